@@ -0,0 +1,570 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from agents.github_monitor import TARGET_REPO
+from utils.spill_store import load_spilled_fields
+from utils.tags import canonicalize_tags, get_tag_canonicalizer
+
+# --- 定数 ---
+# 保存先のデータベース。"sqlite"（ローカル、既定値）または "postgres"（Supabaseなど、DATABASE_URLで接続）
+DB_BACKEND = os.environ.get("DB_BACKEND", "sqlite")
+DB_PATH = os.environ.get("DB_PATH", os.path.join(".cache", "policy_updates.sqlite3"))
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+# SQLiteとPostgresで共通のスキーマ。型だけをバックエンドごとに差し替える
+# PR番号はリポジトリをまたぐと重複するため、PRは (リポジトリ名, 番号) で識別する
+SCHEMA_TEMPLATE = [
+    "CREATE TABLE IF NOT EXISTS pull_requests ("
+    " repo TEXT NOT NULL,"
+    " number BIGINT NOT NULL,"
+    " title TEXT NOT NULL,"
+    " url TEXT NOT NULL,"
+    " author TEXT,"
+    " body TEXT,"
+    " merged_at {timestamp},"
+    " updated_at {timestamp} NOT NULL,"
+    " PRIMARY KEY (repo, number))",
+    "CREATE TABLE IF NOT EXISTS summaries ("
+    " repo TEXT NOT NULL,"
+    " pr_number BIGINT NOT NULL,"
+    " summary TEXT NOT NULL,"
+    " updated_at {timestamp} NOT NULL,"
+    " PRIMARY KEY (repo, pr_number))",
+    "CREATE TABLE IF NOT EXISTS pr_tags ("
+    " repo TEXT NOT NULL,"
+    " pr_number BIGINT NOT NULL,"
+    " tag TEXT NOT NULL,"
+    " PRIMARY KEY (repo, pr_number, tag))",
+    "CREATE TABLE IF NOT EXISTS published_threads ("
+    " thread_hash TEXT PRIMARY KEY,"
+    " target_date TEXT,"
+    " tweets TEXT NOT NULL,"
+    " pr_numbers TEXT NOT NULL,"  # PRのキー（"リポジトリ名#番号"）のJSON配列
+    " published_at {timestamp} NOT NULL)",
+    # トレンド分析用の日次集計。保存したPRのマージ日の分だけを、書き込みと同じトランザクションで再集計する
+    "CREATE TABLE IF NOT EXISTS daily_tag_counts ("
+    " day TEXT NOT NULL,"
+    " tag TEXT NOT NULL,"
+    " pr_count INTEGER NOT NULL,"
+    " PRIMARY KEY (day, tag))",
+    # 正規のタグ -> PRの転置インデックス。(タグ, マージ日) の順に並べて格納し、タグと日付範囲での検索を範囲走査にする
+    "CREATE TABLE IF NOT EXISTS tag_postings ("
+    " tag TEXT NOT NULL,"
+    " day TEXT NOT NULL,"
+    " repo TEXT NOT NULL,"
+    " pr_number BIGINT NOT NULL,"
+    " PRIMARY KEY (tag, day, repo, pr_number)){without_rowid}",
+    "CREATE TABLE IF NOT EXISTS daily_pr_counts ("
+    " day TEXT PRIMARY KEY,"
+    " pr_count INTEGER NOT NULL)",
+    # 主キー (repo, number) に加え、日付範囲とタグでの集計用のインデックス
+    "CREATE INDEX IF NOT EXISTS idx_pull_requests_merged_at ON pull_requests (merged_at)",
+    "CREATE INDEX IF NOT EXISTS idx_pr_tags_tag ON pr_tags (tag, repo, pr_number)",
+    "CREATE INDEX IF NOT EXISTS idx_tag_postings_pr_number ON tag_postings (repo, pr_number)",
+    "CREATE INDEX IF NOT EXISTS idx_published_threads_target_date ON published_threads (target_date)",
+]
+
+UPSERT_PULL_REQUEST_SQL = (
+    "INSERT INTO pull_requests (repo, number, title, url, author, body, merged_at, updated_at)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT (repo, number) DO UPDATE SET title = excluded.title, url = excluded.url, author = excluded.author,"
+    " body = excluded.body, merged_at = excluded.merged_at, updated_at = excluded.updated_at"
+)
+UPSERT_SUMMARY_SQL = (
+    "INSERT INTO summaries (repo, pr_number, summary, updated_at) VALUES (?, ?, ?, ?)"
+    " ON CONFLICT (repo, pr_number) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at"
+)
+DELETE_TAGS_SQL = "DELETE FROM pr_tags WHERE repo = ? AND pr_number = ?"
+INSERT_TAG_SQL = (
+    "INSERT INTO pr_tags (repo, pr_number, tag) VALUES (?, ?, ?) ON CONFLICT (repo, pr_number, tag) DO NOTHING"
+)
+DELETE_POSTINGS_SQL = "DELETE FROM tag_postings WHERE repo = ? AND pr_number = ?"
+INSERT_POSTING_SQL = (
+    "INSERT INTO tag_postings (tag, day, repo, pr_number) VALUES (?, ?, ?, ?)"
+    " ON CONFLICT (tag, day, repo, pr_number) DO NOTHING"
+)
+SELECT_POSTINGS_SQL = (
+    "SELECT repo, pr_number FROM tag_postings WHERE tag = ? AND day >= ? AND day <= ? ORDER BY day, repo, pr_number"
+)
+SELECT_DAY_TAGS_SQL = (
+    "SELECT p.repo, p.number, t.tag FROM pull_requests p"
+    " LEFT JOIN pr_tags t ON t.repo = p.repo AND t.pr_number = p.number"
+    " WHERE p.merged_at >= ? AND p.merged_at < ?"
+)
+DELETE_DAILY_TAG_COUNTS_SQL = "DELETE FROM daily_tag_counts WHERE day = ?"
+DELETE_DAILY_PR_COUNTS_SQL = "DELETE FROM daily_pr_counts WHERE day = ?"
+INSERT_DAILY_TAG_COUNT_SQL = "INSERT INTO daily_tag_counts (day, tag, pr_count) VALUES (?, ?, ?)"
+INSERT_DAILY_PR_COUNT_SQL = "INSERT INTO daily_pr_counts (day, pr_count) VALUES (?, ?)"
+SELECT_DAILY_TAG_COUNTS_SQL = "SELECT day, tag, pr_count FROM daily_tag_counts WHERE day >= ? AND day <= ?"
+SELECT_DAILY_PR_COUNTS_SQL = "SELECT day, pr_count FROM daily_pr_counts WHERE day >= ? AND day <= ?"
+SELECT_SAVED_PULL_REQUEST_SQL = "SELECT 1 FROM pull_requests WHERE repo = ? AND number = ?"
+UPSERT_THREAD_SQL = (
+    "INSERT INTO published_threads (thread_hash, target_date, tweets, pr_numbers, published_at) VALUES (?, ?, ?, ?, ?)"
+    " ON CONFLICT (thread_hash) DO UPDATE SET published_at = excluded.published_at"
+)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _day_of(merged_at) -> str:
+    """マージ日時（ISO 8601文字列、またはPostgresから返るdatetime）から日付 (YYYY-MM-DD) を取り出す。"""
+    return (merged_at if isinstance(merged_at, str) else merged_at.isoformat())[:10]
+
+
+class UpdateStore:
+    """
+    PR・要約・タグ・投稿済みスレッドを保存するストア。
+    1回の実行分の書き込みは、executemanyによる一括のUPSERTとして1つのトランザクションで行う。
+    既定ではローカルのSQLite（WALモード）を使い、DB_BACKEND=postgres の場合はDATABASE_URLのPostgresに接続する。
+    """
+
+    def __init__(self, backend: str = DB_BACKEND, path: str = DB_PATH, dsn: Optional[str] = DATABASE_URL):
+        self.backend = backend
+        self._lock = threading.Lock()
+        if backend == "postgres":
+            # Postgresを使う場合だけ必要なため、ここで初めてインポートする
+            import psycopg
+
+            if not dsn:
+                raise ValueError("DB_BACKEND=postgres の場合は DATABASE_URL を設定してください。")
+            self._conn = psycopg.connect(dsn)
+            self._placeholder = "%s"
+            timestamp_type = "TIMESTAMPTZ"
+            without_rowid = ""
+        elif backend == "sqlite":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            # 書き込み中も読み込みを妨げないよう、WALモードで開く。コミットごとのfsyncはチェックポイント時だけにする
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._placeholder = "?"
+            timestamp_type = "TEXT"
+            # 転置インデックスは主キーの順に格納し、rowidの分だけ小さくする
+            without_rowid = " WITHOUT ROWID"
+        else:
+            raise ValueError(f"未対応のDB_BACKENDです: {backend}")
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            # PRをリポジトリ名なしで保存していた旧スキーマには書き込めないため、接続の時点で知らせる
+            try:
+                cursor.execute("SELECT * FROM pull_requests WHERE 1 = 0")
+                columns = [column[0] for column in cursor.description]
+            except Exception:
+                # テーブルがまだない場合
+                self._conn.rollback()
+                columns = None
+            if columns is not None and "repo" not in columns:
+                raise ValueError("pull_requests テーブルが旧スキーマ（repo列なし）です。"
+                                 "DB_PATHのファイルを削除するか、テーブルを作り直してください。")
+            for statement in SCHEMA_TEMPLATE:
+                cursor.execute(statement.format(timestamp=timestamp_type, without_rowid=without_rowid))
+            self._conn.commit()
+
+    def _sql(self, statement: str) -> str:
+        return statement.replace("?", self._placeholder)
+
+    def save_run(self, pull_requests: List[Dict], summaries: List[Dict]) -> Dict:
+        """
+        1回の実行で取得したPRと、その要約・タグを1つのトランザクションで一括して保存する。
+        同じPRが既に保存されている場合は上書きする（再実行やバックフィルで重複しない）。
+
+        Args:
+            pull_requests (List[Dict]): GitHub監視エージェントが取得したPRのリスト。
+            summaries (List[Dict]): 要約・タグ付けエージェントの結果。"pr_numbers"（と "pr_repos"）に対応するPRの番号を持つ。
+
+        Returns:
+            Dict: 保存した件数と所要時間。失敗した場合は空の辞書。
+        """
+        started = time.perf_counter()
+        now = _now()
+        # 本文はストリーミングモードではスピルストアにあるため、1行ずつ読み込みながら書き込む
+        pr_rows = (
+            (pr.get("repo") or TARGET_REPO, pr["number"], pr["title"], pr["url"], pr.get("author"),
+             load_spilled_fields(pr).get("body"), pr.get("merged_at"), now)
+            for pr in pull_requests
+        )
+        days_by_key = {
+            (pr.get("repo") or TARGET_REPO, pr["number"]): _day_of(pr["merged_at"])
+            for pr in pull_requests if pr.get("merged_at")
+        }
+        summary_rows = []
+        tag_rows = []
+        posting_rows = []
+        for summary in summaries:
+            tags = canonicalize_tags(summary.get("tags") or [])
+            numbers = summary.get("pr_numbers") or []
+            repos = summary.get("pr_repos") or [TARGET_REPO] * len(numbers)
+            # 重複集約した要約は、同一とみなした全てのPRに保存する
+            for repo, number in zip(repos, numbers):
+                summary_rows.append((repo, number, summary["summary"], now))
+                tag_rows.extend((repo, number, tag) for tag in tags)
+                if (repo, number) in days_by_key:
+                    posting_rows.extend((tag, days_by_key[(repo, number)], repo, number) for tag in tags)
+        tagged_keys = [row[:2] for row in summary_rows]
+
+        try:
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.executemany(self._sql(UPSERT_PULL_REQUEST_SQL), pr_rows)
+                cursor.executemany(self._sql(UPSERT_SUMMARY_SQL), summary_rows)
+                # タグは要約し直すと変わるため、要約を保存したPRのタグを置き換える
+                cursor.executemany(self._sql(DELETE_TAGS_SQL), tagged_keys)
+                cursor.executemany(self._sql(INSERT_TAG_SQL), tag_rows)
+                # 転置インデックスも、要約を保存したPRの分だけを差し替える
+                cursor.executemany(self._sql(DELETE_POSTINGS_SQL), tagged_keys)
+                cursor.executemany(self._sql(INSERT_POSTING_SQL), posting_rows)
+                self._refresh_daily_counts(cursor, sorted(set(days_by_key.values())))
+                self._conn.commit()
+        except Exception as e:
+            print(f"エラー: データベースへの保存中にエラーが発生しました: {e}")
+            self._conn.rollback()
+            return {}
+        return {
+            "pull_requests": len(pull_requests),
+            "summaries": len(summary_rows),
+            "tags": len(tag_rows),
+            "elapsed_seconds": time.perf_counter() - started,
+        }
+
+    def _refresh_daily_counts(self, cursor, days: List[str]) -> None:
+        """
+        指定した日の日次集計を作り直す。merged_atのインデックスでその日のPRだけを読むため、
+        コストは履歴全体の量ではなく、その日のPR数にだけ比例する。
+        """
+        for day in days:
+            next_day = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+            cursor.execute(self._sql(SELECT_DAY_TAGS_SQL), (day, next_day))
+            keys = set()
+            tag_counts: Dict[str, int] = {}
+            for repo, number, tag in cursor.fetchall():
+                keys.add((repo, number))
+                if tag is not None:
+                    tag_counts[tag] = tag_counts.get(tag, 0) + 1
+            cursor.execute(self._sql(DELETE_DAILY_TAG_COUNTS_SQL), (day,))
+            cursor.execute(self._sql(DELETE_DAILY_PR_COUNTS_SQL), (day,))
+            cursor.executemany(self._sql(INSERT_DAILY_TAG_COUNT_SQL), [(day, t, c) for t, c in tag_counts.items()])
+            cursor.execute(self._sql(INSERT_DAILY_PR_COUNT_SQL), (day, len(keys)))
+
+    def find_pull_requests_by_tag(self, tag: str, start_day: str = None, end_day: str = None) -> List[Tuple[str, int]]:
+        """
+        タグ（表記の揺れは正規化して検索する）が付いたPRを、マージ日の期間（両端を含む）で絞り込んで返す。
+
+        Returns:
+            List[Tuple[str, int]]: マージ日、リポジトリ名、PR番号の順に並べた (リポジトリ名, PR番号) のリスト。
+        """
+        canonical = canonicalize_tags([tag])
+        if not canonical:
+            return []
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(self._sql(SELECT_POSTINGS_SQL), (canonical[0], start_day or "0000-00-00", end_day or "9999-12-31"))
+            return [(row[0], row[1]) for row in cursor.fetchall()]
+
+    def load_daily_counts(self, start_day: str, end_day: str) -> Tuple[List[Tuple], List[Tuple]]:
+        """
+        期間内（両端を含む）の日次集計を返す。
+
+        Returns:
+            Tuple[List[Tuple], List[Tuple]]: (日付, タグ, PR数) のリストと、(日付, PR数) のリスト。
+        """
+        tag_rows, pr_rows, _ = self.load_trend_snapshot(start_day, end_day, [])
+        return tag_rows, pr_rows
+
+    def load_trend_snapshot(self, start_day: str, end_day: str, keys: List[Tuple[str, int]]) -> Tuple[List, List, set]:
+        """
+        期間内の日次集計と、keys（(リポジトリ名, PR番号)）のうち保存済みのPRを、同じ時点の状態として返す。
+        書き込みと同じロックの中で読むため、日次集計に含まれているPRと、保存済みとして返すPRは一致する。
+
+        Returns:
+            Tuple[List, List, set]: (日付, タグ, PR数) のリスト、(日付, PR数) のリスト、保存済みのPRのキーの集合。
+        """
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(self._sql(SELECT_DAILY_TAG_COUNTS_SQL), (start_day, end_day))
+            tag_rows = cursor.fetchall()
+            cursor.execute(self._sql(SELECT_DAILY_PR_COUNTS_SQL), (start_day, end_day))
+            pr_rows = cursor.fetchall()
+            saved_keys = set()
+            for key in keys:
+                cursor.execute(self._sql(SELECT_SAVED_PULL_REQUEST_SQL), key)
+                if cursor.fetchone():
+                    saved_keys.add(key)
+        return tag_rows, pr_rows, saved_keys
+
+    def save_published_thread(self, target_date: Optional[str], tweets: List[str], pr_keys: List[str]) -> Dict:
+        """
+        投稿したスレッドを保存する。スレッドは本文のハッシュで識別するため、同じスレッドを二重に保存しない。
+        pr_keys には、スレッドで紹介したPRのキー（"リポジトリ名#番号"）を渡す。
+
+        Returns:
+            Dict: スレッドのハッシュ。失敗した場合は空の辞書。
+        """
+        thread_hash = hashlib.sha256("\x1e".join(tweets).encode("utf-8")).hexdigest()
+        try:
+            with self._lock:
+                self._conn.cursor().execute(
+                    self._sql(UPSERT_THREAD_SQL),
+                    (thread_hash, target_date, json.dumps(tweets, ensure_ascii=False), json.dumps(pr_keys), _now()),
+                )
+                self._conn.commit()
+        except Exception as e:
+            print(f"エラー: 投稿済みスレッドの保存中にエラーが発生しました: {e}")
+            self._conn.rollback()
+            return {}
+        return {"thread_hash": thread_hash}
+
+    def count(self, table: str) -> int:
+        """テーブルの行数を返す。"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            return cursor.fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_db_enabled = True
+_default_store: Optional[UpdateStore] = None
+_default_store_lock = threading.Lock()
+# 書き込みはグラフの実行とは別の1本のスレッドで順番に行い、投稿までの処理を待たせない
+_writer: Optional[ThreadPoolExecutor] = None
+_pending_writes: List[Future] = []
+_pending_lock = threading.Lock()
+
+
+def set_db_enabled(enabled: bool) -> None:
+    """データベースへの保存の有効/無効を切り替える（ベンチマークやセルフチェック用）。"""
+    global _db_enabled
+    _db_enabled = enabled
+
+
+def get_update_store() -> Optional[UpdateStore]:
+    """全ノードで共有するストアを返す。無効化されている場合や接続できない場合はNoneを返す。"""
+    global _default_store
+    if not _db_enabled:
+        return None
+    with _default_store_lock:
+        if _default_store is None:
+            try:
+                _default_store = UpdateStore()
+            except Exception as e:
+                print(f"エラー: データベースに接続できませんでした: {e}")
+                return None
+    return _default_store
+
+
+def _submit(function, *args) -> bool:
+    global _writer
+    store = get_update_store()
+    if store is None:
+        return False
+    with _pending_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        _pending_writes.append(_writer.submit(getattr(store, function), *args))
+    return True
+
+
+def save_run_async(pull_requests: List[Dict], summaries: List[Dict]) -> bool:
+    """
+    PRと要約・タグの保存を、バックグラウンドの書き込みスレッドに依頼してすぐに戻る。
+
+    Returns:
+        bool: 保存を依頼できた場合はTrue。保存が無効な場合はFalse。
+    """
+    return _submit("save_run", pull_requests, summaries)
+
+
+def save_published_thread_async(target_date: Optional[str], tweets: List[str], pr_keys: List[str]) -> bool:
+    """投稿したスレッドの保存を、バックグラウンドの書き込みスレッドに依頼してすぐに戻る。"""
+    return _submit("save_published_thread", target_date, tweets, pr_keys)
+
+
+def run_after_pending_writes(function, *args) -> None:
+    """
+    依頼済みの書き込みが全て終わった後に function を実行する。書き込みスレッドがない場合はすぐに実行する。
+    書き込みは1本のスレッドで依頼の順に行うため、書き込みが読むファイルの後片付けに使える。
+    """
+    with _pending_lock:
+        if _writer is not None:
+            _writer.submit(function, *args)
+            return
+    function(*args)
+
+
+def wait_for_pending_writes(timeout: Optional[float] = None) -> List[Dict]:
+    """
+    依頼済みの書き込みが全て完了するまで待ち、それぞれの結果を返す。
+
+    Returns:
+        List[Dict]: 書き込みの結果。失敗した書き込みは空の辞書。
+    """
+    with _pending_lock:
+        pending = list(_pending_writes)
+        _pending_writes.clear()
+    results = []
+    for future in pending:
+        try:
+            results.append(future.result(timeout=timeout))
+        except Exception as e:
+            print(f"エラー: データベースへの書き込みが完了しませんでした: {e}")
+            results.append({})
+    return results
+
+
+def _run_tag_index_benchmark():
+    """
+    100万件のタグの出現（ポスティング）を転置インデックスに格納し、「期間内にタグXが付いたPR」の検索のレイテンシを、
+    保存済みの自由形式のタグを毎回正規化しながら全件走査する方法と比較する。
+    """
+    import random
+    import tempfile
+
+    total_postings = 1_000_000
+    rng = random.Random(0)
+    tags = [f"分野{i}" for i in range(60)]
+    fullwidth = str.maketrans("0123456789", "０１２３４５６７８９")
+    # LLMが返しうる表記の揺れ（"#"・前後の空白・全角数字）
+    variants = {tag: [tag, f"#{tag}", f" {tag} ", tag.translate(fullwidth)] for tag in tags}
+    start = datetime(2016, 1, 1)
+    raw_postings = []
+    number = 0
+    while len(raw_postings) < total_postings:
+        number += 1
+        day = (start + timedelta(days=number * 3650 // (total_postings // 2))).strftime("%Y-%m-%d")
+        for tag in rng.sample(tags, 2):
+            raw_postings.append((rng.choice(variants[tag]), day, number))
+    raw_postings = raw_postings[:total_postings]
+
+    path = os.path.join(tempfile.mkdtemp(), "tags.sqlite3")
+    store = UpdateStore(backend="sqlite", path=path)
+    started = time.perf_counter()
+    canonical_rows = [(canonicalize_tags([tag])[0], day, TARGET_REPO, n) for tag, day, n in raw_postings]
+    with store._lock:
+        store._conn.executemany(INSERT_POSTING_SQL, canonical_rows)
+        store._conn.commit()
+        store._conn.execute("VACUUM")
+    load_seconds = time.perf_counter() - started
+
+    def measure(label, query, queries):
+        latencies = []
+        for tag, start_day, end_day in queries:
+            started = time.perf_counter()
+            query(tag, start_day, end_day)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000
+        print(f"{label}: p50 {p50:.2f}ms, p95 {p95:.2f}ms ({len(queries)}回)")
+
+    def random_query(days):
+        first = start + timedelta(days=rng.randrange(0, 3650 - days))
+        return (rng.choice(variants[rng.choice(tags)]), first.strftime("%Y-%m-%d"),
+                (first + timedelta(days=days - 1)).strftime("%Y-%m-%d"))
+
+    def full_scan(tag, start_day, end_day):
+        # 比較用: 保存済みのタグを正規化しながら全件を調べる
+        canonical = canonicalize_tags([tag])[0]
+        canonicalizer = get_tag_canonicalizer()
+        return [n for t, day, n in raw_postings if start_day <= day <= end_day and canonicalizer.canonicalize(t) == canonical]
+
+    print("\n--- タグ転置インデックス ベンチマーク結果 ---")
+    print(f"ポスティング数: {store.count('tag_postings'):,}件, タグ{len(tags)}種類, 期間10年, "
+          f"ファイルサイズ: {os.path.getsize(path) / 1024 / 1024:.1f}MB "
+          f"({os.path.getsize(path) / total_postings:.0f}バイト/件), 構築 {load_seconds:.1f}秒")
+    measure("転置インデックス 期間30日", store.find_pull_requests_by_tag, [random_query(30) for _ in range(500)])
+    measure("転置インデックス 期間365日", store.find_pull_requests_by_tag, [random_query(365) for _ in range(500)])
+    measure("(比較) 全件走査 期間30日", full_scan, [random_query(30) for _ in range(3)])
+    store.close()
+
+
+def _run_benchmark():
+    """
+    10万件のPR（要約・タグ付き）を書き込み、1件ごとにコミットする場合と、1トランザクションでの一括UPSERTの
+    スループットを比較する。1件ごとのコミットは時間がかかるため、一部の件数で計測する。
+    """
+    import random
+    import tempfile
+
+    total_rows = 100_000
+    per_row_sample = 2_000
+    batch_size = 5_000
+    rng = random.Random(0)
+    tags = ["教育", "科学技術", "経済", "医療", "子育て", "行政改革", "エネルギー", "デジタル"]
+    pull_requests = [
+        {"number": n, "title": f"政策提案 {n}", "url": f"https://github.com/team-mirai/policy/pull/{n}",
+         "author": f"user{n % 500}", "body": "### 政策概要\n" + "変更点の説明です。" * 20,
+         "merged_at": f"2025-{1 + n % 12:02d}-{1 + n % 28:02d}T{n % 24:02d}:00:00+00:00"}
+        for n in range(1, total_rows + 1)
+    ]
+    summaries = [
+        {"summary": f"政策提案 {pr['number']} の要約です。", "tags": rng.sample(tags, 2), "pr_numbers": [pr["number"]]}
+        for pr in pull_requests
+    ]
+    work_dir = tempfile.mkdtemp()
+    results = []
+
+    for journal_mode in ("DELETE", "WAL"):
+        store = UpdateStore(backend="sqlite", path=os.path.join(work_dir, f"per-row-{journal_mode}.sqlite3"))
+        if journal_mode == "DELETE":
+            store._conn.execute("PRAGMA journal_mode=DELETE")
+            store._conn.execute("PRAGMA synchronous=FULL")
+        started = time.perf_counter()
+        for pr, summary in zip(pull_requests[:per_row_sample], summaries[:per_row_sample]):
+            store.save_run([pr], [summary])
+        elapsed = time.perf_counter() - started
+        results.append((f"1件ごとにコミット ({journal_mode})", per_row_sample, elapsed))
+        store.close()
+
+    store = UpdateStore(backend="sqlite", path=os.path.join(work_dir, "bulk.sqlite3"))
+    started = time.perf_counter()
+    for i in range(0, total_rows, batch_size):
+        # バックフィルなどで、1回の実行で書き込む件数の上限に近い単位
+        assert store.save_run(pull_requests[i:i + batch_size], summaries[i:i + batch_size])
+    elapsed = time.perf_counter() - started
+    results.append((f"一括UPSERT ({batch_size}件/トランザクション, WAL)", total_rows, elapsed))
+    assert store.count("pull_requests") == total_rows and store.count("pr_tags") == total_rows * 2
+
+    # 同じ内容をもう一度書き込んでも行は増えない（UPSERT）
+    started = time.perf_counter()
+    store.save_run(pull_requests[:batch_size], summaries[:batch_size])
+    upsert_elapsed = time.perf_counter() - started
+    assert store.count("pull_requests") == total_rows and store.count("pr_tags") == total_rows * 2
+    store.close()
+
+    print("\n--- DB書き込みベンチマーク結果 ---")
+    print(f"1件 = PR1行 + 要約1行 + タグ2行, 合計 {total_rows}件")
+    for label, rows, seconds in results:
+        print(f"{label}: {rows / seconds:,.0f}件/秒 ({rows}件, {seconds:.2f}秒)")
+    print(f"既存の{batch_size}件の再書き込み（UPSERT）: {upsert_elapsed:.2f}秒, 行数は変化なし")
+
+
+if __name__ == '__main__':
+    if "--benchmark-tags" in sys.argv:
+        _run_tag_index_benchmark()
+        sys.exit(0)
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+
+    print("--- DB保存エージェント テスト実行 ---")
+    store = UpdateStore()
+    sample_pull_requests = [
+        {"number": 6505, "title": "博士課程の学生に対する政策を大幅に拡充", "url": "https://github.com/team-mirai/policy/pull/6505",
+         "author": "sample", "body": "### 政策概要", "merged_at": "2025-07-16T09:00:00+00:00"},
+    ]
+    sample_summaries = [{"summary": "博士課程の学生への支援を拡充します。", "tags": ["科学技術"], "pr_numbers": [6505]}]
+    print(store.save_run(sample_pull_requests, sample_summaries))
@@ -0,0 +1,203 @@
+import os
+import re
+import sys
+import time
+import zlib
+import unicodedata
+from typing import Iterable, Optional
+
+import numpy as np
+
+from utils.spill_store import pull_request_body
+
+# --- 定数 ---
+# 推定Jaccard類似度がこの値以上のPRを、ほぼ同一の更新とみなす
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.8"))
+# 文字n-gram（シングル）の長さ。日本語は単語区切りがないため文字単位で扱う
+SHINGLE_SIZE = 3
+# MinHashの署名長。LSHでは BANDS x ROWS_PER_BAND に分割する
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+
+# ハッシュ関数族 h(x) = (a * x + b) mod p。32bitのシングルハッシュに対してuint64で桁あふれしない範囲の係数を使う
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(seed=20250719)
+_HASH_A = _rng.integers(1, (1 << 31) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_HASH_B = _rng.integers(0, (1 << 31) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def _normalize(text: str) -> str:
+    """全角/半角の揺れ・大文字小文字・空白の違いを吸収する。"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """
+    テキストの文字n-gramからMinHash署名を計算する。
+
+    Returns:
+        np.ndarray: 長さNUM_PERMUTATIONSのuint64配列。
+    """
+    text = _normalize(text)
+    if len(text) < SHINGLE_SIZE:
+        text = text.ljust(SHINGLE_SIZE)
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    hashes %= _MERSENNE_PRIME
+    # (署名長, シングル数) の行列でまとめて計算し、各ハッシュ関数の最小値を取る
+    permuted = (_HASH_A[:, None] * hashes[None, :] + _HASH_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+def _pull_request_text(pr: dict) -> str:
+    # ストリーミングモードのPRは本文を持たないため、スピルストアから読み込む
+    return f"{pr.get('title', '')}\n{pull_request_body(pr)}"
+
+
+def find_near_duplicate_clusters(
+    texts: Iterable[str], threshold: float = DEDUP_THRESHOLD, count: Optional[int] = None
+) -> list[list[int]]:
+    """
+    MinHash + LSH（バンド分割）で候補ペアを絞り込み、推定Jaccard類似度がthreshold以上のテキストをクラスタにまとめる。
+    テキストは1件ずつ署名にするだけなので、ジェネレーターで渡せば全テキストを同時にメモリに持たない。
+
+    Args:
+        texts (Iterable[str]): クラスタにまとめるテキスト。
+        threshold (float): ほぼ同一とみなす推定Jaccard類似度のしきい値。
+        count (int, optional): テキストの件数。指定した場合は署名の配列を最初に確保し、一時的なリストを作らない。
+
+    Returns:
+        list[list[int]]: 入力のインデックスのクラスタのリスト。クラスタは最初のメンバーの出現順に並ぶ。
+    """
+    if count is None:
+        texts = list(texts)
+        count = len(texts)
+    if not count:
+        return []
+    signatures = np.empty((count, NUM_PERMUTATIONS), dtype=np.uint64)
+    for index, text in enumerate(texts):
+        signatures[index] = minhash_signature(text)
+
+    parent = list(range(count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # 同じバンドのハッシュ値が一致したものだけを候補ペアとして比較する
+    for band in range(BANDS):
+        buckets = {}
+        band_rows = signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        for index, row in enumerate(band_rows):
+            buckets.setdefault(row.tobytes(), []).append(index)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                root_first, root_other = find(first), find(other)
+                if root_first == root_other:
+                    continue
+                similarity = float(np.mean(signatures[first] == signatures[other]))
+                if similarity >= threshold:
+                    parent[max(root_first, root_other)] = min(root_first, root_other)
+
+    clusters = {}
+    for index in range(count):
+        clusters.setdefault(find(index), []).append(index)
+    return sorted(clusters.values(), key=lambda members: members[0])
+
+
+def collapse_near_duplicates(pull_requests: list[dict], threshold: float = DEDUP_THRESHOLD) -> tuple[list[dict], dict]:
+    """
+    タイトル+本文がほぼ同一のPRをクラスタにまとめ、クラスタごとに代表PRを1件だけ返す。
+    代表PRには、同じクラスタの他のPRの番号とURLを "duplicates" として付与する。
+    LLMは使わず、ローカルの計算だけで完結する。
+
+    Args:
+        pull_requests (list[dict]): GitHub監視エージェントが返したPRのリスト。
+        threshold (float): ほぼ同一とみなす推定Jaccard類似度のしきい値。
+
+    Returns:
+        tuple[list[dict], dict]: 代表PRのリストと、削減できたLLM呼び出し数などの統計情報。
+    """
+    # 代表PRを選ぶために本文の長さだけを残し、テキストは署名にしたら捨てる
+    text_lengths = []
+
+    def texts():
+        for pr in pull_requests:
+            text = _pull_request_text(pr)
+            text_lengths.append(len(text))
+            yield text
+
+    clusters = find_near_duplicate_clusters(texts(), threshold, count=len(pull_requests))
+
+    representatives = []
+    for members in clusters:
+        # 最も情報量の多い（本文が長い）PRを代表とする
+        representative_index = max(members, key=text_lengths.__getitem__)
+        representative = dict(pull_requests[representative_index])
+        representative["duplicates"] = [
+            {"number": pull_requests[i]["number"], "url": pull_requests[i]["url"], "repo": pull_requests[i].get("repo")}
+            for i in members if i != representative_index
+        ]
+        representatives.append(representative)
+
+    stats = {
+        "input_count": len(pull_requests),
+        "cluster_count": len(representatives),
+        "llm_calls_saved": len(pull_requests) - len(representatives),
+    }
+    return representatives, stats
+
+
+def _run_benchmark():
+    """ほぼ同一の編集を多数含む5000件の合成PRで、クラスタリングの速度と削減できるLLM呼び出し数を計測する。"""
+    import random
+
+    rng = random.Random(0)
+    phrases = [
+        "支援制度の対象を拡大します。", "財源の考え方を見直します。", "実施体制を明確にします。", "地方自治体と連携します。",
+        "デジタル化を推進します。", "子育て世帯の負担を軽減します。", "研究者の処遇を改善します。", "医療の提供体制を強化します。",
+        "不登校の児童生徒を支援します。", "エネルギー政策を転換します。", "行政手続きを簡素化します。", "防災対策を強化します。",
+    ]
+    topics = [f"第{i}章の政策について。" + "".join(rng.sample(phrases, 6)) for i in range(500)]
+    pull_requests = []
+    for n in range(5000):
+        topic = topics[n % len(topics)]
+        # 同じ箇所への軽微な表記揺れを加える
+        body = topic.replace("明確に", "明確化") if n % 3 == 0 else topic
+        pull_requests.append({
+            "number": n, "title": f"政策提案 {n % len(topics)}", "body": body,
+            "url": f"https://github.com/team-mirai/policy/pull/{n}",
+        })
+
+    started = time.perf_counter()
+    representatives, stats = collapse_near_duplicates(pull_requests)
+    elapsed = time.perf_counter() - started
+
+    print("\n--- 重複PR集約ベンチマーク結果 ---")
+    print(f"PR数: {stats['input_count']}, クラスタ数: {stats['cluster_count']}, "
+          f"削減できたLLM呼び出し: {stats['llm_calls_saved']}回, 所要時間: {elapsed:.2f}秒")
+
+
+if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+
+    print("--- 重複PR集約 テスト実行 ---")
+    sample_pull_requests = [
+        {"number": 1, "title": "教育の項目を修正", "body": "### 政策概要\n* 不登校の児童生徒への学習支援を明確にします。",
+         "url": "https://github.com/team-mirai/policy/pull/1"},
+        {"number": 2, "title": "教育の項目を修正", "body": "### 政策概要\n* 不登校の児童生徒への学習支援を明確にします",
+         "url": "https://github.com/team-mirai/policy/pull/2"},
+        {"number": 3, "title": "博士課程の支援を拡充", "body": "### 政策概要\n* 博士課程の学生を研究者として位置づけます。",
+         "url": "https://github.com/team-mirai/policy/pull/3"},
+    ]
+    representatives, stats = collapse_near_duplicates(sample_pull_requests)
+    for pr in representatives:
+        print(f"PR #{pr['number']}: {pr['title']} (同一とみなしたPR: {[d['number'] for d in pr['duplicates']]})")
+    print(f"削減できたLLM呼び出し: {stats['llm_calls_saved']}回")
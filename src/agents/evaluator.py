@@ -1,11 +1,10 @@
 
-import os
-import json
-import google.generativeai as genai
+import sys
+import time
 from typing import List
 
-# --- 定数 ---
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+from utils.llm_cache import get_llm_cache, make_cache_key, set_cache_enabled
+from utils.llm_gateway import MODEL_NAME, get_gateway
 
 # --- プロンプトテンプレート ---
 PROMPT_TEMPLATE = """
@@ -27,53 +26,141 @@ PROMPT_TEMPLATE = """
 ```
 {tweets_text}
 ```
-
+{focus_instruction}
 # 出力形式 (Output Format):
 評価結果を、必ず以下のキーを持つJSON形式で出力してください。
 - `"evaluation"`: 評価結果。問題なければ `"Approved"`、人間の再確認が必要であれば `"Needs Review"` のいずれか。
 - `"reason"`: 判断理由を簡潔に記述してください。
+- `"tweets"`: ツイートごとの評価の配列。各要素は `"index"`（ツイートの番号、1始まり）、`"evaluation"`、`"reason"` を持ちます。
 
 {{
   "evaluation": "...",
-  "reason": "..."
+  "reason": "...",
+  "tweets": [
+    {{"index": 1, "evaluation": "...", "reason": "..."}}
+  ]
 }}
 """
 
-def evaluate_tweets(tweets: List[str]) -> dict:
+# 一部のツイートだけを再評価する場合に、プロンプトに追加する指示
+FOCUS_INSTRUCTION_TEMPLATE = """
+# 評価対象 (Focus):
+ツイート{indices_text}以外は承認済みです。承認済みのツイートは流れや一貫性を確認するための文脈としてのみ参照し、
+ツイート{indices_text}だけを評価してください。"tweets"にも、ツイート{indices_text}の評価だけを含めてください。
+"""
+
+# レスポンスのスキーマ
+EVALUATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "evaluation": {"type": "string", "enum": ["Approved", "Needs Review"]},
+        "reason": {"type": "string"},
+        "tweets": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "evaluation": {"type": "string", "enum": ["Approved", "Needs Review"]},
+                    "reason": {"type": "string"},
+                },
+                "required": ["index", "evaluation", "reason"],
+            },
+        },
+    },
+    "required": ["evaluation", "reason"],
+}
+
+def _normalize_tweet_verdicts(result: dict, indices: List[int]) -> List[dict]:
+    """
+    LLMのレスポンスからツイートごとの評価を取り出す。
+    欠落しているツイートは、全体の評価結果と同じとみなす。
+    """
+    verdicts = {}
+    for verdict in result.get("tweets") or []:
+        if isinstance(verdict, dict) and verdict.get("index") in indices and verdict.get("evaluation"):
+            verdicts[verdict["index"]] = {
+                "index": verdict["index"],
+                "evaluation": verdict["evaluation"],
+                "reason": verdict.get("reason", ""),
+            }
+    for index in indices:
+        verdicts.setdefault(index, {"index": index, "evaluation": result["evaluation"], "reason": result["reason"]})
+    return [verdicts[index] for index in indices]
+
+def merge_tweet_verdicts(previous_verdicts: List[dict], new_verdicts: List[dict]) -> dict:
+    """
+    前回の評価結果に、一部のツイートを再評価した結果を反映し、全体の評価結果を組み立て直す。
+
+    Returns:
+        dict: "evaluation"・"reason"・"tweet_verdicts" を持つ辞書。
+    """
+    verdicts = {v["index"]: v for v in previous_verdicts}
+    verdicts.update({v["index"]: v for v in new_verdicts})
+    merged = [verdicts[index] for index in sorted(verdicts)]
+    rejected = [v for v in merged if v["evaluation"] != "Approved"]
+    if rejected:
+        reason = " / ".join(f"ツイート{v['index']}: {v['reason']}" for v in rejected)
+        return {"evaluation": "Needs Review", "reason": reason, "tweet_verdicts": merged}
+    return {"evaluation": "Approved", "reason": "全てのツイートが承認されました。", "tweet_verdicts": merged}
+
+def evaluate_tweets(tweets: List[str], target_indices: List[int] = None, model=None) -> dict:
     """
     生成されたツイートのリストをLLMが評価する。
 
     Args:
         tweets (List[str]): 評価対象のツイート文字列のリスト。
+        target_indices (List[int], optional): 評価するツイートの番号（1始まり）。
+                                              指定した場合、それ以外のツイートは承認済みの文脈として扱う。
+        model (optional): 使用するモデル。指定しない場合は共有のGeminiモデルを使う。
 
     Returns:
-        dict: "evaluation"と"reason"のキーを持つ辞書。失敗時は空の辞書を返す。
+        dict: "evaluation"と"reason"、およびツイートごとの評価 "tweet_verdicts" のキーを持つ辞書。
+              target_indicesを指定した場合、"tweet_verdicts"には指定したツイートの評価だけが含まれる。
+              失敗時は空の辞書を返す。
     """
-    if not GEMINI_API_KEY:
-        print("エラー: 環境変数 GEMINI_API_KEY が設定されていません。")
-        return {}
-    
     if not tweets:
         print("情報: 評価対象のツイートがありません。")
         return {}
 
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        #model = genai.GenerativeModel('gemini-pro')
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    # ツイートリストを整形してプロンプトに埋め込む
+    tweets_text = "\n".join([f"--- ツイート{i+1} ---\n{t}" for i, t in enumerate(tweets)])
+    indices = sorted(target_indices) if target_indices else list(range(1, len(tweets) + 1))
+    focus_instruction = ""
+    if target_indices:
+        focus_instruction = FOCUS_INSTRUCTION_TEMPLATE.format(indices_text="・".join(str(i) for i in indices))
+
+    cache = get_llm_cache()
+    cache_key = make_cache_key("evaluator", PROMPT_TEMPLATE, MODEL_NAME, tweets_text, focus_instruction)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"  - キャッシュから評価結果を取得しました: {cached['evaluation']}")
+            return cached
+
+    gateway = get_gateway(model)
+    if gateway is None:
+        return {}
 
-        # ツイートリストを整形してプロンプトに埋め込む
-        tweets_text = "\n".join([f"--- ツイート{i+1} ---\n{t}" for i, t in enumerate(tweets)])
-        prompt = PROMPT_TEMPLATE.format(tweets_text=tweets_text)
+    try:
+        prompt = PROMPT_TEMPLATE.format(tweets_text=tweets_text, focus_instruction=focus_instruction)
 
-        print("LLMにツイート内容の評価をリクエストしています...")
-        response = model.generate_content(prompt)
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-        result = json.loads(cleaned_response)
+        if target_indices:
+            print(f"LLMにツイート{indices}の再評価をリクエストしています...")
+        else:
+            print("LLMにツイート内容の評価をリクエストしています...")
+        result = gateway.generate_json(prompt, EVALUATION_SCHEMA)
 
         if "evaluation" in result and "reason" in result:
+            result = {
+                "evaluation": result["evaluation"],
+                "reason": result["reason"],
+                "tweet_verdicts": _normalize_tweet_verdicts(result, indices),
+            }
             print(f"  - 評価成功: {result['evaluation']}")
             print(f"評価: {result['evaluation']}")
+            if cache is not None:
+                cache.set(cache_key, result)
             return result
         else:
             print("エラー: LLMのレスポンスに必要なキーが含まれていません。")
@@ -83,7 +170,58 @@ def evaluate_tweets(tweets: List[str]) -> dict:
         print(f"LLMとの通信中にエラーが発生しました: {e}")
         return {}
 
+def _run_benchmark():
+    """
+    2ツイート目だけが差し戻される台本どおりの偽モデルで、スレッド全体の再生成と
+    差し戻されたツイートだけの修正とを比較し、削減できるトークン数と秒数を計測する。
+    """
+    from agents.tweet_generator import generate_tweets, repair_tweet
+    from utils.fake_llm import FakeGenerativeModel, ScriptedResponder
+
+    set_cache_enabled(False)
+
+    headline = "【本日の政策更新】\n・博士課程学生の経済支援を拡充\n・不登校の児童生徒への学習支援を明確化\n博士課程学生の支援について、次のツイートで詳しく解説します。(1/2)"
+    deep_dive = "【注目】博士課程の学生を「研究者」として位置づけ、生活費を賄える水準まで支援を引き上げます。(2/2)"
+
+    responder = ScriptedResponder(tweets=[headline, deep_dive], repaired_tweet=deep_dive)
+
+    summaries = [
+        {"summary": f"政策{i}の変更点と、その変更がもたらす影響についての要約です。" * 2, "tags": ["教育"]}
+        for i in range(20)
+    ]
+    rejected = {"evaluation": "Needs Review", "reason": "ツイート2: 背景の説明が不足しています",
+                "tweet_verdicts": [{"index": 1, "evaluation": "Approved", "reason": "問題ありません。"},
+                                   {"index": 2, "evaluation": "Needs Review", "reason": "背景の説明が不足しています"}]}
+
+    # 入力トークン数と出力トークン数に比例して遅くなる偽モデル
+    full_model = FakeGenerativeModel(responder=responder, latency=0.05, latency_per_token=0.0001, latency_per_output_token=0.002)
+    started = time.perf_counter()
+    tweets = generate_tweets(summaries, use_cache=False, model=full_model)
+    result = evaluate_tweets(tweets, model=full_model)
+    full_seconds = time.perf_counter() - started
+    assert result["evaluation"] == "Approved"
+
+    repair_model = FakeGenerativeModel(responder=responder, latency=0.05, latency_per_token=0.0001, latency_per_output_token=0.002)
+    started = time.perf_counter()
+    repaired = list(tweets)
+    repaired[1] = repair_tweet(summaries, tweets, 2, "背景の説明が不足しています", model=repair_model)
+    partial = evaluate_tweets(repaired, target_indices=[2], model=repair_model)
+    result = merge_tweet_verdicts(rejected["tweet_verdicts"], partial["tweet_verdicts"])
+    repair_seconds = time.perf_counter() - started
+    assert result["evaluation"] == "Approved"
+
+    print("\n--- 差し戻し時の再生成コスト比較 ---")
+    full_tokens = full_model.prompt_tokens + full_model.completion_tokens
+    repair_tokens = repair_model.prompt_tokens + repair_model.completion_tokens
+    print(f"スレッド全体を再生成: {full_seconds:.2f}秒, 入力 {full_model.prompt_tokens} / 出力 {full_model.completion_tokens}トークン")
+    print(f"差し戻されたツイートだけを修正: {repair_seconds:.2f}秒, 入力 {repair_model.prompt_tokens} / 出力 {repair_model.completion_tokens}トークン")
+    print(f"削減: {full_seconds - repair_seconds:.2f}秒, {full_tokens - repair_tokens}トークン")
+
 if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+
     print("--- 評価エージェント テスト実行 ---")
 
     # サンプルデータ（tweet_generatorが生成したツイート案）
@@ -0,0 +1,263 @@
+import os
+import re
+import sys
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from agents.github_monitor import TARGET_REPO, WATERMARK_PATH, _is_newer_than_watermark, load_watermark
+
+# --- 定数 ---
+# ベアミラーの保存先ディレクトリ
+MIRROR_DIR = os.environ.get("GIT_MIRROR_DIR", os.path.join(".cache", "mirrors"))
+# 差分を計算するワーカープロセス数
+GIT_DIFF_WORKERS = int(os.environ.get("GIT_DIFF_WORKERS", "4"))
+
+# GitHubのマージコミットのメッセージ形式 (例: "Merge pull request #6505 from team-mirai/branch")
+MERGE_MESSAGE_PATTERN = re.compile(r"^Merge pull request #(\d+) from (\S+)")
+FIELD_SEPARATOR = "\x1f"
+RECORD_SEPARATOR = "\x1e"
+
+
+def _run_git(args: list, cwd: str = None) -> str:
+    """gitコマンドを実行し、標準出力を返す。失敗時はCalledProcessErrorを送出する。"""
+    result = subprocess.run(
+        ["git", "-c", "core.quotepath=false", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+    return result.stdout
+
+
+def sync_mirror(repo_url: str, mirror_path: str) -> None:
+    """
+    ベアミラーを作成する。既に存在する場合は、差分だけをgit fetchで取り込む。
+
+    Args:
+        repo_url (str): ミラー元のリポジトリURL（ローカルパスも可）。
+        mirror_path (str): ベアミラーの保存先。
+    """
+    if os.path.exists(os.path.join(mirror_path, "HEAD")):
+        print(f"  - ミラーを更新しています: {mirror_path}")
+        _run_git(["fetch", "--prune", "--quiet", "origin"], cwd=mirror_path)
+    else:
+        print(f"  - ミラーを作成しています: {repo_url} -> {mirror_path}")
+        os.makedirs(os.path.dirname(mirror_path) or ".", exist_ok=True)
+        _run_git(["clone", "--mirror", "--quiet", repo_url, mirror_path])
+
+
+def list_merge_commits(mirror_path: str, since: datetime, until: datetime = None) -> list[dict]:
+    """
+    デフォルトブランチ上で、指定期間にコミットされたPRのマージコミットを取得する。
+
+    Returns:
+        list[dict]: "sha", "parents", "author", "merged_at", "message" を持つ辞書のリスト（古い順）。
+    """
+    args = [
+        "log", "--merges", "--first-parent", "--reverse",
+        f"--since={since.isoformat()}",
+        f"--format=%H{FIELD_SEPARATOR}%P{FIELD_SEPARATOR}%an{FIELD_SEPARATOR}%cI{FIELD_SEPARATOR}%B{RECORD_SEPARATOR}",
+    ]
+    if until:
+        args.append(f"--until={until.isoformat()}")
+    args.append("HEAD")
+
+    commits = []
+    for record in _run_git(args, cwd=mirror_path).split(RECORD_SEPARATOR):
+        record = record.strip("\n")
+        if not record:
+            continue
+        sha, parents, author, committed_at, message = record.split(FIELD_SEPARATOR, 4)
+        merged_at = datetime.fromisoformat(committed_at).astimezone(timezone.utc)
+        # --since/--untilは境界を含むため、翌日0時ちょうどのコミットは除外する
+        if until and merged_at >= until:
+            continue
+        commits.append({
+            "sha": sha,
+            "parents": parents.split(),
+            "author": author,
+            "merged_at": merged_at,
+            "message": message,
+        })
+    return commits
+
+
+def _compute_pull_request_diff(args: tuple) -> dict:
+    """
+    ワーカープロセスで、マージコミットと第1親の差分（変更ファイルと統合差分）を計算する。
+    """
+    mirror_path, base_sha, merge_sha = args
+    files = []
+    for line in _run_git(["diff", "--numstat", base_sha, merge_sha], cwd=mirror_path).splitlines():
+        additions, deletions, filename = line.split("\t", 2)
+        # バイナリファイルは行数が "-" になる
+        files.append({
+            "filename": filename,
+            "additions": int(additions) if additions.isdigit() else 0,
+            "deletions": int(deletions) if deletions.isdigit() else 0,
+        })
+    diff = _run_git(["diff", base_sha, merge_sha], cwd=mirror_path)
+    return {"files": files, "diff": diff}
+
+
+def fetch_merged_pull_requests_from_mirror(
+    repo_name: str = TARGET_REPO,
+    target_date_str: str = None,
+    mirror_dir: str = MIRROR_DIR,
+    repo_url: str = None,
+    max_workers: int = GIT_DIFF_WORKERS,
+    watermark_path: str = WATERMARK_PATH,
+) -> list[dict]:
+    """
+    ローカルのベアミラーから、マージされたPRとその変更ファイル・統合差分を取得する。
+    ミラーの更新はgit fetchの差分だけで済み、PRごとのAPI呼び出しは発生しない。
+
+    Args:
+        repo_name (str): 対象リポジトリ名 (例: "owner/repo")
+        target_date_str (str, optional): 取得対象の日付文字列 (例: "2025-07-19")。
+                                         指定しない場合、ハイウォーターマーク（初回は過去24時間）以降のPRを取得する。
+        mirror_dir (str): ベアミラーを置くディレクトリ。
+        repo_url (str, optional): ミラー元のURL。省略時はGitHubの公開URLを使う。
+        max_workers (int): 差分を計算するワーカープロセス数。
+        watermark_path (str): 日付を指定しない場合に参照するハイウォーターマークの保存先。
+
+    Returns:
+        list[dict]: fetch_recent_merged_pull_requests と同じ形式に、"additions"・"deletions"・"files"・"diff" を加えたPRのリスト。
+                    取得失敗時は空のリストを返す。
+    """
+    repo_url = repo_url or f"https://github.com/{repo_name}.git"
+    mirror_path = os.path.join(mirror_dir, repo_name.replace("/", "__") + ".git")
+
+    watermark = None
+    if target_date_str:
+        try:
+            since = datetime.strptime(target_date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        except ValueError:
+            print(f"エラー: 無効な日付形式です。YYYY-MM-DD形式で指定してください: {target_date_str}")
+            return []
+        until = since + timedelta(days=1)
+    else:
+        watermark = load_watermark(watermark_path)
+        if watermark.get("last_merged_at"):
+            since = datetime.fromisoformat(watermark["last_merged_at"].replace("Z", "+00:00"))
+        else:
+            since = datetime.now(timezone.utc) - timedelta(days=1)
+        until = None
+
+    try:
+        sync_mirror(repo_url, mirror_path)
+        commits = list_merge_commits(mirror_path, since, until)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"gitコマンドの実行中にエラーが発生しました: {e}")
+        return []
+
+    pull_requests = []
+    diff_jobs = []
+    for commit in commits:
+        subject, _, rest = commit["message"].partition("\n")
+        match = MERGE_MESSAGE_PATTERN.match(subject)
+        if not match:
+            continue
+        # GitHubのマージコミットは、空行の後の1行目がPRタイトルになっている
+        title, _, body = rest.strip("\n").partition("\n")
+        number = int(match.group(1))
+        pull_requests.append({
+            "number": number,
+            "title": title.strip() or subject,
+            "body": body.strip(),
+            "url": f"https://github.com/{repo_name}/pull/{number}",
+            "merged_at": commit["merged_at"].isoformat(),
+            "author": commit["author"],
+            "repo": repo_name,
+        })
+        diff_jobs.append((mirror_path, commit["parents"][0], commit["sha"]))
+
+    if watermark is not None:
+        keep = [_is_newer_than_watermark(pr, watermark) for pr in pull_requests]
+        pull_requests = [pr for pr, k in zip(pull_requests, keep) if k]
+        diff_jobs = [job for job, k in zip(diff_jobs, keep) if k]
+
+    if diff_jobs:
+        print(f"  - {len(diff_jobs)}件のPRの差分を最大{max_workers}プロセスで計算しています...")
+        try:
+            with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(diff_jobs)))) as executor:
+                for pr, diff in zip(pull_requests, executor.map(_compute_pull_request_diff, diff_jobs)):
+                    pr.update(diff)
+                    pr["additions"] = sum(f["additions"] for f in diff["files"])
+                    pr["deletions"] = sum(f["deletions"] for f in diff["files"])
+        except (subprocess.CalledProcessError, OSError) as e:
+            print(f"差分の計算中にエラーが発生しました: {e}")
+            return []
+
+    for pr in pull_requests:
+        print(f"  - 発見: PR #{pr['number']} {pr['title']} (Merged: {pr['merged_at']}, 変更ファイル: {len(pr['files'])}件)")
+    print(f"{len(pull_requests)}件のマージ済みPull Requestが見つかりました。")
+    return pull_requests
+
+
+def _run_self_check():
+    """
+    使い捨てのローカルリポジトリに合成したマージコミットを作り、ミラー経由で取得できることを確認する。
+    """
+    import tempfile
+
+    work_dir = tempfile.mkdtemp()
+    upstream = os.path.join(work_dir, "upstream")
+    os.makedirs(upstream)
+
+    def git(*args, date=None):
+        env = dict(os.environ, GIT_AUTHOR_NAME="takahiroanno", GIT_AUTHOR_EMAIL="a@example.com",
+                   GIT_COMMITTER_NAME="takahiroanno", GIT_COMMITTER_EMAIL="a@example.com")
+        if date:
+            env["GIT_AUTHOR_DATE"] = env["GIT_COMMITTER_DATE"] = date
+        subprocess.run(["git", *args], cwd=upstream, check=True, capture_output=True, env=env)
+
+    def write(filename, text):
+        with open(os.path.join(upstream, filename), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    git("init", "--quiet", "--initial-branch=main")
+    write("33_ステップ３科学技術.md", "### 政策概要\n* 既存の政策\n")
+    git("add", ".")
+    git("commit", "--quiet", "-m", "initial", date="2025-07-15T00:00:00Z")
+
+    merges = [
+        (6505, "33_ステップ３科学技術.md", "博士課程の学生に対する政策を大幅に拡充", "2025-07-16T10:34:15Z"),
+        (6506, "21_教育.md", "不登校の児童生徒への学習支援を明確化", "2025-07-16T12:00:00Z"),
+        (6507, "21_教育.md", "翌日のPR", "2025-07-17T01:00:00Z"),
+    ]
+    for number, filename, title, date in merges:
+        git("checkout", "--quiet", "-b", f"patch-{number}")
+        write(filename, f"### 政策概要\n* {title}\n")
+        git("add", ".")
+        git("commit", "--quiet", "-m", title, date=date)
+        git("checkout", "--quiet", "main")
+        git("merge", "--quiet", "--no-ff", f"patch-{number}", "-m",
+            f"Merge pull request #{number} from team-mirai/patch-{number}\n\n{title}", date=date)
+
+    mirror_dir = os.path.join(work_dir, "mirrors")
+    prs = fetch_merged_pull_requests_from_mirror("team-mirai/policy", "2025-07-16", mirror_dir, repo_url=upstream)
+    assert [pr["number"] for pr in prs] == [6505, 6506], [pr["number"] for pr in prs]
+    assert prs[0]["title"] == "博士課程の学生に対する政策を大幅に拡充"
+    assert prs[0]["files"][0]["filename"] == "33_ステップ３科学技術.md"
+    assert "+* 博士課程の学生に対する政策を大幅に拡充" in prs[0]["diff"]
+
+    # 2回目はgit fetchによる差分更新となる
+    prs = fetch_merged_pull_requests_from_mirror("team-mirai/policy", "2025-07-17", mirror_dir, repo_url=upstream)
+    assert [pr["number"] for pr in prs] == [6507]
+    print("\n--- セルフチェック成功: ローカルミラーからPRと差分を取得しました ---")
+
+
+if __name__ == '__main__':
+    if "--self-check" in sys.argv:
+        _run_self_check()
+        sys.exit(0)
+
+    print("--- Gitミラー取得 テスト実行 ---")
+    target_date = sys.argv[1] if len(sys.argv) > 1 else None
+    for pr_data in fetch_merged_pull_requests_from_mirror(target_date_str=target_date):
+        print(f"PR #{pr_data['number']}: {pr_data['title']} ({len(pr_data['files'])}ファイル)")
@@ -1,18 +1,65 @@
 import os
+import sys
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from github import Github, GithubException
+
+from utils.cassette import active_cassette, remember
+from utils.metrics import track_request
+from utils.rate_limiter import GITHUB_RATE_LIMITER
 
 # --- 定数 ---
 GITHUB_TOKEN = os.environ.get("GITHUB_API_TOKEN")
 TARGET_REPO = "team-mirai/policy"
+# 監視するリポジトリ（カンマ区切り、例: "team-mirai/policy,team-mirai/manifest"）。省略時は政策リポジトリだけを監視する
+TARGET_REPOS = [r.strip() for r in os.environ.get("GITHUB_TARGET_REPOS", TARGET_REPO).split(",") if r.strip()]
+# Search APIが受け付けるクエリの長さの上限。repo: 修飾子は、この長さに収まる範囲で1つのクエリにまとめる
+SEARCH_QUERY_MAX_LENGTH = 256
+# 分割した検索クエリを並行して実行する数（リクエストの間隔は共有のレートリミッターで調整する）
+GITHUB_SHARD_WORKERS = int(os.environ.get("GITHUB_SHARD_WORKERS", "4"))
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+# 前回までに処理したPRの位置（ハイウォーターマーク）の保存先
+WATERMARK_PATH = os.environ.get("GITHUB_WATERMARK_PATH", os.path.join(".cache", "github_watermark.json"))
+# 検索クエリの起点をハイウォーターマークに合わせ直すまでの日数
+WATERMARK_REANCHOR_DAYS = int(os.environ.get("GITHUB_WATERMARK_REANCHOR_DAYS", "7"))
+# "graphql" を指定すると、PRの一覧・変更ファイル・差分行数をGraphQL APIでまとめて取得する
+GITHUB_FETCH_BACKEND = os.environ.get("GITHUB_FETCH_BACKEND", "rest")
+
+# 1ページで最大100件のPRと、その変更ファイルをまとめて取得するGraphQLクエリ
+MERGED_PULL_REQUESTS_QUERY = """
+query($searchQuery: String!, $cursor: String) {
+  search(query: $searchQuery, type: ISSUE, first: 100, after: $cursor) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      ... on PullRequest {
+        number
+        title
+        body
+        url
+        mergedAt
+        author { login }
+        additions
+        deletions
+        changedFiles
+        files(first: 100) { nodes { path additions deletions } }
+      }
+    }
+  }
+}
+"""
 
-def fetch_recent_merged_pull_requests(repo_name: str = TARGET_REPO, target_date_str: str = None) -> list[dict]:
+def fetch_recent_merged_pull_requests(repo_names: list[str] = None, target_date_str: str = None) -> list[dict]:
     """
     指定されたGitHubリポジトリから、過去24時間以内、または指定された日付にマージされたPull Requestを取得する。
     GitHub Search APIを使用して効率的にフィルタリングを行う。
+    複数のリポジトリは、クエリ長の上限に収まる範囲で1つのクエリにまとめ、分割したクエリを並行して実行する。
 
     Args:
-        repo_name (str): 対象リポジリ名 (例: "owner/repo")
+        repo_names (list[str], optional): 対象リポジトリ名のリスト (例: ["owner/repo"])。省略時は TARGET_REPOS。
         target_date_str (str, optional): 取得対象の日付文字列 (例: "2025-07-19").
                                          指定しない場合、過去24時間以内のPRを取得する。
 
@@ -20,14 +67,17 @@ def fetch_recent_merged_pull_requests(repo_name: str = TARGET_REPO, target_date_
         list[dict]: マージされたPRの情報のリスト。各PRは辞書形式。
                      取得失敗時は空のリストを返す。
     """
-    if not GITHUB_TOKEN:
+    token = _github_token()
+    if not token:
         print("エラー: 環境変数 GITHUB_API_TOKEN が設定されていません。")
         return []
 
-    try:
-        g = Github(GITHUB_TOKEN)
+    # PyGithubは読み込みに時間がかかるため、このバックエンドを使う場合にだけインポートする
+    from github import Github, GithubException
 
-        base_query = f"is:pr is:merged repo:{repo_name}"
+    try:
+        _install_cassette_connections()
+        g = Github(token)
 
         if target_date_str:
             try:
@@ -47,12 +97,21 @@ def fetch_recent_merged_pull_requests(repo_name: str = TARGET_REPO, target_date_
             date_query = f"merged:>{query_since}" # 24時間前から現在まで
             print(f"  - 過去24時間以内のPRを検索します (UTC: {query_since} から現在まで)")
 
-        full_query = f"{base_query} {date_query}"
-        print(f"  - GitHub Search APIでクエリを実行中: {full_query}")
+        def search(shard: list[str]) -> list:
+            full_query = build_search_query(shard, date_query)
+            print(f"  - GitHub Search APIでクエリを実行中: {full_query}")
+            # Search APIはIssueとPRを返すため、is:prでフィルタリング
+            # 検索結果はIssueオブジェクトとして返される
+            # カセットの再生中はGitHubにリクエストを送らないため、レートリミッターを使わない
+            cassette = active_cassette()
+            if cassette is None or not cassette.replaying:
+                GITHUB_RATE_LIMITER.acquire()
+            with track_request("github", api="search"):
+                # 検索結果はページ単位で遅延取得されるため、ここで全件を取得して所要時間を計測する
+                return list(g.search_issues(query=full_query))
 
-        # Search APIはIssueとPRを返すため、is:prでフィルタリング
-        # 検索結果はIssueオブジェクトとして返される
-        issues_and_prs = g.search_issues(query=full_query)
+        shards = shard_repositories(repo_names or TARGET_REPOS, date_query)
+        issues_and_prs = [item for items in _run_shards(search, shards) for item in items]
         
         print("  - 検索結果のフィルタリングとデータ抽出を開始します...")
 
@@ -72,7 +131,8 @@ def fetch_recent_merged_pull_requests(repo_name: str = TARGET_REPO, target_date_
                         "body": item.body if item.body else "", # bodyがNoneの場合があるため空文字列に
                         "url": item.html_url,
                         "merged_at": pr.merged_at.isoformat(),
-                        "author": item.user.login
+                        "author": item.user.login,
+                        "repo": _repo_from_html_url(item.html_url),
                     })
         
         print(f"{len(merged_prs)}件のマージ済みPull Requestが見つかりました。")
@@ -90,7 +150,675 @@ def fetch_recent_merged_pull_requests(repo_name: str = TARGET_REPO, target_date_
         print(f"予期せぬエラーが発生しました: {e}")
         return []
 
+def _parse_github_datetime(value: str) -> datetime:
+    """GitHub APIの日時文字列 (例: "2025-07-19T10:00:00Z") をdatetimeに変換する。"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def _format_github_datetime(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _repo_from_html_url(url: str) -> str:
+    """PRのURL (例: "https://github.com/owner/repo/pull/1") からリポジトリ名 ("owner/repo") を取り出す。"""
+    return "/".join(urllib.parse.urlsplit(url).path.strip("/").split("/")[:2])
+
+def pull_request_key(pr: dict) -> str:
+    """リポジトリをまたいで一意なPRのキー (例: "team-mirai/policy#123")。"""
+    return f"{pr.get('repo') or TARGET_REPO}#{pr['number']}"
+
+def build_search_query(repo_names: list[str], qualifiers: str) -> str:
+    """マージ済みPRの検索クエリを組み立てる。同じクエリ内の複数の repo: 修飾子はOR条件として扱われる。"""
+    return " ".join(["is:pr is:merged", *(f"repo:{repo_name}" for repo_name in repo_names), qualifiers])
+
+def shard_repositories(repo_names: list[str], qualifiers: str, max_length: int = SEARCH_QUERY_MAX_LENGTH) -> list[list[str]]:
+    """
+    リポジトリを、検索クエリが max_length 文字に収まる範囲でできるだけ少ないグループに分ける。
+
+    Args:
+        repo_names (list[str]): 対象リポジトリ名のリスト。
+        qualifiers (str): repo: 以外の修飾子 (例: "merged:>=2025-07-19T00:00:00Z")。長さの計算に使う。
+        max_length (int): 1つのクエリの長さの上限。
+
+    Returns:
+        list[list[str]]: クエリごとのリポジトリ名のリスト。1つで上限を超えるリポジトリは単独のクエリにする。
+    """
+    shards = []
+    current = []
+    for repo_name in dict.fromkeys(repo_names):
+        if current and len(build_search_query(current + [repo_name], qualifiers)) > max_length:
+            shards.append(current)
+            current = []
+        current.append(repo_name)
+    if current:
+        shards.append(current)
+    return shards
+
+def _run_shards(fetch_shard, shards: list, max_workers: int = None) -> list:
+    """
+    分割したクエリを並行して実行し、結果をクエリの順序で返す。いずれかのクエリが失敗した場合は例外を送出する。
+    リクエストの間隔は共有のレートリミッターで調整するため、並行数を増やしてもレートリミットは超えない。
+    """
+    if len(shards) <= 1:
+        return [fetch_shard(shard) for shard in shards]
+    max_workers = max_workers or GITHUB_SHARD_WORKERS
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shards)))) as executor:
+        return list(executor.map(fetch_shard, shards))
+
+def _github_token(token: str = None) -> str:
+    """使用するGitHub APIトークン。カセットの再生中はGitHubにリクエストを送らないため、トークンがなくてもよい。"""
+    token = token or GITHUB_TOKEN
+    cassette = active_cassette()
+    if not token and cassette is not None and cassette.replaying:
+        return "replay"
+    return token
+
+def _urlopen_live(request: urllib.request.Request) -> tuple:
+    """GitHub APIにリクエストを送り、(ステータスコード, レスポンスヘッダーの辞書, ボディ) を返す。4xx・5xxも例外にせず返す。"""
+    GITHUB_RATE_LIMITER.acquire()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+def _urlopen(request: urllib.request.Request) -> tuple:
+    """
+    GitHub APIにリクエストを送る。カセットの記録中はやり取りを記録し、再生中はGitHubに送らずに記録したレスポンスを返す。
+    4xx・5xx（304を除く）は urllib.error.HTTPError を送出する。
+    """
+    cassette = active_cassette()
+    if cassette is None:
+        status, headers, body = _urlopen_live(request)
+    else:
+        status, headers, body = cassette.http(request.get_method(), request.full_url, request.data,
+                                              lambda: _urlopen_live(request))
+    if status >= 400:
+        raise urllib.error.HTTPError(request.full_url, status, body.decode("utf-8", errors="replace")[:200],
+                                     headers, None)
+    return status, headers, body
+
+def _install_cassette_connections() -> None:
+    """
+    カセットの記録中・再生中は、PyGithubのHTTPリクエストもカセットを通す。
+    PyGithubが差し替えのために用意している接続クラスを、カセットを通すものに置き換える。
+    """
+    from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass, Requester
+
+    cassette = active_cassette()
+    if cassette is None:
+        Requester.resetConnectionClasses()
+        return
+
+    class CassetteResponse:
+        # PyGithubが使う、httplibのレスポンスと同じ属性だけを持つ
+        def __init__(self, status: int, headers: dict, body: bytes):
+            self.status = status
+            self.headers = headers
+            self.body = body.decode("utf-8", errors="replace")
+
+        def getheaders(self):
+            return self.headers.items()
+
+        def read(self) -> str:
+            return self.body
+
+    def connection_class(base):
+        class CassetteConnection(base):
+            def getresponse(self):
+                url = f"{self.protocol}://{self.host}:{self.port}{self.url}"
+
+                def perform() -> tuple:
+                    GITHUB_RATE_LIMITER.acquire()
+                    response = base.getresponse(self)
+                    return response.status, dict(response.headers), response.read().encode("utf-8")
+
+                return CassetteResponse(*cassette.http(self.verb, url, self.input, perform))
+
+        return CassetteConnection
+
+    Requester.injectConnectionClasses(connection_class(HTTPRequestsConnectionClass),
+                                      connection_class(HTTPSRequestsConnectionClass))
+
+def _github_get(url: str, token: str, headers: dict = None) -> tuple:
+    """
+    GitHub REST APIにGETリクエストを送る。
+
+    Returns:
+        tuple: (ステータスコード, レスポンスヘッダーの辞書, JSONボディ)。304の場合、ボディはNone。
+    """
+    request_headers = {
+        "Accept": "application/vnd.github+json",
+        "Authorization": f"Bearer {token}",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
+    request_headers.update(headers or {})
+    request = urllib.request.Request(url, headers=request_headers)
+    with track_request("github", api="rest"):
+        try:
+            status, response_headers, body = _urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, dict(e.headers), None
+            raise
+        if status == 304:
+            return 304, response_headers, None
+        return status, response_headers, json.loads(body.decode("utf-8"))
+
+def _github_graphql(query: str, variables: dict, token: str, api_url: str = GITHUB_API_URL) -> dict:
+    """
+    GitHub GraphQL APIにクエリを送り、"data"部分を返す。エラーが含まれる場合はValueErrorを送出する。
+    """
+    request = urllib.request.Request(
+        f"{api_url}/graphql",
+        data=json.dumps({"query": query, "variables": variables}).encode("utf-8"),
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        method="POST",
+    )
+    with track_request("github", api="graphql"):
+        _, _, body = _urlopen(request)
+    result = json.loads(body.decode("utf-8"))
+    if result.get("errors"):
+        raise ValueError(f"GraphQLエラー: {result['errors']}")
+    return result["data"]
+
+def _next_page_url(link_header: str) -> str:
+    """Linkヘッダーから次ページのURLを取り出す。存在しない場合はNoneを返す。"""
+    for part in (link_header or "").split(","):
+        url_part, _, rel_part = part.partition(";")
+        if 'rel="next"' in rel_part:
+            return url_part.strip().strip("<>")
+    return None
+
+def _pull_request_from_search_item(item: dict) -> dict:
+    """Search APIの検索結果1件を、GitHub監視エージェントが返すPRの辞書形式に変換する。"""
+    pull_request = item.get("pull_request") or {}
+    merged_at = pull_request.get("merged_at") or item.get("closed_at")
+    return {
+        "number": item["number"],
+        "title": item["title"],
+        "body": item.get("body") or "", # bodyがNoneの場合があるため空文字列に
+        "url": item["html_url"],
+        "merged_at": _parse_github_datetime(merged_at).isoformat(),
+        "author": (item.get("user") or {}).get("login", ""),
+        "repo": _repo_from_html_url(item["html_url"]),
+    }
+
+def pull_request_from_webhook_payload(payload: dict, repo_names: list[str] = None) -> dict:
+    """
+    GitHubの pull_request Webhookのペイロードを、GitHub監視エージェントが返すPRの辞書形式に変換する。
+    対象リポジトリ（省略時は TARGET_REPOS）のPRがマージされたイベント（action が "closed" かつ merged が true）以外はNoneを返す。
+    """
+    pull_request = payload.get("pull_request") or {}
+    if payload.get("action") != "closed" or not pull_request.get("merged"):
+        return None
+    repo_name = (payload.get("repository") or {}).get("full_name")
+    if repo_name not in (repo_names or TARGET_REPOS):
+        return None
+    return {
+        "number": pull_request["number"],
+        "title": pull_request["title"],
+        "body": pull_request.get("body") or "", # bodyがNoneの場合があるため空文字列に
+        "url": pull_request["html_url"],
+        "merged_at": _parse_github_datetime(pull_request["merged_at"]).isoformat(),
+        "author": (pull_request.get("user") or {}).get("login", ""),
+        "repo": repo_name,
+    }
+
+def _read_watermark(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"last_merged_at": None, "seen_keys": [], "queries": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def load_watermark(path: str = WATERMARK_PATH) -> dict:
+    """
+    保存されたハイウォーターマークを読み込む。存在しない場合は空の状態を返す。
+    カセットには実行開始時の状態を記録し、再生中はファイルの代わりにその状態を返す。
+    """
+    return remember(f"watermark:{os.path.abspath(path)}", lambda: _read_watermark(path))
+
+def save_watermark(watermark: dict, path: str = WATERMARK_PATH) -> None:
+    cassette = active_cassette()
+    if cassette is not None and cassette.replaying:
+        # 再生は記録した実行の再現なので、実際のハイウォーターマークは進めない
+        return
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(watermark, f, ensure_ascii=False, indent=2)
+
+def _is_newer_than_watermark(pr: dict, watermark: dict) -> bool:
+    if not watermark.get("last_merged_at"):
+        return True
+    merged_at = _parse_github_datetime(pr["merged_at"])
+    last_merged_at = _parse_github_datetime(watermark["last_merged_at"])
+    if merged_at > last_merged_at:
+        return True
+    # 同時刻にマージされたPRは、処理済みのPRでなければ新しいものとみなす
+    return merged_at == last_merged_at and pull_request_key(pr) not in _seen_keys(watermark)
+
+def _seen_keys(watermark: dict) -> set:
+    """処理済みのPRのキー。PR番号だけを保存していた旧形式は、政策リポジトリのPRとして読む。"""
+    keys = set(watermark.get("seen_keys", []))
+    keys.update(f"{TARGET_REPO}#{number}" for number in watermark.get("seen_numbers", []))
+    return keys
+
+def advance_watermark(pull_requests: list[dict], path: str = WATERMARK_PATH) -> None:
+    """
+    処理が完了したPRまでハイウォーターマークを進める。
+    最新のmerged_atと、その時刻にマージされた処理済みPRのキー（リポジトリ名#番号）を保存する。
+
+    Args:
+        pull_requests (list[dict]): 処理が完了したPRのリスト。
+        path (str): ハイウォーターマークの保存先。
+    """
+    if not pull_requests:
+        return
+    watermark = load_watermark(path)
+    candidates = [_parse_github_datetime(pr["merged_at"]) for pr in pull_requests]
+    if watermark.get("last_merged_at"):
+        candidates.append(_parse_github_datetime(watermark["last_merged_at"]))
+    last_merged_at = max(candidates)
+
+    seen_keys = {pull_request_key(pr) for pr in pull_requests if _parse_github_datetime(pr["merged_at"]) == last_merged_at}
+    if watermark.get("last_merged_at") and _parse_github_datetime(watermark["last_merged_at"]) == last_merged_at:
+        seen_keys.update(_seen_keys(watermark))
+
+    watermark["last_merged_at"] = _format_github_datetime(last_merged_at)
+    watermark["seen_keys"] = sorted(seen_keys)
+    watermark.pop("seen_numbers", None)
+    save_watermark(watermark, path)
+    print(f"  - ハイウォーターマークを更新しました: {watermark['last_merged_at']}")
+
+def fetch_new_merged_pull_requests(
+    repo_names: list[str] = None,
+    watermark_path: str = WATERMARK_PATH,
+    api_url: str = GITHUB_API_URL,
+    token: str = None,
+) -> list[dict]:
+    """
+    前回のハイウォーターマーク以降にマージされたPull Requestだけを取得する。
+    前回と同じ検索クエリをETag/If-Modified-Sinceつきの条件付きリクエストで送るため、
+    更新がない場合は304となり、Search APIの利用枠を消費しない。
+    複数のリポジトリは、クエリ長の上限に収まる範囲で1つのクエリにまとめ、分割したクエリを並行して実行する。
+
+    Args:
+        repo_names (list[str], optional): 対象リポジトリ名のリスト (例: ["owner/repo"])。省略時は TARGET_REPOS。
+        watermark_path (str): ハイウォーターマークの保存先。
+        api_url (str): GitHub APIのベースURL。
+        token (str, optional): GitHub APIトークン。省略時は環境変数の値を使う。
+
+    Returns:
+        list[dict]: 新しくマージされたPRの情報のリスト。取得失敗時は空のリストを返す。
+                    一部のクエリだけが失敗した場合も、そのリポジトリのPRを取りこぼさないよう空のリストを返す。
+    """
+    token = _github_token(token)
+    if not token:
+        print("エラー: 環境変数 GITHUB_API_TOKEN が設定されていません。")
+        return []
+
+    watermark = load_watermark(watermark_path)
+    queries = watermark.get("queries") or {}
+    if watermark.get("query"):
+        # 1つのリポジトリだけを監視していた旧形式の状態は、政策リポジトリのクエリとして引き継ぐ
+        queries.setdefault(TARGET_REPO, watermark.pop("query"))
+    last_merged_at = watermark.get("last_merged_at")
+
+    def fetch_shard(shard: list[str]) -> tuple:
+        query_state = queries.get(",".join(shard)) or {}
+        # 検索の起点は、前回のクエリを再利用できる限り変えない（条件付きリクエストを効かせるため）
+        anchor = query_state.get("since")
+        if last_merged_at and (
+            not anchor
+            or _parse_github_datetime(last_merged_at) - _parse_github_datetime(anchor) > timedelta(days=WATERMARK_REANCHOR_DAYS)
+        ):
+            anchor = last_merged_at
+        if not anchor:
+            anchor = _format_github_datetime(datetime.now(timezone.utc) - timedelta(days=1))
+
+        full_query = build_search_query(shard, f"merged:>={anchor}")
+        if query_state.get("q") != full_query:
+            query_state = {"q": full_query, "since": anchor}
+
+        headers = {}
+        if query_state.get("etag"):
+            headers["If-None-Match"] = query_state["etag"]
+        if query_state.get("last_modified"):
+            headers["If-Modified-Since"] = query_state["last_modified"]
+
+        print(f"  - GitHub Search APIで差分クエリを実行中: {full_query}")
+        url = f"{api_url}/search/issues?" + urllib.parse.urlencode({"q": full_query, "per_page": 100})
+        status, response_headers, data = _github_get(url, token, headers)
+
+        if status == 304:
+            print(f"  - 前回から検索結果に変更はありません (304 Not Modified): {', '.join(shard)}")
+            return query_state, query_state.get("pull_requests", [])
+        candidates = [_pull_request_from_search_item(item) for item in data.get("items", [])]
+        next_url = _next_page_url(response_headers.get("Link"))
+        while next_url:
+            _, page_headers, page = _github_get(next_url, token)
+            candidates.extend(_pull_request_from_search_item(item) for item in page.get("items", []))
+            next_url = _next_page_url(page_headers.get("Link"))
+        query_state["etag"] = response_headers.get("ETag")
+        query_state["last_modified"] = response_headers.get("Last-Modified")
+        query_state["pull_requests"] = candidates
+        return query_state, candidates
+
+    # 起点の日時は常に同じ長さの形式のため、現在時刻で長さを見積もってクエリを分割する
+    shards = shard_repositories(repo_names or TARGET_REPOS, f"merged:>={_format_github_datetime(datetime.now(timezone.utc))}")
+    try:
+        results = _run_shards(fetch_shard, shards)
+    except (urllib.error.URLError, ValueError, KeyError) as e:
+        print(f"GitHub APIエラーが発生しました: {e}")
+        return []
+
+    # 設定から外れたリポジトリのクエリの状態は破棄する
+    watermark["queries"] = {",".join(shard): query_state for shard, (query_state, _) in zip(shards, results)}
+    save_watermark(watermark, watermark_path)
+
+    candidates = [pr for _, shard_candidates in results for pr in shard_candidates]
+    merged_prs = [pr for pr in candidates if _is_newer_than_watermark(pr, watermark)]
+    merged_prs.sort(key=lambda pr: (pr["merged_at"], pr.get("repo") or "", pr["number"]))
+    for pr in merged_prs:
+        print(f"  - 発見: {pr.get('repo') or TARGET_REPO} PR #{pr['number']} {pr['title']} (Merged: {pr['merged_at']})")
+    print(f"{len(merged_prs)}件の新しいマージ済みPull Requestが見つかりました。")
+    return merged_prs
+
+def _pull_request_from_graphql_node(node: dict) -> dict:
+    """GraphQLのPullRequestノードを、GitHub監視エージェントが返すPRの辞書形式に変換する。"""
+    return {
+        "number": node["number"],
+        "title": node["title"],
+        "body": node.get("body") or "",
+        "url": node["url"],
+        "merged_at": _parse_github_datetime(node["mergedAt"]).isoformat(),
+        "author": (node.get("author") or {}).get("login", ""), # 退会済みユーザーはauthorがnullになる
+        "repo": _repo_from_html_url(node["url"]),
+        "additions": node.get("additions", 0),
+        "deletions": node.get("deletions", 0),
+        "files": [
+            {"filename": f["path"], "additions": f["additions"], "deletions": f["deletions"]}
+            for f in ((node.get("files") or {}).get("nodes") or [])
+        ],
+    }
+
+def fetch_merged_pull_requests_graphql(
+    repo_names: list[str] = None,
+    target_date_str: str = None,
+    api_url: str = GITHUB_API_URL,
+    token: str = None,
+    watermark_path: str = WATERMARK_PATH,
+) -> list[dict]:
+    """
+    GraphQL APIの1つのページングクエリで、マージされたPRの番号・タイトル・本文・マージ日時・作成者・
+    変更ファイル一覧・追加/削除行数をまとめて取得する。PRごとの追加のRESTリクエストは発生しない。
+    複数のリポジトリは、クエリ長の上限に収まる範囲で1つのクエリにまとめ、分割したクエリを並行して実行する。
+
+    Args:
+        repo_names (list[str], optional): 対象リポジトリ名のリスト (例: ["owner/repo"])。省略時は TARGET_REPOS。
+        target_date_str (str, optional): 取得対象の日付文字列 (例: "2025-07-19")。
+                                         指定しない場合、ハイウォーターマーク（初回は過去24時間）以降のPRを取得する。
+        api_url (str): GitHub APIのベースURL。
+        token (str, optional): GitHub APIトークン。省略時は環境変数の値を使う。
+        watermark_path (str): 日付を指定しない場合に参照するハイウォーターマークの保存先。
+
+    Returns:
+        list[dict]: fetch_recent_merged_pull_requests と同じ形式に、"additions"・"deletions"・"files" を加えたPRのリスト。
+                    取得失敗時は空のリストを返す。
+    """
+    token = _github_token(token)
+    if not token:
+        print("エラー: 環境変数 GITHUB_API_TOKEN が設定されていません。")
+        return []
+
+    watermark = None
+    if target_date_str:
+        try:
+            target_date = datetime.strptime(target_date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        except ValueError:
+            print(f"エラー: 無効な日付形式です。YYYY-MM-DD形式で指定してください: {target_date_str}")
+            return []
+        date_query = f"merged:{_format_github_datetime(target_date)}..{_format_github_datetime(target_date + timedelta(days=1))}"
+    else:
+        watermark = load_watermark(watermark_path)
+        since = watermark.get("last_merged_at") or _format_github_datetime(datetime.now(timezone.utc) - timedelta(days=1))
+        date_query = f"merged:>={since}"
+
+    def fetch_shard(shard: list[str]) -> list[dict]:
+        search_query = build_search_query(shard, date_query)
+        print(f"  - GitHub GraphQL APIでクエリを実行中: {search_query}")
+        shard_prs = []
+        cursor = None
+        while True:
+            data = _github_graphql(MERGED_PULL_REQUESTS_QUERY, {"searchQuery": search_query, "cursor": cursor}, token, api_url)
+            search = data["search"]
+            for node in search["nodes"]:
+                # PullRequest以外のノードは空の辞書として返される
+                if node and node.get("mergedAt"):
+                    shard_prs.append(_pull_request_from_graphql_node(node))
+            if not search["pageInfo"]["hasNextPage"]:
+                return shard_prs
+            cursor = search["pageInfo"]["endCursor"]
+
+    try:
+        results = _run_shards(fetch_shard, shard_repositories(repo_names or TARGET_REPOS, date_query))
+    except (urllib.error.URLError, ValueError, KeyError) as e:
+        print(f"GitHub APIエラーが発生しました: {e}")
+        return []
+    merged_prs = [pr for shard_prs in results for pr in shard_prs]
+
+    if watermark is not None:
+        merged_prs = [pr for pr in merged_prs if _is_newer_than_watermark(pr, watermark)]
+    merged_prs.sort(key=lambda pr: (pr["merged_at"], pr["repo"], pr["number"]))
+    for pr in merged_prs:
+        print(f"  - 発見: {pr['repo']} PR #{pr['number']} {pr['title']} (Merged: {pr['merged_at']}, 変更ファイル: {len(pr['files'])}件)")
+    print(f"{len(merged_prs)}件のマージ済みPull Requestが見つかりました。")
+    return merged_prs
+
+def _run_graphql_self_check():
+    """
+    記録済みのGraphQLレスポンスを返すローカルサーバーに対して取得を実行し、
+    150件のPRが2回のリクエスト（1ページ100件）だけで取得できることを確認する。
+    """
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    recorded_nodes = [
+        {"number": n, "title": f"PR {n}", "body": f"本文{n}", "url": f"https://github.com/o/r/pull/{n}",
+         "mergedAt": "2025-07-19T%02d:%02d:00Z" % (n // 60, n % 60), "author": {"login": "alice"},
+         "additions": n, "deletions": 1, "changedFiles": 1,
+         "files": {"nodes": [{"path": f"{n:02d}_政策.md", "additions": n, "deletions": 1}]}}
+        for n in range(1, 151)
+    ]
+    requests = []
+
+    class RecordedGraphQLHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            requests.append(payload)
+            start = int(payload["variables"]["cursor"] or 0)
+            page = recorded_nodes[start:start + 100]
+            has_next = start + 100 < len(recorded_nodes)
+            body = json.dumps({"data": {"search": {
+                "pageInfo": {"hasNextPage": has_next, "endCursor": str(start + 100) if has_next else None},
+                "nodes": page,
+            }}}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordedGraphQLHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        prs = fetch_merged_pull_requests_graphql(
+            ["o/r"], "2025-07-19", api_url, token="dummy", watermark_path=os.path.join(tempfile.mkdtemp(), "w.json")
+        )
+    finally:
+        server.shutdown()
+
+    assert len(prs) == 150, len(prs)
+    assert len(requests) == 2, f"リクエスト数が想定と異なります: {len(requests)}"
+    assert set(prs[0]) >= {"number", "title", "body", "url", "merged_at", "author", "files"}
+    print(f"\n--- GraphQLセルフチェック成功: PR {len(prs)}件をリクエスト {len(requests)}回で取得 ---")
+
+def _run_self_check():
+    """
+    ローカルの偽GitHubサーバーに対して差分取得を実行し、
+    変更がない実行では課金対象の検索リクエスト（304以外）が発生しないことを確認する。
+    """
+    import hashlib
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    search_items = [
+        {"number": 1, "title": "PR 1", "body": "本文1", "html_url": "https://github.com/o/r/pull/1",
+         "pull_request": {"merged_at": "2025-07-19T01:00:00Z"}, "user": {"login": "alice"}},
+        {"number": 2, "title": "PR 2", "body": None, "html_url": "https://github.com/o/r/pull/2",
+         "pull_request": {"merged_at": "2025-07-19T02:00:00Z"}, "user": {"login": "bob"}},
+    ]
+    calls = {"billable": 0, "not_modified": 0}
+
+    class FakeGitHubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({"total_count": len(search_items), "items": search_items}).encode("utf-8")
+            etag = '"' + hashlib.sha256(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                calls["not_modified"] += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            calls["billable"] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+    watermark_path = os.path.join(tempfile.mkdtemp(), "watermark.json")
+    try:
+        first = fetch_new_merged_pull_requests(["o/r"], watermark_path, api_url, token="dummy")
+        assert [pr["number"] for pr in first] == [1, 2]
+        advance_watermark(first, watermark_path)
+
+        billable_before = calls["billable"]
+        second = fetch_new_merged_pull_requests(["o/r"], watermark_path, api_url, token="dummy")
+        assert second == [] and calls["billable"] == billable_before, calls
+
+        search_items.append(
+            {"number": 3, "title": "PR 3", "body": "本文3", "html_url": "https://github.com/o/r/pull/3",
+             "pull_request": {"merged_at": "2025-07-20T00:00:00Z"}, "user": {"login": "carol"}}
+        )
+        third = fetch_new_merged_pull_requests(["o/r"], watermark_path, api_url, token="dummy")
+        assert [pr["number"] for pr in third] == [3]
+    finally:
+        server.shutdown()
+
+    print(f"\n--- セルフチェック成功: 課金対象リクエスト {calls['billable']}回, 304応答 {calls['not_modified']}回 ---")
+
+def _run_benchmark():
+    """
+    20個の偽リポジトリを持つ偽GitHubサーバーに対して、リポジトリごとに1クエリずつ検索する場合と、
+    repo: 修飾子をまとめて分割したクエリを逐次・並行に実行する場合の所要時間とリクエスト数を比較する。
+    """
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from utils.rate_limiter import TokenBucket
+
+    global GITHUB_RATE_LIMITER, GITHUB_SHARD_WORKERS
+    repo_count = 20
+    pull_requests_per_repo = 5
+    latency = 0.15
+    repo_names = [f"team-mirai/policy-area-{i:02d}" for i in range(repo_count)]
+    requests = []
+
+    class FakeSearchHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)["q"][0]
+            requests.append(query)
+            time.sleep(latency)
+            repos = [term[len("repo:"):] for term in query.split() if term.startswith("repo:")]
+            items = [
+                {"number": n, "title": f"{repo} の変更 {n}", "body": "本文",
+                 "html_url": f"https://github.com/{repo}/pull/{n}",
+                 "pull_request": {"merged_at": f"2099-01-01T00:{n:02d}:00Z"}, "user": {"login": "alice"}}
+                for repo in repos for n in range(1, pull_requests_per_repo + 1)
+            ]
+            body = json.dumps({"total_count": len(items), "items": items}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+    work_dir = tempfile.mkdtemp()
+
+    def per_repo() -> list[dict]:
+        return [pr for repo_name in repo_names
+                for pr in fetch_new_merged_pull_requests([repo_name], os.path.join(work_dir, f"{repo_name.replace('/', '_')}.json"),
+                                                          api_url, token="dummy")]
+
+    def sharded() -> list[dict]:
+        return fetch_new_merged_pull_requests(repo_names, os.path.join(work_dir, f"sharded-{GITHUB_SHARD_WORKERS}.json"),
+                                              api_url, token="dummy")
+
+    results = []
+    original_stdout = sys.stdout
+    try:
+        for label, fetch, workers in (("リポジトリごとに1クエリ（逐次）", per_repo, 1),
+                                      ("分割したクエリ（逐次）", sharded, 1),
+                                      ("分割したクエリ（並行）", sharded, 4)):
+            # Search APIの30回/分の枠を60倍に縮めた時間で再現する（バーストなし）
+            GITHUB_RATE_LIMITER = TokenBucket(1, 30.0, name="github")
+            GITHUB_SHARD_WORKERS = workers
+            requests.clear()
+            sys.stdout = open(os.devnull, "w")
+            started = time.perf_counter()
+            prs = fetch()
+            elapsed = time.perf_counter() - started
+            sys.stdout.close()
+            sys.stdout = original_stdout
+            assert len(prs) == repo_count * pull_requests_per_repo, len(prs)
+            assert {pr["repo"] for pr in prs} == set(repo_names)
+            results.append((label, workers, len(requests), max(len(q) for q in requests), elapsed))
+    finally:
+        sys.stdout = original_stdout
+        server.shutdown()
+
+    print("\n--- 複数リポジトリの取得ベンチマーク結果 ---")
+    print(f"リポジトリ: {repo_count}個 (各{pull_requests_per_repo}件のPR), 1リクエストの遅延: {latency}秒, "
+          f"レートリミット: 30回/分を60倍速で再現")
+    for label, workers, request_count, max_query_length, elapsed in results:
+        print(f"{label} 並行数{workers}: {request_count}リクエスト (最長クエリ {max_query_length}文字), "
+              f"{elapsed:.2f}秒 (リポジトリごと比 {results[0][4] / elapsed:.1f}倍)")
+
 if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+    if "--self-check" in sys.argv:
+        _run_self_check()
+        _run_graphql_self_check()
+        sys.exit(0)
+
     print("--- GitHub監視エージェント テスト実行 ---")
     
     print("\n--- 過去24時間のPRを取得 --- ")
@@ -0,0 +1,529 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from utils.metrics import increment
+from utils.rate_limiter import TokenBucket
+
+# --- 定数 ---
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", os.path.join(".cache", "outbox.sqlite3"))
+# 投稿に使うアカウント。投稿数の上限はアカウントごとに数える
+POSTING_ACCOUNT = os.environ.get("POSTING_ACCOUNT", "default")
+# アカウントごとの投稿数の上限（POSTING_RATE_WINDOW_SECONDS 秒あたり POSTING_RATE_LIMIT 件）
+POSTING_RATE_LIMIT = int(os.environ.get("POSTING_RATE_LIMIT", "100"))
+POSTING_RATE_WINDOW_SECONDS = float(os.environ.get("POSTING_RATE_WINDOW_SECONDS", "900"))
+# 1つのスレッドの投稿を試みる回数の上限と、再試行までの指数バックオフ（フルジッター）の基準値・上限
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.environ.get("OUTBOX_BACKOFF_BASE_SECONDS", "2.0"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.environ.get("OUTBOX_BACKOFF_MAX_SECONDS", "300"))
+# 並行して投稿するスレッドの数（投稿数の上限はアカウントごとに共有する）
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", "1"))
+# 投稿中のまま、この秒数を過ぎたスレッドは、投稿していたプロセスが異常終了したとみなして投稿し直す
+OUTBOX_CLAIM_TIMEOUT_SECONDS = float(os.environ.get("OUTBOX_CLAIM_TIMEOUT_SECONDS", "600"))
+
+# 再試行する投稿APIのエラー。それ以外の4xxは、再試行しても成功しないため失敗として記録する
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# スレッドの状態
+STATUS_PENDING = "pending"  # 投稿待ち（再試行待ちを含む）
+STATUS_POSTING = "posting"  # 投稿中
+STATUS_POSTED = "posted"
+STATUS_FAILED = "failed"    # 再試行の上限に達したか、再試行しても成功しないエラー
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS outbox_threads ("
+    " thread_key TEXT PRIMARY KEY,"
+    " target_date TEXT,"
+    " account TEXT NOT NULL,"
+    " tweets TEXT NOT NULL,"
+    " metadata TEXT NOT NULL,"
+    " status TEXT NOT NULL,"
+    " attempts INTEGER NOT NULL DEFAULT 0,"
+    " next_attempt_at REAL NOT NULL,"  # 投稿待ちは次に試みる時刻、投稿中は投稿をやり直す時刻 (UNIX時間)
+    " last_error TEXT,"
+    " created_at TEXT NOT NULL,"
+    " posted_at TEXT)",
+    # 投稿済みのツイートのID。スレッドの途中で失敗した場合は、次の試行で続きのツイートから投稿する
+    "CREATE TABLE IF NOT EXISTS outbox_posts ("
+    " thread_key TEXT NOT NULL,"
+    " position INTEGER NOT NULL,"
+    " post_id TEXT NOT NULL,"
+    " posted_at TEXT NOT NULL,"
+    " PRIMARY KEY (thread_key, position)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS idx_outbox_threads_due ON outbox_threads (status, next_attempt_at)",
+]
+
+ENQUEUE_SQL = (
+    "INSERT INTO outbox_threads (thread_key, target_date, account, tweets, metadata, status, attempts, next_attempt_at,"
+    " created_at) VALUES (?, ?, ?, ?, ?, 'pending', 0, ?, ?)"
+    # 失敗として記録されたスレッドは、再実行で保存し直されたときに投稿待ちに戻す
+    " ON CONFLICT (thread_key) DO UPDATE SET status = 'pending', attempts = 0, next_attempt_at = excluded.next_attempt_at,"
+    " last_error = NULL WHERE outbox_threads.status = 'failed'"
+)
+SELECT_DUE_SQL = (
+    "SELECT thread_key, target_date, account, tweets, metadata, attempts FROM outbox_threads"
+    " WHERE status IN ('pending', 'posting') AND next_attempt_at <= ? ORDER BY created_at, thread_key LIMIT ?"
+)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def thread_key(target_date: Optional[str], tweets: List[str]) -> str:
+    """スレッドを識別するキー。対象日とツイート本文のハッシュで、同じ日の同じスレッドは同じキーになる。"""
+    content = (target_date or "") + "\x1f" + "\x1e".join(tweets)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    code = getattr(error, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+class Outbox:
+    """
+    承認されたスレッドを、投稿が完了するまで保持するSQLiteの永続キュー。
+    スレッドは対象日と本文のハッシュで識別するため、再実行や再開で同じスレッドを保存しても1件にまとまり、
+    投稿済みかどうかは主キーの1回の参照で判定できる。
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # Webhookの常駐プロセスと日次の実行が同じファイルを使っても待たされないよう、WALモードで開く
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            self._conn.commit()
+
+    def enqueue(self, target_date: Optional[str], tweets: List[str], account: str = POSTING_ACCOUNT,
+                metadata: Optional[Dict] = None) -> Dict:
+        """
+        スレッドを投稿待ちとして保存する。同じスレッドが既にある場合は保存し直さない。
+
+        Returns:
+            Dict: "thread_key"、保存後の "status"、新しく投稿待ちにしたかどうか ("enqueued")。
+        """
+        key = thread_key(target_date, tweets)
+        with self._lock:
+            cursor = self._conn.execute(ENQUEUE_SQL, (
+                key, target_date, account, json.dumps(tweets, ensure_ascii=False),
+                json.dumps(metadata or {}, ensure_ascii=False), time.time(), _now(),
+            ))
+            enqueued = cursor.rowcount > 0
+            status = self._conn.execute("SELECT status FROM outbox_threads WHERE thread_key = ?", (key,)).fetchone()[0]
+            self._conn.commit()
+        return {"thread_key": key, "status": status, "enqueued": enqueued}
+
+    def status(self, key: str) -> Optional[str]:
+        """スレッドの状態を返す。保存されていない場合はNone。"""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM outbox_threads WHERE thread_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def claim_due(self, limit: int, claim_timeout: float = OUTBOX_CLAIM_TIMEOUT_SECONDS) -> List[Dict]:
+        """
+        期限の来た投稿待ちのスレッドを、保存した順に最大limit件取り出して投稿中にする。
+        投稿中のまま claim_timeout 秒を過ぎたスレッドも、投稿し直す対象として取り出す。
+        """
+        now = time.time()
+        with self._lock:
+            # 同じファイルを使う別のプロセスと同じスレッドを取り出さないよう、読み取りの前に書き込みロックを取る
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(SELECT_DUE_SQL, (now, limit)).fetchall()
+            self._conn.executemany(
+                "UPDATE outbox_threads SET status = 'posting', next_attempt_at = ? WHERE thread_key = ?",
+                [(now + claim_timeout, row[0]) for row in rows],
+            )
+            self._conn.commit()
+        return [
+            {"thread_key": key, "target_date": target_date, "account": account, "tweets": json.loads(tweets),
+             "metadata": json.loads(metadata), "attempts": attempts}
+            for key, target_date, account, tweets, metadata, attempts in rows
+        ]
+
+    def posted_ids(self, key: str) -> List[str]:
+        """スレッドのうち投稿済みのツイートのIDを、スレッド内の順に返す。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT post_id FROM outbox_posts WHERE thread_key = ? ORDER BY position", (key,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def record_post(self, key: str, position: int, post_id: str) -> None:
+        """ツイート1件の投稿IDを記録する。返信の次のツイートを投稿する前に、必ずコミットする。"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO outbox_posts (thread_key, position, post_id, posted_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (thread_key, position) DO NOTHING",
+                (key, position, post_id, _now()),
+            )
+            self._conn.commit()
+
+    def _update(self, key: str, **columns) -> None:
+        assignments = ", ".join(f"{name} = ?" for name in columns)
+        with self._lock:
+            self._conn.execute(f"UPDATE outbox_threads SET {assignments} WHERE thread_key = ?", (*columns.values(), key))
+            self._conn.commit()
+
+    def mark_posted(self, key: str) -> None:
+        self._update(key, status=STATUS_POSTED, posted_at=_now(), last_error=None)
+
+    def schedule_retry(self, key: str, attempts: int, next_attempt_at: float, error: str) -> None:
+        self._update(key, status=STATUS_PENDING, attempts=attempts, next_attempt_at=next_attempt_at, last_error=error)
+
+    def mark_failed(self, key: str, attempts: int, error: str) -> None:
+        self._update(key, status=STATUS_FAILED, attempts=attempts, last_error=error)
+
+    def next_due_at(self) -> Optional[float]:
+        """投稿待ち・投稿中のスレッドのうち、最も早く投稿を試みる時刻を返す。ない場合はNone。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox_threads WHERE status IN ('pending', 'posting')"
+            ).fetchone()
+        return row[0]
+
+    def counts(self) -> Dict[str, int]:
+        """状態ごとのスレッド数を返す。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox_threads GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_account_limiters: Dict[str, TokenBucket] = {}
+_account_limiters_lock = threading.Lock()
+
+
+def posting_limiter(limit: int, window_seconds: float, name: Optional[str] = None) -> TokenBucket:
+    """
+    「window_seconds 秒あたり limit 件」の上限を超えないトークンバケットを作る。
+    窓の中で投稿できる件数は「容量 + 補充の速さ x 窓の長さ」になるため、容量を上限の1割に抑え、
+    残りを窓の長さで補充する（容量を上限と同じにすると、最初の窓で上限の2倍まで投稿してしまう）。
+    """
+    capacity = max(1, limit // 10)
+    return TokenBucket(capacity, (limit - capacity) / window_seconds, name=name)
+
+
+def get_account_limiter(account: str) -> TokenBucket:
+    """アカウントごとの投稿数の上限を守るトークンバケットを返す。同じプロセスの全ての投稿で共有する。"""
+    with _account_limiters_lock:
+        if account not in _account_limiters:
+            _account_limiters[account] = posting_limiter(
+                POSTING_RATE_LIMIT, POSTING_RATE_WINDOW_SECONDS, name=f"posting_{account}"
+            )
+        return _account_limiters[account]
+
+
+class OutboxDispatcher:
+    """
+    アウトボックスの投稿待ちのスレッドを投稿する。
+    スレッド内のツイートは、1つ前のツイートへの返信として順番に投稿し、投稿IDを1件ごとに記録する。
+    途中で失敗したスレッドは、次の試行で記録済みの続きから投稿するため、同じツイートを二重に投稿しない。
+
+    Args:
+        outbox (Outbox): 投稿待ちのスレッドを保持するアウトボックス。
+        client: post(text, reply_to_id) で1件投稿し、投稿IDを返すクライアント。
+        limiter_for (Callable[[str], TokenBucket]): アカウント名から、投稿数の上限を守るトークンバケットを返す関数。
+        on_posted (Callable[[Dict], None], optional): スレッドの投稿が完了したときに呼び出す関数。
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        client,
+        limiter_for: Callable[[str], TokenBucket] = get_account_limiter,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        backoff_base: float = OUTBOX_BACKOFF_BASE_SECONDS,
+        backoff_max: float = OUTBOX_BACKOFF_MAX_SECONDS,
+        workers: int = OUTBOX_WORKERS,
+        on_posted: Optional[Callable[[Dict], None]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.outbox = outbox
+        self.client = client
+        self.limiter_for = limiter_for
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.workers = max(1, workers)
+        self.on_posted = on_posted
+        self._rng = random.Random(seed)
+
+    def _post_thread(self, thread: Dict) -> str:
+        """1つのスレッドを、記録済みの続きから投稿し、投稿後の状態を返す。"""
+        key = thread["thread_key"]
+        post_ids = self.outbox.posted_ids(key)
+        reply_to_id = post_ids[-1] if post_ids else None
+        limiter = self.limiter_for(thread["account"])
+        try:
+            for position in range(len(post_ids), len(thread["tweets"])):
+                limiter.acquire()
+                reply_to_id = self.client.post(thread["tweets"][position], reply_to_id=reply_to_id)
+                self.outbox.record_post(key, position, reply_to_id)
+                increment("outbox_posts_total")
+        except Exception as e:
+            return self._handle_failure(thread, e)
+
+        self.outbox.mark_posted(key)
+        increment("outbox_threads_total", result=STATUS_POSTED)
+        if self.on_posted is not None:
+            try:
+                self.on_posted(thread)
+            except Exception as e:
+                print(f"エラー: 投稿済みスレッドの記録中にエラーが発生しました: {e}")
+        return STATUS_POSTED
+
+    def _handle_failure(self, thread: Dict, error: Exception) -> str:
+        key = thread["thread_key"]
+        code = _status_code(error)
+        # 429は投稿数の上限によるもので、スレッドの内容の問題ではないため、試行回数に数えない
+        attempts = thread["attempts"] + (0 if code == 429 else 1)
+        retryable = isinstance(error, (TimeoutError, ConnectionError)) or code in RETRYABLE_STATUS_CODES
+        if not retryable or attempts >= self.max_attempts:
+            print(f"エラー: スレッドの投稿に失敗しました ({attempts}回目、再試行しません): {error}")
+            self.outbox.mark_failed(key, attempts, str(error))
+            increment("outbox_threads_total", result=STATUS_FAILED)
+            return STATUS_FAILED
+        delay = self._rng.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempts)))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            # 投稿APIが待つべき時間を示した場合は、それより前には再試行しない
+            delay = max(delay, retry_after)
+        print(f"  - スレッドの投稿が失敗したため、{delay:.1f}秒後に再試行します: {error}")
+        self.outbox.schedule_retry(key, attempts, time.time() + delay, str(error))
+        increment("outbox_threads_total", result="retry")
+        return STATUS_PENDING
+
+    def dispatch_due(self) -> Dict[str, int]:
+        """
+        期限の来たスレッドがなくなるまで投稿する。再試行待ちのスレッドの期限までは待たない。
+
+        Returns:
+            Dict[str, int]: 試行の結果（posted / pending / failed）ごとの件数。
+        """
+        stats = {STATUS_POSTED: 0, STATUS_PENDING: 0, STATUS_FAILED: 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                threads = self.outbox.claim_due(limit=self.workers * 4)
+                if not threads:
+                    return stats
+                for result in executor.map(self._post_thread, threads):
+                    stats[result] += 1
+
+    def drain(self, timeout: Optional[float] = None) -> Dict[str, int]:
+        """
+        再試行待ちのスレッドの期限も待ちながら、投稿待ちのスレッドがなくなるまで投稿する。
+        timeout 秒を過ぎた場合は、残りのスレッドを投稿待ちのまま戻る。
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        stats = {STATUS_POSTED: 0, STATUS_PENDING: 0, STATUS_FAILED: 0}
+        while True:
+            for result, count in self.dispatch_due().items():
+                stats[result] += count
+            next_due_at = self.outbox.next_due_at()
+            if next_due_at is None:
+                return stats
+            wait = next_due_at - time.time()
+            if deadline is not None and time.time() + max(0.0, wait) >= deadline:
+                return stats
+            if wait > 0:
+                time.sleep(wait)
+
+
+_outbox_enabled = True
+_default_outbox: Optional[Outbox] = None
+_default_outbox_lock = threading.Lock()
+
+
+def set_outbox_enabled(enabled: bool) -> None:
+    """アウトボックスの有効/無効を切り替える（セルフチェック用）。無効の場合は、承認されたスレッドを直接投稿する。"""
+    global _outbox_enabled
+    _outbox_enabled = enabled
+
+
+def get_outbox() -> Optional[Outbox]:
+    """全ノードで共有するアウトボックスを返す。無効化されている場合や開けない場合はNoneを返す。"""
+    global _default_outbox
+    if not _outbox_enabled:
+        return None
+    with _default_outbox_lock:
+        if _default_outbox is None:
+            try:
+                _default_outbox = Outbox()
+            except Exception as e:
+                print(f"エラー: アウトボックスを開けませんでした: {e}")
+                return None
+    return _default_outbox
+
+
+def publish_thread(
+    target_date: Optional[str],
+    tweets: List[str],
+    metadata: Optional[Dict] = None,
+    dispatch: bool = True,
+    client=None,
+    on_posted: Optional[Callable[[Dict], None]] = None,
+) -> str:
+    """
+    承認されたスレッドをアウトボックスに保存し、dispatch=True の場合は期限の来たスレッドを投稿する。
+    投稿済みのスレッドは、再実行や再開で保存し直されても投稿しない。
+
+    Args:
+        target_date (str, optional): スレッドの対象日。
+        tweets (List[str]): スレッドのツイート。
+        metadata (Dict, optional): on_posted に渡すための付加情報（紹介したPRのキーなど）。
+        dispatch (bool): すぐに投稿するかどうか。Falseの場合は保存だけを行い、後で drain_outbox で投稿する。
+        client (optional): 投稿に使うクライアント。省略時はシミュレーション。
+        on_posted (Callable[[Dict], None], optional): スレッドの投稿が完了したときに呼び出す関数。
+
+    Returns:
+        str: このスレッドの状態（posted / pending / failed）。
+    """
+    from agents.publisher import SimulatedPostingClient, post_tweets
+
+    outbox = get_outbox()
+    if outbox is None:
+        # アウトボックスが使えない場合は、従来どおり直接投稿する（二重投稿は防げない）
+        if not post_tweets(tweets):
+            return STATUS_FAILED
+        if on_posted is not None:
+            on_posted({"target_date": target_date, "tweets": tweets, "metadata": metadata or {}})
+        return STATUS_POSTED
+
+    entry = outbox.enqueue(target_date, tweets, metadata=metadata)
+    if entry["status"] == STATUS_POSTED:
+        print("このスレッドは投稿済みのため、投稿を省略します。")
+        increment("outbox_threads_total", result="duplicate")
+        return STATUS_POSTED
+    if dispatch:
+        OutboxDispatcher(outbox, client or SimulatedPostingClient(), on_posted=on_posted).dispatch_due()
+    return outbox.status(entry["thread_key"])
+
+
+def drain_outbox(client=None, on_posted: Optional[Callable[[Dict], None]] = None,
+                 timeout: Optional[float] = None) -> Dict[str, int]:
+    """アウトボックスの投稿待ちのスレッドを、再試行待ちの期限も待ちながら全て投稿する。"""
+    from agents.publisher import SimulatedPostingClient
+
+    outbox = get_outbox()
+    if outbox is None:
+        return {}
+    return OutboxDispatcher(outbox, client or SimulatedPostingClient(), on_posted=on_posted).drain(timeout)
+
+
+def _run_benchmark():
+    """
+    偽の投稿APIに対して、バックフィル300日分のスレッドを投稿し、投稿数の上限を事前に守る場合と
+    429を受けてから待つ場合のスループットと429の回数を比較する。あわせて、同じスレッドを保存し直しても
+    二重に投稿しないことと、途中で失敗したスレッドが続きのツイートから返信のつながりを保って投稿されることを確認する。
+    """
+    import tempfile
+
+    thread_count = 300
+    limit = 100
+    window = 1.0  # 15分あたり100件の上限を、900倍速で再現する
+    latency = 0.02
+    threads = [
+        [f"{day}日目の政策の更新をお知らせします。(1/2)", f"【注目】{day}日目の注目の更新の解説です。(2/2)"]
+        for day in range(thread_count)
+    ]
+    results = []
+    original_stdout = sys.stdout
+
+    for label, pre_limit, workers in (("上限を事前に守らない（429を受けてから待つ）", False, 4),
+                                      ("トークンバケットで上限を守る", True, 1),
+                                      ("トークンバケットで上限を守る", True, 4)):
+        outbox = Outbox(os.path.join(tempfile.mkdtemp(), "outbox.sqlite3"))
+        api = FakePostingAPI(limit=limit, window_seconds=window, latency=latency, error_rate=0.03, seed=1)
+        bucket = posting_limiter(limit, window) if pre_limit else TokenBucket(1e9, 1e9)
+        dispatcher = OutboxDispatcher(outbox, api, limiter_for=lambda account: bucket, backoff_base=0.05,
+                                      backoff_max=1.0, workers=workers, seed=1)
+        for day, tweets in enumerate(threads):
+            outbox.enqueue(f"day-{day}", tweets)
+        sys.stdout = open(os.devnull, "w")
+        try:
+            started = time.perf_counter()
+            stats = dispatcher.drain(timeout=120)
+            elapsed = time.perf_counter() - started
+            # 再実行や再開で同じスレッドを保存し直しても、二重に投稿しない
+            posts_before = len(api.posts)
+            for day, tweets in enumerate(threads):
+                assert outbox.enqueue(f"day-{day}", tweets)["status"] == STATUS_POSTED
+            dispatcher.drain(timeout=5)
+            assert len(api.posts) == posts_before
+        finally:
+            sys.stdout.close()
+            sys.stdout = original_stdout
+        assert stats[STATUS_POSTED] == thread_count and outbox.counts() == {STATUS_POSTED: thread_count}, stats
+        # 全てのスレッドが、返信のつながりを保って1回ずつ投稿されている
+        assert sorted(api.threads()) == sorted(threads), "スレッドの返信のつながりが崩れています"
+        results.append((label, workers, elapsed, api.rate_limited_count, api.error_count))
+        outbox.close()
+
+    print("\n--- アウトボックス ベンチマーク結果 ---")
+    print(f"スレッド: {thread_count}件 (各2ツイート), 投稿の上限: 15分あたり{limit}件を900倍速で再現, "
+          f"1投稿の遅延: {latency}秒, 3%の投稿が5xxで失敗")
+    for label, workers, elapsed, rate_limited, errors in results:
+        posts_per_window = thread_count * 2 / elapsed * window
+        # 900倍速の経過時間を実時間に戻し、実際の上限のもとでの1時間あたりのスレッド数に換算する
+        print(f"{label} 並行数{workers}: {elapsed:.2f}秒, {thread_count / (elapsed * 900 / window) * 3600:.0f}スレッド/時 "
+              f"(上限に対する投稿数 {posts_per_window / limit:.0%}), 429応答 {rate_limited}回, 5xx {errors}回")
+    print("全ての構成で、同じスレッドの保存し直しによる二重投稿は0件、返信のつながりは全て正しい状態でした。")
+
+
+def _run_self_check():
+    """スレッドの2ツイート目で失敗した場合に、再試行で1ツイート目への返信として2ツイート目だけを投稿することを確認する。"""
+    import tempfile
+
+    class FailSecondOnce:
+        def __init__(self):
+            self.api = FakePostingAPI()
+            self.failed = False
+
+        def post(self, text, reply_to_id=None):
+            if reply_to_id is not None and not self.failed:
+                self.failed = True
+                raise FakePostingError(503)
+            return self.api.post(text, reply_to_id)
+
+    outbox = Outbox(os.path.join(tempfile.mkdtemp(), "outbox.sqlite3"))
+    client = FailSecondOnce()
+    tweets = ["ヘッドラインです。(1/2)", "【注目】解説です。(2/2)"]
+    outbox.enqueue("2025-07-19", tweets)
+    dispatcher = OutboxDispatcher(outbox, client, limiter_for=lambda account: TokenBucket(1e9, 1e9),
+                                  backoff_base=0.01, backoff_max=0.05)
+    stats = dispatcher.drain(timeout=10)
+    assert stats == {STATUS_POSTED: 1, STATUS_PENDING: 1, STATUS_FAILED: 0}, stats
+    assert client.api.threads() == [tweets], client.api.threads()
+    assert outbox.enqueue("2025-07-19", tweets)["status"] == STATUS_POSTED
+    print("--- セルフチェック成功: 途中で失敗したスレッドを、続きのツイートから返信として投稿しました ---")
+
+
+if __name__ == '__main__':
+    from utils.fake_posting import FakePostingAPI, FakePostingError
+
+    if "--self-check" in sys.argv:
+        _run_self_check()
+        sys.exit(0)
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
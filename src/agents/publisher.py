@@ -1,6 +1,7 @@
 import os
+import uuid
 # import tweepy # tweepyは不要になったためコメントアウトまたは削除
-from typing import List
+from typing import List, Optional
 
 # --- 環境変数からTwitter APIの認証情報を取得 (不要になったが、形式として残すことも可能) ---
 # TWITTER_API_KEY = os.environ.get("TWITTER_API_KEY")
@@ -8,6 +9,19 @@ from typing import List
 # TWITTER_ACCESS_TOKEN = os.environ.get("TWITTER_ACCESS_TOKEN")
 # TWITTER_ACCESS_TOKEN_SECRET = os.environ.get("TWITTER_ACCESS_TOKEN_SECRET")
 
+class SimulatedPostingClient:
+    """
+    Twitter (X) APIの代わりに、ツイートをコンソールに表示するだけのクライアント（シミュレーション）。
+    アウトボックスの投稿処理から1ツイートずつ呼び出される。
+    """
+
+    def post(self, text: str, reply_to_id: Optional[str] = None) -> str:
+        """ツイートを1件投稿（表示）し、投稿IDを返す。"""
+        post_id = f"sim-{uuid.uuid4().hex[:12]}"
+        target = f" (返信先: {reply_to_id})" if reply_to_id else ""
+        print(f"[シミュレーション投稿 {post_id}{target}]\n{text}\n" + "-" * 30)
+        return post_id
+
 def post_tweets(tweets: List[str]) -> bool:
     """
     ツイートのリストを、リプライ形式で連続投稿する（シミュレーション）。
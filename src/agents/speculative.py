@@ -0,0 +1,203 @@
+import os
+import sys
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List
+
+from agents.evaluator import evaluate_tweets
+from agents.tweet_generator import generate_tweets
+from agents.tweet_validator import validate_tweets
+
+# --- 定数 ---
+# 並行して生成する候補スレッドの数。1以下の場合は投機的生成を行わない
+SPECULATIVE_CANDIDATES = int(os.environ.get("SPECULATIVE_CANDIDATES", "1"))
+# 候補ごとに使うtemperature。候補数より少ない場合は繰り返して使う
+SPECULATIVE_TEMPERATURES = [float(t) for t in os.environ.get("SPECULATIVE_TEMPERATURES", "0.4,0.7,1.0").split(",")]
+# 承認された候補が見つかった時点で、残りの候補の処理を打ち切るかどうか
+SPECULATIVE_CANCEL_PENDING = os.environ.get("SPECULATIVE_CANCEL_PENDING", "1") == "1"
+
+
+def _run_candidate(index: int, summaries: List[Dict], temperature: float, cancel_event: threading.Event, model) -> Dict:
+    """
+    1つの候補スレッドを生成し、形式チェックとLLMによる評価までを行う。
+    打ち切りが指示されている場合は、次のLLM呼び出しを行わずに終了する。
+    """
+    started = time.perf_counter()
+    candidate = {"index": index, "temperature": temperature, "tweets": [], "evaluation_result": {},
+                 "llm_calls": 0, "cancelled": False}
+    if cancel_event.is_set():
+        candidate["cancelled"] = True
+        return candidate
+
+    candidate["tweets"] = generate_tweets(summaries, use_cache=False, model=model, temperature=temperature)
+    candidate["llm_calls"] += 1
+    if not candidate["tweets"]:
+        candidate["elapsed"] = time.perf_counter() - started
+        return candidate
+
+    validation_result = validate_tweets(candidate["tweets"])
+    if validation_result["evaluation"] != "Approved":
+        candidate["evaluation_result"] = validation_result
+    elif cancel_event.is_set():
+        candidate["cancelled"] = True
+    else:
+        candidate["evaluation_result"] = evaluate_tweets(candidate["tweets"], model=model)
+        candidate["llm_calls"] += 1
+    candidate["elapsed"] = time.perf_counter() - started
+    return candidate
+
+
+def _approved_count(candidate: Dict) -> int:
+    verdicts = candidate["evaluation_result"].get("tweet_verdicts") or []
+    return sum(1 for v in verdicts if v["evaluation"] == "Approved")
+
+
+def generate_and_evaluate_speculatively(
+    summaries: List[Dict],
+    candidates: int = SPECULATIVE_CANDIDATES,
+    temperatures: List[float] = SPECULATIVE_TEMPERATURES,
+    cancel_pending: bool = SPECULATIVE_CANCEL_PENDING,
+    model=None,
+) -> Dict:
+    """
+    temperatureを変えたK個の候補スレッドを並行して生成・評価し、最初に承認された候補を採用する。
+    cancel_pendingがTrueの場合、承認された時点で未開始の候補を取り消し、実行中の候補も次のLLM呼び出しを行わない。
+
+    Args:
+        summaries (List[Dict]): 各更新の要約とタグを含む辞書のリスト。
+        candidates (int): 並行して生成する候補の数 (K)。
+        temperatures (List[float]): 候補ごとのtemperature。
+        cancel_pending (bool): 承認後に残りの候補を打ち切るかどうか。
+        model (optional): 使用するモデル。指定しない場合は各エージェントがGeminiモデルを初期化する。
+
+    Returns:
+        Dict: "tweets"・"evaluation_result"（採用した候補）と、"metrics"（レイテンシとLLM呼び出し数）を持つ辞書。
+              承認された候補がない場合は、承認されたツイートが最も多い候補を返す。
+    """
+    candidates = max(1, candidates)
+    cancel_event = threading.Event()
+    started = time.perf_counter()
+    print(f"  - {candidates}個の候補スレッドを並行して生成・評価します...")
+
+    finished = []
+    winner = None
+    first_approved_seconds = None
+    executor = ThreadPoolExecutor(max_workers=candidates)
+    try:
+        pending = {
+            executor.submit(_run_candidate, i, summaries, temperatures[i % len(temperatures)], cancel_event, model)
+            for i in range(candidates)
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                candidate = future.result()
+                finished.append(candidate)
+                if winner is None and candidate["evaluation_result"].get("evaluation") == "Approved":
+                    winner = candidate
+                    first_approved_seconds = time.perf_counter() - started
+                    print(f"  - 候補{candidate['index'] + 1} (temperature={candidate['temperature']}) が最初に承認されました")
+            if winner is not None and cancel_pending:
+                cancel_event.set()
+                for future in pending:
+                    future.cancel()
+                # 実行中の候補は、次のLLM呼び出しの前に打ち切られる。結果は待たずに返す
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=cancel_pending)
+
+    if winner is None:
+        usable = [c for c in finished if c["tweets"]]
+        winner = max(usable, key=_approved_count) if usable else {"tweets": [], "evaluation_result": {}}
+
+    metrics = {
+        "candidates": candidates,
+        "winner_index": winner.get("index"),
+        "first_approved_seconds": first_approved_seconds,
+        "total_seconds": time.perf_counter() - started,
+        "llm_calls": sum(c["llm_calls"] for c in finished),
+        "cancelled_candidates": candidates - len([c for c in finished if not c["cancelled"]]),
+    }
+    return {"tweets": winner["tweets"], "evaluation_result": winner["evaluation_result"], "metrics": metrics}
+
+
+def _run_benchmark():
+    """
+    承認率とレイテンシを設定した偽モデルで、逐次の生成→評価→再生成ループと投機的生成とを比較し、
+    期待レイテンシと追加のトークン消費を計測する。
+    """
+    import random
+    from utils.fake_llm import FakeGenerativeModel, ScriptedResponder, use_offline_settings
+
+    # 偽モデルに対する呼び出しなので、APIのレート制限による待ちは計測から除外する
+    use_offline_settings()
+    approval_rate = 0.5
+    trials = 20
+    summaries = [{"summary": f"政策{i}の変更点と、その変更がもたらす影響についての要約です。", "tags": ["教育"]} for i in range(5)]
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+
+    def jitter(kind: str, prompt: str) -> None:
+        # 呼び出しごとの遅延のばらつきを再現する
+        with rng_lock:
+            delay = rng.uniform(0.0, 0.1)
+        time.sleep(delay)
+
+    def evaluation(prompt: str) -> str:
+        with rng_lock:
+            return "Approved" if rng.random() < approval_rate else "Needs Review"
+
+    responder = ScriptedResponder(evaluation=evaluation, on_call=jitter)
+
+    def sequential_run(model):
+        # 承認されるまで生成→評価を繰り返す、従来の逐次ループ
+        while True:
+            candidate = generate_tweets(summaries, use_cache=False, model=model)
+            if evaluate_tweets(candidate, model=model).get("evaluation") == "Approved":
+                return
+
+    def speculative_run(model, k):
+        # 承認される候補が出るまで、K個ずつの投機的生成を繰り返す
+        while True:
+            result = generate_and_evaluate_speculatively(summaries, candidates=k, model=model)
+            if result["evaluation_result"].get("evaluation") == "Approved":
+                return
+
+    results = {}
+    for label, k in (("逐次ループ", 0), ("投機的 K=2", 2), ("投機的 K=3", 3), ("投機的 K=4", 4)):
+        elapsed = 0.0
+        tokens = 0
+        for _ in range(trials):
+            model = FakeGenerativeModel(responder=responder, latency=0.05)
+            started = time.perf_counter()
+            if k == 0:
+                sequential_run(model)
+            else:
+                speculative_run(model, k)
+            elapsed += time.perf_counter() - started
+            # 打ち切り前に開始済みだった呼び出しの完了を待ってから、消費トークンを集計する
+            time.sleep(0.2)
+            tokens += model.prompt_tokens + model.completion_tokens
+        results[label] = (elapsed / trials, tokens / trials)
+
+    base_seconds, base_tokens = results["逐次ループ"]
+    print("\n--- 投機的生成ベンチマーク結果 ---")
+    print(f"承認率: {approval_rate:.0%}, 1回のLLM呼び出しの遅延: 0.05〜0.15秒, 試行回数: {trials}")
+    for label, (seconds, tokens) in results.items():
+        print(f"{label}: 平均レイテンシ {seconds:.2f}秒 ({base_seconds / seconds:.1f}倍速), "
+              f"平均トークン {tokens:.0f} (逐次比 {tokens / base_tokens:.2f}倍)")
+
+
+if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+
+    print("--- 投機的ツイート生成 テスト実行 ---")
+    sample_summaries = [
+        {"summary": "不登校の児童生徒も念頭に、フリースクール等での学習継続支援を推進する方針を示しました。", "tags": ["教育"]},
+        {"summary": "博士課程の学生を「研究者」と位置づけ、経済的支援を大幅に拡充します。", "tags": ["科学技術"]},
+    ]
+    result = generate_and_evaluate_speculatively(sample_summaries, candidates=max(2, SPECULATIVE_CANDIDATES))
+    print(result["metrics"])
@@ -1,12 +1,27 @@
 
 import os
+import re
+import sys
 import json
-import google.generativeai as genai
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from utils.llm_cache import get_llm_cache, make_cache_key, set_cache_enabled
+from utils.llm_gateway import MODEL_NAME, LLMGateway, get_gateway
+from utils.rate_limiter import GEMINI_RATE_LIMITER, RateLimiter, estimate_tokens
 
 # --- 定数 ---
-# 環境変数からGemini APIキーを取得
-# このキーは、GitHub ActionsのSecretsに設定することを想定
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+# 要約リクエストの同時実行数
+SUMMARIZER_CONCURRENCY = int(os.environ.get("SUMMARIZER_CONCURRENCY", "4"))
+# "batch" を指定すると、複数のPRを1リクエストにまとめて要約する
+SUMMARIZER_MODE = os.environ.get("SUMMARIZER_MODE", "single")
+# バッチ1件あたりの入力トークン数の上限
+SUMMARIZER_BATCH_MAX_INPUT_TOKENS = int(os.environ.get("SUMMARIZER_BATCH_MAX_INPUT_TOKENS", "8000"))
+# これを超える入力は、セクションごとに分割して要約するマップリデュース方式で処理する
+SUMMARIZER_MAX_INPUT_TOKENS = int(os.environ.get("SUMMARIZER_MAX_INPUT_TOKENS", "6000"))
+# マップリデュース方式で分割する1チャンクあたりのトークン数
+SUMMARIZER_CHUNK_TOKENS = int(os.environ.get("SUMMARIZER_CHUNK_TOKENS", "3000"))
 
 # --- プロンプトテンプレート ---
 # 要件定義で合意した、高品質な要約を生成するためのプロンプト
@@ -36,43 +51,255 @@ PROMPT_TEMPLATE = """
 }}
 """
 
-def generate_summary_and_tags(pull_request_body: str) -> dict:
+# 大きな入力を分割した各チャンクを要約するためのプロンプト（マップ）
+MAP_PROMPT_TEMPLATE = """
+# 役割 (Role):
+あなたは、政策の動向を市民に分かりやすく伝える、経験豊富な政治ジャーナリストです。
+
+# 目的 (Objective):
+以下は、1つの大きな政策更新のテキストを分割した一部分（{chunk_index}/{chunk_count}）です。
+この部分に含まれる「変更点」と「その変更がもたらす影響や目的」を、200文字程度で要約してください。
+
+# ルール (Rules):
+- この部分に書かれている事実だけを要約し、あなたの意見や憶測は含めないでください。
+- 出力は、必ず指定されたJSON形式に従ってください。
+
+# 入力テキスト (Input):
+```
+{chunk_text}
+```
+
+# 出力形式 (Output Format):
+"summary"（文字列）と"tags"（文字列の配列、#は不要）の2つのキーを持つJSONオブジェクトで出力してください。
+{{
+  "summary": "...",
+  "tags": ["...", "..."]
+}}
+"""
+
+# チャンクごとの要約を1つの要約にまとめるためのプロンプト（リデュース）
+REDUCE_PROMPT_TEMPLATE = """
+# 役割 (Role):
+あなたは、政策の動向を市民に分かりやすく伝える、経験豊富な政治ジャーナリストです。
+
+# 目的 (Objective):
+以下は、1つの大きな政策更新のテキストを分割し、部分ごとに要約したものです。
+これらを統合し、政策に関心のあるTwitterフォロワーが「何が変わり、なぜそれが重要なのか」を瞬時に理解できるような、100文字程度の要約を作成してください。
+
+# ルール (Rules):
+- 必ず「変更点」と「その変更がもたらす影響や目的」の両方を含めてください。
+- 専門用語は避け、中学生でも理解できる平易な言葉で表現してください。
+- 客観的な事実に徹し、あなたの意見や憶測は含めないでください。
+- 出力は、必ず指定されたJSON形式に従ってください。
+
+# 部分ごとの要約 (Input):
+{partial_summaries_text}
+
+# 出力形式 (Output Format):
+"summary"（文字列）と"tags"（文字列の配列、#は不要）の2つのキーを持つJSONオブジェクトで出力してください。
+{{
+  "summary": "...",
+  "tags": ["...", "..."]
+}}
+"""
+
+# 複数のPRをまとめて要約するためのプロンプト。ルールは PROMPT_TEMPLATE と同じ
+BATCH_PROMPT_TEMPLATE = """
+# 役割 (Role):
+あなたは、政策の動向を市民に分かりやすく伝える、経験豊富な政治ジャーナリストです。
+
+# 目的 (Objective):
+以下の複数の政策更新のテキストそれぞれについて、政策に関心のあるTwitterフォロワーが「何が変わり、なぜそれが重要なのか」を瞬時に理解できるような、100文字程度の要約を作成してください。
+
+# ルール (Rules):
+- 必ず「変更点」と「その変更がもたらす影響や目的」の両方を含めてください。
+- 専門用語は避け、中学生でも理解できる平易な言葉で表現してください。
+- 客観的な事実に徹し、あなたの意見や憶測は含めないでください。
+- 各更新は独立して要約し、他の更新の内容を混ぜないでください。
+- 入力された全ての更新について、必ず1件ずつ結果を出力してください。
+- 出力は、必ず指定されたJSON形式に従ってください。
+
+# 入力テキスト (Input):
+{pull_requests_text}
+
+# 出力形式 (Output Format):
+JSON配列で出力してください。各要素は "number"（入力の更新の番号、整数）、"summary"（文字列）、"tags"（文字列の配列、#は不要）の3つのキーを持つオブジェクトです。
+[
+  {{
+    "number": 123,
+    "summary": "...",
+    "tags": ["...", "..."]
+  }}
+]
+"""
+
+# バッチ内の1件ごとの入力テキスト
+# 番号はバッチ内の連番で、PR番号ではない。PR番号として要約に書かれないよう「更新」と表記する
+BATCH_ITEM_TEMPLATE = """## 更新 {number}
+```
+{pull_request_body}
+```
+"""
+
+# 要約・タグ付けのレスポンスのスキーマ（MAP_PROMPT_TEMPLATE / REDUCE_PROMPT_TEMPLATE も同じ形式）
+SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {"summary": {"type": "string"}, "tags": {"type": "array", "items": {"type": "string"}}},
+    "required": ["summary", "tags"],
+}
+# バッチ要約のレスポンスのスキーマ
+BATCH_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "number": {"type": "integer"},
+            "summary": {"type": "string"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["number", "summary", "tags"],
+    },
+}
+
+def split_markdown_sections(text: str, max_tokens: int) -> List[str]:
+    """
+    テキストをMarkdownの見出し（"###" など）の境界で分割し、max_tokensに収まるチャンクに詰める。
+    1つのセクションがmax_tokensを超える場合は、行単位、さらに文字単位で分割する。
+
+    Args:
+        text (str): 分割対象のテキスト。
+        max_tokens (int): 1チャンクあたりの推定トークン数の上限。
+
+    Returns:
+        List[str]: チャンクのリスト。
+    """
+    sections = []
+    current = []
+    for line in text.splitlines(keepends=True):
+        if re.match(r"^\s*#{1,6}\s", line) and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+
+    # 大きすぎるセクションを、行単位・文字単位で分割する
+    pieces = []
+    for section in sections:
+        if estimate_tokens(section) <= max_tokens:
+            pieces.append(section)
+            continue
+        for line in section.splitlines(keepends=True):
+            while estimate_tokens(line) > max_tokens:
+                # 非ASCII文字は1文字1トークンで見積もるため、max_tokens文字ずつ切り出せば必ず上限に収まる
+                pieces.append(line[:max_tokens])
+                line = line[max_tokens:]
+            pieces.append(line)
+
+    chunks = []
+    current_chunk = ""
+    for piece in pieces:
+        if current_chunk and estimate_tokens(current_chunk + piece) > max_tokens:
+            chunks.append(current_chunk)
+            current_chunk = ""
+        current_chunk += piece
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+def _map_reduce_summary(
+    text: str,
+    gateway: LLMGateway,
+    rate_limiter: Optional[RateLimiter],
+    chunk_tokens: int = SUMMARIZER_CHUNK_TOKENS,
+    max_concurrency: int = SUMMARIZER_CONCURRENCY,
+) -> Tuple[dict, bool]:
+    """
+    大きなテキストをセクション境界で分割してチャンクごとに並行して要約し（マップ）、
+    最後に1回のリクエストで通常の "summary"と"tags" の形式にまとめる（リデュース）。
+
+    Returns:
+        Tuple[dict, bool]: "summary"と"tags"のキーを持つ辞書と、全てのチャンクを要約できたかどうか。
+                           一部のチャンクが失敗した場合も、残りのチャンクからまとめた要約を返す。
+    """
+    chunks = split_markdown_sections(text, chunk_tokens)
+    print(f"  - 入力が大きいため、{len(chunks)}個のチャンクに分割して要約します...")
+
+    def summarize_chunk(indexed_chunk):
+        index, chunk_text = indexed_chunk
+        prompt = MAP_PROMPT_TEMPLATE.format(chunk_index=index, chunk_count=len(chunks), chunk_text=chunk_text)
+        try:
+            return gateway.generate_json(prompt, SUMMARY_SCHEMA, rate_limiter=rate_limiter)
+        except Exception as e:
+            print(f"  - チャンク{index}の要約中にエラーが発生しました: {e}")
+            return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(chunks)))) as executor:
+        partials = [p for p in executor.map(summarize_chunk, enumerate(chunks, 1)) if p]
+    if not partials:
+        return {}, False
+    if len(partials) < len(chunks):
+        print(f"  - {len(chunks)}個中{len(chunks) - len(partials)}個のチャンクの要約に失敗したため、残りのチャンクからまとめます（キャッシュしません）")
+
+    partial_summaries_text = "\n".join(f"- ({i}) {p['summary']}" for i, p in enumerate(partials, 1))
+    prompt = REDUCE_PROMPT_TEMPLATE.format(partial_summaries_text=partial_summaries_text)
+    print("LLMに部分要約の統合をリクエストしています...")
+    return gateway.generate_json(prompt, SUMMARY_SCHEMA, rate_limiter=rate_limiter), len(partials) == len(chunks)
+
+def generate_summary_and_tags(pull_request_body: str, model=None, rate_limiter: Optional[RateLimiter] = None) -> dict:
     """
     指定されたテキストから、LLMを使って要約とタグを生成する。
 
     Args:
         pull_request_body (str): 要約対象のテキスト（PRの本文など）。
+        model (optional): 使用するモデル。指定しない場合は共有のGeminiモデルを使う。
+        rate_limiter (RateLimiter, optional): リクエスト前に枠を取得するレートリミッター。
 
     Returns:
         dict: "summary"と"tags"のキーを持つ辞書。失敗時は空の辞書を返す。
     """
-    if not GEMINI_API_KEY:
-        print("エラー: 環境変数 GEMINI_API_KEY が設定されていません。")
-        return {}
+    # 大きな入力はマップリデュース方式、それ以外は1回のリクエストで要約する
+    is_large = estimate_tokens(pull_request_body) > SUMMARIZER_MAX_INPUT_TOKENS
 
-    try:
-        # モデルの初期化
-        genai.configure(api_key=GEMINI_API_KEY)
-        #model = genai.GenerativeModel('gemini-pro')
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    # 同じ本文・プロンプト・モデルの組み合わせは、過去の結果を再利用する
+    cache = get_llm_cache()
+    if is_large:
+        cache_key = make_cache_key(
+            "summarizer_map_reduce", MAP_PROMPT_TEMPLATE, REDUCE_PROMPT_TEMPLATE, MODEL_NAME, pull_request_body
+        )
+    else:
+        cache_key = make_cache_key("summarizer", PROMPT_TEMPLATE, MODEL_NAME, pull_request_body)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print("  - キャッシュから要約を取得しました")
+            return cached
 
-        # プロンプトの生成
-        prompt = PROMPT_TEMPLATE.format(pull_request_body=pull_request_body)
+    try:
+        # 共有のゲートウェイ（モデルを指定しない場合はGeminiモデル）を取得
+        gateway = get_gateway(model)
+        if gateway is None:
+            return {}
 
-        print("LLMに要約とタグの生成をリクエストしています...")
-        response = model.generate_content(prompt)
+        # 一部のチャンクが欠けた要約は、次の実行で全てのチャンクから作り直せるようキャッシュしない
+        complete = True
+        if is_large:
+            result, complete = _map_reduce_summary(pull_request_body, gateway, rate_limiter)
+        else:
+            # プロンプトの生成
+            prompt = PROMPT_TEMPLATE.format(pull_request_body=pull_request_body)
 
-        # LLMの出力からJSON部分を抽出
-        # "```json\n{...}\n```" のような形式で返ってくることがあるため
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-        
-        result = json.loads(cleaned_response)
+            print("LLMに要約とタグの生成をリクエストしています...")
+            # スキーマを指定したJSONモードで生成し、解析済みの結果を受け取る
+            result = gateway.generate_json(prompt, SUMMARY_SCHEMA, rate_limiter=rate_limiter)
 
         # 簡単なバリデーション
         if "summary" in result and "tags" in result:
             print("  - 生成成功")
             print(f"要約: {result['summary']}")
             print(f"タグ: {result['tags']}")
+            if cache is not None and complete:
+                cache.set(cache_key, result)
             return result
         else:
             print("エラー: LLMのレスポンスに必要なキーが含まれていません。")
@@ -82,7 +309,277 @@ def generate_summary_and_tags(pull_request_body: str) -> dict:
         print(f"LLMとの通信中にエラーが発生しました: {e}")
         return {}
 
+def generate_summaries(
+    texts: List[str],
+    max_concurrency: int = SUMMARIZER_CONCURRENCY,
+    rate_limiter: Optional[RateLimiter] = GEMINI_RATE_LIMITER,
+    model=None,
+) -> List[dict]:
+    """
+    複数のテキストの要約とタグを、スレッドプールで並行して生成する。
+    結果は入力と同じ順序で返し、個別の失敗は空の辞書として他の要約を妨げない。
+
+    Args:
+        texts (List[str]): 要約対象のテキストのリスト。
+        max_concurrency (int): 同時に実行するリクエスト数の上限。
+        rate_limiter (RateLimiter, optional): 全リクエストで共有するレートリミッター。
+        model (optional): 使用するモデル。指定しない場合は共有のGeminiモデルを使う。
+
+    Returns:
+        List[dict]: 入力と同じ順序の結果リスト。失敗した要素は空の辞書。
+    """
+    if not texts:
+        return []
+
+    if get_gateway(model) is None:
+        return [{} for _ in texts]
+
+    max_workers = max(1, min(max_concurrency, len(texts)))
+    print(f"  - {len(texts)}件の要約を最大{max_workers}並列で生成します...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # mapは入力順に結果を返すため、PRの順序が保たれる
+        return list(executor.map(
+            lambda text: generate_summary_and_tags(text, model=model, rate_limiter=rate_limiter),
+            texts,
+        ))
+
+def _pack_batches(items: List[Tuple[int, str]], max_input_tokens: int) -> List[List[Tuple[int, str]]]:
+    """
+    (更新の番号, テキスト) のリストを、入力トークン数の上限に収まるよう順番に詰めてバッチに分割する。
+    1件で上限を超える更新は、単独のバッチとする。
+    """
+    overhead = estimate_tokens(BATCH_PROMPT_TEMPLATE)
+    batches = []
+    current = []
+    current_tokens = overhead
+    for number, text in items:
+        item_tokens = estimate_tokens(BATCH_ITEM_TEMPLATE.format(number=number, pull_request_body=text))
+        if current and current_tokens + item_tokens > max_input_tokens:
+            batches.append(current)
+            current = []
+            current_tokens = overhead
+        current.append((number, text))
+        current_tokens += item_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_batch_response(items, expected_numbers: set) -> Dict[int, dict]:
+    """
+    解析済みのバッチのレスポンスから、形式が正しい要素だけを 更新の番号 -> {"summary", "tags"} の辞書で返す。
+    """
+    if isinstance(items, dict):
+        items = items.get("items", [])
+    if not isinstance(items, list):
+        return {}
+
+    parsed = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        number = item.get("number")
+        if isinstance(number, str):
+            # 見出しをそのまま写した "更新 3" や "#3" も受け付ける
+            number = re.sub(r"^(更新|#)\s*", "", number.strip())
+            number = int(number) if number.isdigit() else None
+        if number not in expected_numbers:
+            continue
+        if not isinstance(item.get("summary"), str) or not isinstance(item.get("tags"), list):
+            continue
+        parsed[number] = {"summary": item["summary"], "tags": item["tags"]}
+    return parsed
+
+def _summarize_batch(batch: List[Tuple[int, str]], model, rate_limiter: Optional[RateLimiter]) -> Dict[int, dict]:
+    """
+    1つのバッチを要約する。欠落・不正な要素があった場合は、その要素だけを半分ずつに分割して再試行する。
+    1件だけになっても失敗する場合は、通常の単体要約にフォールバックする。
+    """
+    if len(batch) == 1:
+        number, text = batch[0]
+        result = generate_summary_and_tags(text, model=model, rate_limiter=rate_limiter)
+        return {number: result} if result else {}
+
+    pull_requests_text = "\n".join(
+        BATCH_ITEM_TEMPLATE.format(number=number, pull_request_body=text) for number, text in batch
+    )
+    prompt = BATCH_PROMPT_TEMPLATE.format(pull_requests_text=pull_requests_text)
+    expected_numbers = {number for number, _ in batch}
+
+    results = {}
+    try:
+        print(f"LLMに{len(batch)}件分の要約とタグの生成をまとめてリクエストしています...")
+        # ゲートウェイは最上位が配列であることだけを確認する。要素ごとの検証は _parse_batch_response で行う
+        response = get_gateway(model).generate_json(prompt, BATCH_SCHEMA, rate_limiter=rate_limiter)
+        results = _parse_batch_response(response, expected_numbers)
+    except Exception as e:
+        print(f"LLMとの通信中にエラーが発生しました: {e}")
+
+    missing = [(number, text) for number, text in batch if number not in results]
+    if missing:
+        print(f"  - {len(missing)}件の要約が欠落または不正だったため、分割して再試行します: {[n for n, _ in missing]}")
+        middle = (len(missing) + 1) // 2
+        for half in (missing[:middle], missing[middle:]):
+            if half:
+                results.update(_summarize_batch(half, model, rate_limiter))
+    return results
+
+def generate_summaries_batched(
+    items: List[Tuple[int, str]],
+    max_input_tokens: int = SUMMARIZER_BATCH_MAX_INPUT_TOKENS,
+    max_concurrency: int = SUMMARIZER_CONCURRENCY,
+    rate_limiter: Optional[RateLimiter] = GEMINI_RATE_LIMITER,
+    model=None,
+) -> List[dict]:
+    """
+    複数のPRを、入力トークン数の上限までまとめて1リクエストで要約する。
+    全ての更新の番号が返ってきたかを検証し、欠落・不正な要素はより小さいバッチで再試行する。
+
+    Args:
+        items (List[Tuple[int, str]]): (更新の番号, 要約対象のテキスト) のリスト。番号はリスト内で一意な整数。
+        max_input_tokens (int): 1バッチあたりの入力トークン数の上限。
+        max_concurrency (int): 同時に実行するバッチリクエスト数の上限。
+        rate_limiter (RateLimiter, optional): 全リクエストで共有するレートリミッター。
+        model (optional): 使用するモデル。指定しない場合は共有のGeminiモデルを使う。
+
+    Returns:
+        List[dict]: 入力と同じ順序の "summary"と"tags"を持つ辞書のリスト。失敗した要素は空の辞書。
+    """
+    if not items:
+        return []
+
+    # キャッシュ済みのPRはバッチに含めない
+    cache = get_llm_cache()
+    cache_keys = {
+        number: make_cache_key("summarizer_batch", BATCH_PROMPT_TEMPLATE, MODEL_NAME, text) for number, text in items
+    }
+    results = {}
+    if cache is not None:
+        for number, _ in items:
+            cached = cache.get(cache_keys[number])
+            if cached is not None:
+                results[number] = cached
+        if results:
+            print(f"  - {len(results)}件の要約をキャッシュから取得しました")
+
+    pending = [(number, text) for number, text in items if number not in results]
+    if pending:
+        if get_gateway(model) is None:
+            return [results.get(number, {}) for number, _ in items]
+
+        batches = _pack_batches(pending, max_input_tokens)
+        print(f"  - {len(pending)}件のPRを{len(batches)}件のバッチにまとめて要約します...")
+        max_workers = max(1, min(max_concurrency, len(batches)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch_results in executor.map(lambda b: _summarize_batch(b, model, rate_limiter), batches):
+                results.update(batch_results)
+                if cache is not None:
+                    for number, result in batch_results.items():
+                        cache.set(cache_keys[number], result)
+
+    return [results.get(number, {}) for number, _ in items]
+
+def _run_benchmark():
+    """一定の遅延を持つ偽モデルで、並列数に応じた実行時間の変化を計測する。"""
+    from utils.fake_llm import FakeGenerativeModel
+
+    # 計測のたびにキャッシュへヒットしないよう無効化する
+    set_cache_enabled(False)
+    pr_count = 16
+    latency = 0.2
+    texts = [f"タイトル: テストPR {i}\n\n### 政策概要\n* 変更点 {i}" for i in range(pr_count)]
+    results = []
+    for concurrency in (1, 2, 4, 8, 16):
+        model = FakeGenerativeModel(latency=latency)
+        started = time.perf_counter()
+        summaries = generate_summaries(texts, max_concurrency=concurrency, rate_limiter=None, model=model)
+        elapsed = time.perf_counter() - started
+        assert len(summaries) == pr_count and all(summaries)
+        results.append((concurrency, elapsed))
+
+    print("\n--- 並列要約ベンチマーク結果 ---")
+    print(f"PR数: {pr_count}, 1リクエストの遅延: {latency}秒")
+    for concurrency, elapsed in results:
+        print(f"並列数 {concurrency:>2}: {elapsed:.2f}秒 (逐次比 {results[0][1] / elapsed:.1f}倍)")
+
+def _run_batch_benchmark():
+    """偽モデルで、単体要約とバッチ要約のリクエスト数・入力トークン数を比較する。"""
+    from utils.fake_llm import FakeGenerativeModel
+
+    set_cache_enabled(False)
+
+    def batch_responder(prompt: str) -> str:
+        numbers = [int(n) for n in re.findall(r"^## 更新 (\d+)$", prompt, flags=re.MULTILINE)]
+        if not numbers:
+            return json.dumps({"summary": "テスト用の要約です。", "tags": ["テスト"]}, ensure_ascii=False)
+        # 7の倍数の更新は欠落させ、分割再試行の動作も確認する
+        items = [
+            {"number": n, "summary": f"更新 {n} のテスト用の要約です。", "tags": ["テスト"]}
+            for n in numbers if n % 7 != 0 or len(numbers) == 1
+        ]
+        return json.dumps(items, ensure_ascii=False)
+
+    pr_count = 40
+    body = "### 政策概要\n" + "\n".join(f"* 政策の変更点の説明文です。{i}" for i in range(10))
+    items = [(i, f"タイトル: テストPR {i}\n\n{body}") for i in range(1, pr_count + 1)]
+
+    single_model = FakeGenerativeModel(responder=batch_responder)
+    single = generate_summaries([text for _, text in items], rate_limiter=None, model=single_model)
+    batch_model = FakeGenerativeModel(responder=batch_responder)
+    batched = generate_summaries_batched(items, rate_limiter=None, model=batch_model)
+    assert all(single) and all(batched) and len(batched) == pr_count
+
+    print("\n--- バッチ要約ベンチマーク結果 ---")
+    print(f"PR数: {pr_count}, バッチ入力上限: {SUMMARIZER_BATCH_MAX_INPUT_TOKENS}トークン")
+    print(f"単体要約: リクエスト {single_model.call_count}回, 入力 {single_model.prompt_tokens}トークン")
+    print(f"バッチ要約: リクエスト {batch_model.call_count}回, 入力 {batch_model.prompt_tokens}トークン")
+    print(f"削減率: リクエスト {single_model.call_count / batch_model.call_count:.1f}倍, "
+          f"入力トークン {single_model.prompt_tokens / batch_model.prompt_tokens:.1f}倍")
+
+def _run_large_input_benchmark():
+    """合成した200KBのPRで、1回のリクエストとマップリデュース方式のレイテンシ・トークン数を比較する。"""
+    global SUMMARIZER_MAX_INPUT_TOKENS
+    from utils.fake_llm import FakeGenerativeModel
+
+    set_cache_enabled(False)
+
+    sections = []
+    size = 0
+    section_index = 0
+    while size < 200 * 1024:
+        section_index += 1
+        lines = [f"### 政策セクション{section_index}"]
+        lines += [f"* 政策の現状認識と課題、その解決策についての説明文です。項目{i}" for i in range(20)]
+        section = "\n".join(lines) + "\n"
+        sections.append(section)
+        size += len(section.encode("utf-8"))
+    text = "タイトル: 大規模な政策改定\n\n" + "".join(sections)
+
+    # 入力トークン数に比例して遅くなる偽モデル（1万トークンあたり0.5秒）
+    results = {}
+    for label, threshold in (("1回のリクエスト", 10 ** 9), ("マップリデュース", SUMMARIZER_MAX_INPUT_TOKENS)):
+        SUMMARIZER_MAX_INPUT_TOKENS = threshold
+        model = FakeGenerativeModel(latency=0.05, latency_per_token=0.00005)
+        started = time.perf_counter()
+        result = generate_summary_and_tags(text, model=model)
+        assert result
+        results[label] = (time.perf_counter() - started, model.call_count, model.prompt_tokens)
+
+    print("\n--- 大規模入力ベンチマーク結果 ---")
+    print(f"入力サイズ: {len(text.encode('utf-8')) // 1024}KB, 推定 {estimate_tokens(text)}トークン")
+    for label, (elapsed, calls, tokens) in results.items():
+        print(f"{label}: {elapsed:.2f}秒, リクエスト {calls}回, 入力 {tokens}トークン")
+
 if __name__ == '__main__':
+    if "--benchmark-large" in sys.argv:
+        _run_large_input_benchmark()
+        sys.exit(0)
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+    if "--benchmark-batch" in sys.argv:
+        _run_batch_benchmark()
+        sys.exit(0)
+
     # このファイルを直接実行した際のテスト用コード
     print("--- 要約・タグ付けエージェント テスト実行 ---")
     
@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# --- 定数 ---
+# 移動ウィンドウの日数（短期・長期）
+TREND_SHORT_WINDOW_DAYS = int(os.environ.get("TREND_SHORT_WINDOW_DAYS", "7"))
+TREND_LONG_WINDOW_DAYS = int(os.environ.get("TREND_LONG_WINDOW_DAYS", "30"))
+# ツイートで紹介するタグの数
+TREND_TOP_TAGS = int(os.environ.get("TREND_TOP_TAGS", "3"))
+# 伸び率を計算する際に、直前の期間の件数がこれ未満のタグは「急増」として扱わない（少数の変動を除外する）
+TREND_MIN_PREVIOUS_COUNT = int(os.environ.get("TREND_MIN_PREVIOUS_COUNT", "2"))
+
+
+def _day_range(end_day: str, days: int) -> List[str]:
+    end = datetime.strptime(end_day, "%Y-%m-%d")
+    return [(end - timedelta(days=days - 1 - i)).strftime("%Y-%m-%d") for i in range(days)]
+
+
+def rolling_sums(counts: np.ndarray, window: int) -> np.ndarray:
+    """
+    日次の件数（行: タグ、列: 日付）から、各日を末尾とする移動合計を累積和でまとめて計算する。
+
+    Returns:
+        np.ndarray: countsと同じ形の配列。先頭のwindow-1日は、その日までの合計。
+    """
+    cumulative = np.cumsum(counts, axis=1)
+    shifted = np.zeros_like(cumulative)
+    shifted[:, window:] = cumulative[:, :-window]
+    return cumulative - shifted
+
+
+def compute_tag_trends(
+    tags: List[str],
+    counts: np.ndarray,
+    totals: np.ndarray,
+    short_window: int = TREND_SHORT_WINDOW_DAYS,
+    long_window: int = TREND_LONG_WINDOW_DAYS,
+) -> Dict:
+    """
+    タグごとの日次件数から、短期・長期の移動合計と伸び率を計算する。
+    countsは直近 long_window + short_window 日分（末尾が対象日）を想定する。
+
+    Args:
+        tags (List[str]): タグのリスト（countsの行に対応）。
+        counts (np.ndarray): タグごとの日次PR数 (タグ数 x 日数)。
+        totals (np.ndarray): 日次のPR数（タグの有無にかかわらず数えた件数）。
+
+    Returns:
+        Dict: 全体の件数と、タグごとの短期・長期の件数、直前の短期期間からの伸び率。
+    """
+    short_sums = rolling_sums(counts, short_window)
+    long_sums = rolling_sums(counts, long_window)
+    current = short_sums[:, -1]
+    previous = short_sums[:, -1 - short_window] if counts.shape[1] > short_window else np.zeros(len(tags))
+    # 直前の短期期間からの伸び率。直前が0件の場合は計算しない
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.where(previous > 0, (current - previous) / np.maximum(previous, 1), np.nan)
+    # 長期の平均ペースに対する、短期のペースの比
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pace = np.where(long_sums[:, -1] > 0, current / (long_sums[:, -1] * short_window / long_window), np.nan)
+
+    total_short = rolling_sums(totals[np.newaxis, :], short_window)[0]
+    total_long = int(totals[-long_window:].sum())
+    tag_stats = [
+        {
+            "tag": tag,
+            "short_window_count": int(current[i]),
+            "previous_short_window_count": int(previous[i]),
+            "long_window_count": int(long_sums[i, -1]),
+            "growth_rate": None if np.isnan(growth[i]) else round(float(growth[i]), 3),
+            "pace_ratio": None if np.isnan(pace[i]) else round(float(pace[i]), 3),
+        }
+        for i, tag in enumerate(tags)
+    ]
+    return {
+        "short_window_days": short_window,
+        "long_window_days": long_window,
+        "total_short_window_count": int(total_short[-1]),
+        "total_previous_short_window_count": int(total_short[-1 - short_window]) if len(totals) > short_window else 0,
+        "total_long_window_count": total_long,
+        "tags": tag_stats,
+    }
+
+
+def format_trend_comment(trends: Dict, top_n: int = TREND_TOP_TAGS) -> str:
+    """トレンドの集計結果から、3ツイート目 (3/3) の素材となるコメントを作成する。"""
+    if not trends or not trends["tags"] or trends["total_long_window_count"] == 0:
+        return ""
+    short_days = trends["short_window_days"]
+    long_days = trends["long_window_days"]
+    ranked = sorted(trends["tags"], key=lambda t: (-t["short_window_count"], -t["long_window_count"], t["tag"]))
+    top = [t for t in ranked if t["short_window_count"] > 0][:top_n]
+    rising = sorted(
+        [t for t in trends["tags"] if t["growth_rate"] is not None and t["growth_rate"] > 0
+         and t["previous_short_window_count"] >= TREND_MIN_PREVIOUS_COUNT],
+        key=lambda t: (-t["growth_rate"], t["tag"]),
+    )[:top_n]
+
+    lines = [f"直近{short_days}日間の更新は{trends['total_short_window_count']}件"
+             f"（その前の{short_days}日間: {trends['total_previous_short_window_count']}件、"
+             f"直近{long_days}日間: {trends['total_long_window_count']}件）。"]
+    if top:
+        lines.append(f"直近{short_days}日間で更新の多い分野: "
+                     + "、".join(f"{t['tag']}（{t['short_window_count']}件）" for t in top))
+    if rising:
+        lines.append("前の期間から伸びている分野: "
+                     + "、".join(f"{t['tag']}（+{t['growth_rate']:.0%}）" for t in rising))
+    return "\n".join(lines)
+
+
+def analyze_trends(
+    target_day: str,
+    today_pull_requests: Optional[List[Dict]] = None,
+    today_summaries: Optional[List[Dict]] = None,
+    store=None,
+) -> Dict:
+    """
+    保存済みの日次集計と、今回の実行で取得したPRから、対象日までのトレンドを分析する。
+    履歴全体ではなく直近 長期+短期 日分の日次集計だけを読むため、履歴が増えてもコストは一定である。
+    今回のPRはDBへの書き込み完了を待たずに、まだ保存されていないPRの件数だけを、そのマージ日の集計に加える
+    （同じ日の2回目以降の実行やWebhookのバッチでも、保存済みのPRを数え直したり取りこぼしたりしない）。
+
+    Args:
+        target_day (str): 対象日 (YYYY-MM-DD)。
+        today_pull_requests (List[Dict], optional): 今回の実行で取得したPR。
+        today_summaries (List[Dict], optional): 今回の要約結果。"pr_numbers" と "tags" を使う。
+        store (optional): 日次集計を読むストア。指定しない場合は共有のストアを使う。
+
+    Returns:
+        Dict: "trends"（集計結果）と "trend_comment"（3ツイート目の素材）。ストアが使えない場合は空の辞書。
+    """
+    from agents.db_saver import TARGET_REPO, _day_of, get_update_store
+    from utils.tags import canonicalize_tags
+
+    store = store or get_update_store()
+    if store is None:
+        return {}
+    days = _day_range(target_day, TREND_LONG_WINDOW_DAYS + TREND_SHORT_WINDOW_DAYS)
+    day_index = {day: i for i, day in enumerate(days)}
+
+    # 今回のPRを、DBと同じキー (リポジトリ名, 番号) とマージ日ごとにまとめる（PR番号はリポジトリをまたぐと重複する）
+    today_days = {
+        (pr.get("repo") or TARGET_REPO, pr["number"]): _day_of(pr["merged_at"])
+        for pr in today_pull_requests or [] if pr.get("merged_at")
+    }
+    today_tags: Dict[tuple, List[str]] = {}
+    for summary in today_summaries or []:
+        numbers = summary.get("pr_numbers") or []
+        repos = summary.get("pr_repos") or [TARGET_REPO] * len(numbers)
+        for key in zip(repos, numbers):
+            today_tags[key] = list(dict.fromkeys(canonicalize_tags(summary.get("tags") or [])))
+    try:
+        tag_rows, pr_rows, saved_keys = store.load_trend_snapshot(days[0], days[-1], list(today_days))
+    except Exception as e:
+        print(f"エラー: 日次集計の読み込み中にエラーが発生しました: {e}")
+        return {}
+
+    # 書き込みは非同期のため、まだ保存されていない（日次集計に含まれていない）PRだけを加える
+    for key, day in today_days.items():
+        if key in saved_keys or day not in day_index:
+            continue
+        pr_rows.append((day, 1))
+        tag_rows.extend((day, tag, 1) for tag in today_tags.get(key, []))
+
+    tags = sorted({row[1] for row in tag_rows})
+    tag_index = {tag: i for i, tag in enumerate(tags)}
+    counts = np.zeros((len(tags), len(days)), dtype=np.int64)
+    if tag_rows:
+        rows = np.array([tag_index[t] for _, t, _ in tag_rows])
+        cols = np.array([day_index[d] for d, _, _ in tag_rows])
+        np.add.at(counts, (rows, cols), np.array([c for _, _, c in tag_rows]))
+    totals = np.zeros(len(days), dtype=np.int64)
+    for day, count in pr_rows:
+        totals[day_index[day]] += count
+
+    trends = compute_tag_trends(tags, counts, totals)
+    trends["as_of"] = target_day
+    return {"trends": trends, "trend_comment": format_trend_comment(trends)}
+
+
+def target_day_of(target_date: Optional[str], pull_requests: List[Dict]) -> str:
+    """分析の対象日。日付の指定がない場合は、取得したPRのうち最も新しいマージ日（なければ今日）とする。"""
+    if target_date:
+        return target_date
+    merged = [pr["merged_at"][:10] for pr in pull_requests if pr.get("merged_at")]
+    return max(merged) if merged else datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _run_benchmark():
+    """
+    履歴の日数を増やしながら、1日分の書き込み（日次集計の更新を含む）とトレンド分析の時間を計測し、
+    毎回履歴全体を集計し直す方法と比較する。
+    """
+    import random
+    import tempfile
+    from agents.db_saver import UpdateStore
+
+    prs_per_day = 20
+    checkpoints = (100, 1000, 3000)
+    tags = ["教育", "科学技術", "経済", "医療", "子育て", "行政改革", "エネルギー", "デジタル", "外交", "農業"]
+    rng = random.Random(0)
+    store = UpdateStore(backend="sqlite", path=os.path.join(tempfile.mkdtemp(), "trends.sqlite3"))
+    start = datetime(2017, 1, 1)
+    number = 0
+    results = []
+
+    def make_day(day: str):
+        nonlocal number
+        prs, summaries = [], []
+        for _ in range(rng.randint(prs_per_day // 2, prs_per_day * 3 // 2)):
+            number += 1
+            prs.append({"number": number, "title": f"政策提案 {number}", "url": f"https://example.com/{number}",
+                        "author": "user", "body": "", "merged_at": f"{day}T{rng.randint(0, 23):02d}:00:00+00:00"})
+            summaries.append({"summary": "要約", "tags": rng.sample(tags, rng.randint(1, 2)), "pr_numbers": [number]})
+        return prs, summaries
+
+    def full_rescan(day: str) -> float:
+        # 比較用: 履歴全体のPRとタグを毎回読み直して集計する
+        started = time.perf_counter()
+        cursor = store._conn.execute(
+            "SELECT substr(p.merged_at, 1, 10), t.tag FROM pull_requests p JOIN pr_tags t ON t.pr_number = p.number"
+            " WHERE p.merged_at < ?", ((datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d"),))
+        aggregated: Dict[tuple, int] = {}
+        for key in cursor:
+            aggregated[key] = aggregated.get(key, 0) + 1
+        return time.perf_counter() - started
+
+    for i in range(max(checkpoints)):
+        day = (start + timedelta(days=i)).strftime("%Y-%m-%d")
+        prs, summaries = make_day(day)
+        if i + 1 not in checkpoints:
+            store.save_run(prs, summaries)
+            continue
+        # 計測する日は、数回の平均を取る
+        write_seconds, analyze_seconds = [], []
+        for _ in range(5):
+            started = time.perf_counter()
+            store.save_run(prs, summaries)
+            write_seconds.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            result = analyze_trends(day, prs, summaries, store=store)
+            analyze_seconds.append(time.perf_counter() - started)
+        assert result["trend_comment"]
+        results.append((i + 1, number, np.median(write_seconds), np.median(analyze_seconds), full_rescan(day)))
+
+    print("\n--- トレンド分析ベンチマーク結果 ---")
+    print(f"1日あたり約{prs_per_day}件のPR, タグ{len(tags)}種類")
+    for days, rows, write_seconds, analyze_seconds, rescan_seconds in results:
+        print(f"履歴 {days}日 ({rows}件): 1日分の書き込み+集計更新 {write_seconds * 1000:.1f}ms, "
+              f"トレンド分析 {analyze_seconds * 1000:.1f}ms, (比較) 履歴全体の再集計 {rescan_seconds * 1000:.1f}ms")
+    print("\n3ツイート目の素材の例:")
+    print(result["trend_comment"])
+
+
+if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+
+    print("--- トレンド分析エージェント テスト実行 ---")
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    result = analyze_trends(today)
+    print(result.get("trend_comment") or "保存済みの更新がありません。")
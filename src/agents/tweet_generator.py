@@ -1,11 +1,26 @@
 
 import os
+import sys
 import json
-import google.generativeai as genai
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 
+from utils.llm_cache import get_llm_cache, make_cache_key, set_cache_enabled
+from utils.llm_gateway import MODEL_NAME, get_gateway
+
 # --- 定数 ---
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+# 要約がこの件数を超える日は、タグごとのダイジェストを作ってから最終的なツイートを生成する
+HIERARCHICAL_THRESHOLD = int(os.environ.get("TWEET_HIERARCHICAL_THRESHOLD", "30"))
+# ダイジェストを作るグループ（タグ）の最大数。残りは「その他」にまとめる
+MAX_DIGEST_GROUPS = int(os.environ.get("TWEET_MAX_DIGEST_GROUPS", "8"))
+# 1回のダイジェスト生成に含める要約の最大件数
+DIGEST_BATCH_SIZE = int(os.environ.get("TWEET_DIGEST_BATCH_SIZE", "40"))
+# 最終的なツイート生成プロンプトに埋め込む更新リストの最大文字数
+MAX_FINAL_INPUT_CHARS = int(os.environ.get("TWEET_MAX_FINAL_INPUT_CHARS", "3000"))
+DIGEST_CONCURRENCY = int(os.environ.get("TWEET_DIGEST_CONCURRENCY", "4"))
+OTHER_GROUP_NAME = "その他"
 
 # --- プロンプトテンプレート ---
 PROMPT_TEMPLATE = """
@@ -72,42 +87,239 @@ PROMPT_TEMPLATE_SINGLE = """
 }}
 """
 
-def generate_tweets(summaries: List[Dict]) -> List[str]:
+# 同じトピックの要約をまとめて、1つのダイジェストにするためのプロンプト
+DIGEST_PROMPT_TEMPLATE = """
+# 役割 (Role):
+あなたは、政党のSNS広報を担当する、経験豊富な編集者です。
+
+# 目的 (Objective):
+以下は「{group_name}」に関する{count}件の政策更新の要約です。
+これらを、何が変わったのかが分かる200文字以内のダイジェストにまとめてください。
+
+# ルール (Rules):
+- 客観的な事実に徹し、あなたの意見や憶測は含めないでください。
+- 特に重要と思われる更新は、具体的に触れてください。
+- 出力は、必ず指定されたJSON形式に従ってください。
+
+# 政策更新の要約 (Input):
+{summaries_text}
+
+# 出力形式 (Output Format):
+"digest"（文字列）をキーに持つJSONオブジェクトで出力してください。
+{{
+  "digest": "..."
+}}
+"""
+
+# 評価で差し戻された1件のツイートだけを書き直すためのプロンプト
+REPAIR_PROMPT_TEMPLATE = """
+# 役割 (Role):
+あなたは、政党のSNS広報を担当する、経験豊富な編集長です。
+
+# 目的 (Objective):
+以下の連投ツイートのうち、ツイート{index}だけがレビューで差し戻されました。
+差し戻しの理由を解消するように、ツイート{index}だけを書き直してください。
+
+# ルール (Rules):
+- 承認済みのツイートは変更できません。承認済みのツイートと自然につながるように書き直してください。
+{position_rules}
+- 客観的かつ信頼できるトーンを保ってください。
+- 文字数は、日本語で280文字以内に厳守してください。
+- 出力は、必ず指定されたJSON形式に従ってください。
+- アイコンを入れないでください。
+- タグも入れないでください。
+- 熱意あるトーンにしないでください。そのため!は使わないこと。
+
+# 本日の政策更新リスト (Input):
+{summaries_text}
+
+# 現在の連投ツイート (Thread):
+{thread_text}
+
+# 差し戻されたツイート{index}の理由 (Reason):
+{reason}
+
+# 出力形式 (Output Format):
+"tweet"というキーを持つJSONオブジェクトで出力してください。"tweet"の値は、書き直したツイート{index}の本文（文字列）です。
+{{
+  "tweet": "ツイート{index}の本文..."
+}}
+"""
+
+# 書き直すツイートの位置ごとのルール（PROMPT_TEMPLATE / PROMPT_TEMPLATE_SINGLE と同じ）
+REPAIR_POSITION_RULES = {
+    (1, 1): "- 政策が持つ「背景」や「社会的意義」まで含めて、1ツイートで完結させてください。",
+    (1, 2): "- 全ての更新の要点を網羅し、箇条書きで簡潔に紹介してください。\n- 末尾に「(1/2)」と付けてください。\n- 最も重要と思われる更新について、次のツイートで詳しく解説することを予告してください。",
+    (2, 2): "- 【注目】から書き始めてください。\n- 1ツイート目で予告した更新について、その政策が持つ「背景」や「社会的意義」を、より詳しく解説してください。\n- 末尾に「(2/2)」と付けてください。",
+}
+
+# レスポンスのスキーマ
+TWEETS_SCHEMA = {
+    "type": "object",
+    "properties": {"tweets": {"type": "array", "items": {"type": "string"}}},
+    "required": ["tweets"],
+}
+DIGEST_SCHEMA = {"type": "object", "properties": {"digest": {"type": "string"}}, "required": ["digest"]}
+REPAIR_SCHEMA = {"type": "object", "properties": {"tweet": {"type": "string"}}, "required": ["tweet"]}
+
+def format_summaries_text(summaries: List[Dict]) -> str:
+    """
+    要約を箇条書きの更新リストにする。
+    複数のリポジトリの要約を含む場合は、リポジトリごとに見出しを付けてまとめる。
+    """
+    repos = list(dict.fromkeys(s.get("repo") for s in summaries))
+    if len(repos) <= 1:
+        return "\n".join(f"- {s['summary']}" for s in summaries)
+    lines = []
+    for repo in repos:
+        lines.append(f"{repo} の更新:")
+        lines.extend(f"- {s['summary']}" for s in summaries if s.get("repo") == repo)
+    return "\n".join(lines)
+
+def group_summaries_by_tag(summaries: List[Dict], max_groups: int = MAX_DIGEST_GROUPS) -> Dict[str, List[Dict]]:
+    """
+    要約をタグごとにグループ化する。
+    全体で出現回数の多い上位 (max_groups - 1) 件のタグをグループとし、各要約は自身のタグのうち
+    最も出現回数の多いグループに入る。どのグループにも属さない要約は「その他」にまとめる。
+
+    Returns:
+        Dict[str, List[Dict]]: グループ名 -> 要約のリスト（件数の多い順）。
+    """
+    tag_counts = Counter(tag for s in summaries for tag in dict.fromkeys(s.get("tags") or []))
+    top_tags = [tag for tag, _ in tag_counts.most_common(max(1, max_groups - 1))]
+    rank = {tag: i for i, tag in enumerate(top_tags)}
+
+    groups = {}
+    for summary in summaries:
+        candidates = [tag for tag in (summary.get("tags") or []) if tag in rank]
+        group_name = min(candidates, key=rank.get) if candidates else OTHER_GROUP_NAME
+        groups.setdefault(group_name, []).append(summary)
+    return dict(sorted(groups.items(), key=lambda item: len(item[1]), reverse=True))
+
+def _generate_digest(group_name: str, summaries: List[Dict], model) -> str:
+    """1つのグループ（最大DIGEST_BATCH_SIZE件）の要約からダイジェストを生成する。失敗時は空文字列を返す。"""
+    summaries_text = "\n".join(f"- {s['summary']}" for s in summaries)
+    cache = get_llm_cache()
+    cache_key = make_cache_key("tweet_digest", DIGEST_PROMPT_TEMPLATE, MODEL_NAME, group_name, summaries_text)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached["digest"]
+
+    prompt = DIGEST_PROMPT_TEMPLATE.format(group_name=group_name, count=len(summaries), summaries_text=summaries_text)
+    try:
+        digest = get_gateway(model).generate_json(prompt, DIGEST_SCHEMA)["digest"]
+    except Exception as e:
+        print(f"  - 「{group_name}」のダイジェスト生成中にエラーが発生しました: {e}")
+        return ""
+    if cache is not None:
+        cache.set(cache_key, {"digest": digest})
+    return digest
+
+def build_digest_text(summaries: List[Dict], model, max_chars: int = MAX_FINAL_INPUT_CHARS) -> str:
+    """
+    要約をタグごとにグループ化し、グループ単位のダイジェストを並行して生成して、
+    最終的なツイート生成プロンプトに埋め込む更新リストを作る。
+    更新リストの文字数は、要約の件数にかかわらずmax_chars以下に収まる。
+    ダイジェストを1つも生成できなかった場合は、要約の一覧をmax_charsで切り詰めて使う。
+    各グループの件数は、生成できたダイジェストが実際に扱っている要約の件数を示す。
+    """
+    groups = group_summaries_by_tag(summaries)
+    print(f"  - {len(summaries)}件の要約を{len(groups)}個のグループにまとめてダイジェストを生成します...")
+
+    # グループをDIGEST_BATCH_SIZE件ずつのジョブに分け、まとめて並行に処理する
+    jobs = [
+        (group_name, group[i:i + DIGEST_BATCH_SIZE])
+        for group_name, group in groups.items()
+        for i in range(0, len(group), DIGEST_BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, min(DIGEST_CONCURRENCY, len(jobs)))) as executor:
+        partial_digests = list(executor.map(lambda job: _generate_digest(job[0], job[1], model), jobs))
+
+    # グループ名 -> (ダイジェスト, そのダイジェストが扱う要約の件数) のリスト
+    digests_by_group = {}
+    for (group_name, job_summaries), digest in zip(jobs, partial_digests):
+        if digest:
+            digests_by_group.setdefault(group_name, []).append((digest, len(job_summaries)))
+    if not digests_by_group:
+        # 空の更新リストでツイートを生成すると、存在しない更新を含むスレッドができてしまう
+        print("警告: ダイジェストを1つも生成できなかったため、要約の一覧を切り詰めて使用します。")
+        return format_summaries_text(summaries)[:max_chars]
+
+    # 複数のジョブに分かれたグループは、ダイジェスト同士をさらにまとめる。
+    # まとめられなかった場合は、部分ダイジェストを並べて使う（後でグループあたりの文字数に切り詰める）
+    multi = [name for name, digests in digests_by_group.items() if len(digests) > 1]
+    if multi:
+        with ThreadPoolExecutor(max_workers=max(1, min(DIGEST_CONCURRENCY, len(multi)))) as executor:
+            merged = executor.map(
+                lambda name: _generate_digest(name, [{"summary": d} for d, _ in digests_by_group[name]], model), multi
+            )
+            for name, digest in zip(multi, merged):
+                digests = digests_by_group[name]
+                digests_by_group[name] = [(digest or " ".join(d for d, _ in digests), sum(n for _, n in digests))]
+
+    # グループあたりの文字数を均等に割り当て、全体をmax_chars以内に収める
+    per_group_chars = max_chars // max(1, len(digests_by_group))
+    lines = []
+    for group_name, [(digest, covered)] in digests_by_group.items():
+        total = len(groups[group_name])
+        # 一部のジョブのダイジェストが失敗したグループは、扱えた件数を明示する
+        count_text = f"{total}件" if covered == total else f"{total}件中{covered}件"
+        line = f"- 【{group_name}】({count_text}) {digest}"
+        lines.append(line[:per_group_chars])
+    return "\n".join(lines)[:max_chars]
+
+def generate_tweets(summaries: List[Dict], use_cache: bool = True, model=None, temperature: float = None) -> List[str]:
     """
     要約リストから、LLMを使って連投ツイートを生成する。
+    要約がHIERARCHICAL_THRESHOLD件を超える場合は、タグごとのダイジェストを素材にする。
 
     Args:
         summaries (List[Dict]): 各更新の要約とタグを含む辞書のリスト。
+        use_cache (bool): キャッシュ済みのツイートを再利用するかどうか。
+                          評価で差し戻された後の再生成ではFalseを指定する。
+        model (optional): 使用するモデル。指定しない場合は共有のGeminiモデルを使う。
+        temperature (float, optional): 生成時のtemperature。指定しない場合はモデルの既定値を使う。
 
     Returns:
         List[str]: 生成されたツイート文のリスト。失敗時は空のリストを返す。
     """
-    if not GEMINI_API_KEY:
-        print("エラー: 環境変数 GEMINI_API_KEY が設定されていません。")
-        return []
-    
     if not summaries:
         print("情報: 要約リストが空のため、ツイートは生成されません。")
         return []
 
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        #model = genai.GenerativeModel('gemini-pro')
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    gateway = get_gateway(model)
+    if gateway is None:
+        return []
 
-        # 更新が1件か複数かでプロンプトを切り替える
+    # 更新が1件か複数かでプロンプトを切り替える
+    if len(summaries) == 1:
+        template = PROMPT_TEMPLATE_SINGLE
+        summary_text = f"- {summaries[0]['summary']}"
+        prompt = PROMPT_TEMPLATE_SINGLE.format(summary_text=summary_text)
+    else:
+        template = PROMPT_TEMPLATE
+        if len(summaries) > HIERARCHICAL_THRESHOLD:
+            summary_text = build_digest_text(summaries, model)
+        else:
+            summary_text = format_summaries_text(summaries)
+        prompt = PROMPT_TEMPLATE.format(summaries_text=summary_text)
+
+    cache = get_llm_cache()
+    cache_key = make_cache_key("tweet_generator", template, MODEL_NAME, summary_text, str(temperature))
+    if cache is not None and use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print("  - キャッシュからツイートを取得しました")
+            return cached["tweets"]
+
+    try:
         if len(summaries) == 1:
-            summary_text = f"- {summaries[0]['summary']}"
-            prompt = PROMPT_TEMPLATE_SINGLE.format(summary_text=summary_text)
             print("LLMに単独ツイートの生成をリクエストしています...")
         else:
-            summaries_text = "\n".join([f"- {s['summary']}" for s in summaries])
-            prompt = PROMPT_TEMPLATE.format(summaries_text=summaries_text)
             print("LLMに連投ツイートの生成をリクエストしています...")
 
-        response = model.generate_content(prompt)
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-        result = json.loads(cleaned_response)
+        result = gateway.generate_json(prompt, TWEETS_SCHEMA, temperature=temperature)
 
         if "tweets" in result and isinstance(result["tweets"], list):
             print(f"  - {len(result['tweets'])}件のツイートを生成成功")
@@ -116,6 +328,8 @@ def generate_tweets(summaries: List[Dict]) -> List[str]:
                 print(tweet)
                 print(f"文字数: {len(tweet)}")
                 print("-" * 20)
+            if cache is not None:
+                cache.set(cache_key, {"tweets": result["tweets"]})
             return result["tweets"]
         else:
             print("エラー: LLMのレスポンスに必要なキーまたは正しい形式が含まれていません。")
@@ -125,7 +339,105 @@ def generate_tweets(summaries: List[Dict]) -> List[str]:
         print(f"LLMとの通信中にエラーが発生しました: {e}")
         return []
 
+def _select_relevant_summaries(summaries: List[Dict], tweet: str, limit: int = 3) -> List[Dict]:
+    """文字2-gramの重なりが大きい順に、ツイートが扱っている更新の要約を選ぶ。"""
+    def bigrams(text):
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    tweet_bigrams = bigrams(tweet)
+    ranked = sorted(summaries, key=lambda s: len(tweet_bigrams & bigrams(s["summary"])), reverse=True)
+    return ranked[:limit]
+
+def repair_tweet(summaries: List[Dict], tweets: List[str], index: int, reason: str, model=None) -> str:
+    """
+    評価で差し戻された1件のツイートだけを、承認済みのツイートを固定の文脈として書き直す。
+
+    Args:
+        summaries (List[Dict]): 各更新の要約とタグを含む辞書のリスト。
+        tweets (List[str]): 現在の連投ツイートのリスト。
+        index (int): 書き直すツイートの番号（1始まり）。
+        reason (str): 差し戻しの理由。
+        model (optional): 使用するモデル。指定しない場合は共有のGeminiモデルを使う。
+
+    Returns:
+        str: 書き直したツイート。失敗時は空文字列を返す。
+    """
+    gateway = get_gateway(model)
+    if gateway is None:
+        return ""
+
+    # 深掘り解説は1件の更新だけを扱うため、関連する要約だけを素材として渡す
+    if len(tweets) > 1 and index > 1:
+        summaries = _select_relevant_summaries(summaries, tweets[index - 1])
+    summaries_text = format_summaries_text(summaries)[:MAX_FINAL_INPUT_CHARS]
+    thread_text = "\n".join(
+        f"--- ツイート{i} ({'差し戻し' if i == index else '承認済み'}) ---\n{t}" for i, t in enumerate(tweets, 1)
+    )
+    prompt = REPAIR_PROMPT_TEMPLATE.format(
+        index=index,
+        position_rules=REPAIR_POSITION_RULES.get((index, len(tweets)), ""),
+        summaries_text=summaries_text,
+        thread_text=thread_text,
+        reason=reason,
+    )
+
+    try:
+        print(f"LLMにツイート{index}の書き直しをリクエストしています...")
+        tweet = gateway.generate_json(prompt, REPAIR_SCHEMA)["tweet"]
+        print(f"【ツイート {index}（書き直し）】")
+        print(tweet)
+        print(f"文字数: {len(tweet)}")
+        return tweet
+    except Exception as e:
+        print(f"LLMとの通信中にエラーが発生しました: {e}")
+        return ""
+
+def _run_benchmark():
+    """要約の件数を10件から1000件まで増やし、最終的なツイート生成リクエストのレイテンシと入力サイズを計測する。"""
+    from utils.fake_llm import FakeGenerativeModel
+    from utils.rate_limiter import estimate_tokens
+
+    set_cache_enabled(False)
+
+    def responder(prompt: str) -> str:
+        if '"digest"' in prompt:
+            return json.dumps({"digest": "複数の政策分野で制度の見直しが進みました。" * 3}, ensure_ascii=False)
+        return json.dumps({"tweets": ["ヘッドライン (1/2)", "【注目】深掘り解説 (2/2)"]}, ensure_ascii=False)
+
+    class TimedModel(FakeGenerativeModel):
+        """最終的なツイート生成リクエストだけの所要時間と入力トークン数を記録する。"""
+        final_seconds = 0.0
+        final_tokens = 0
+
+        def generate_content(self, prompt, **kwargs):
+            started = time.perf_counter()
+            response = super().generate_content(prompt, **kwargs)
+            if '"digest"' not in prompt:
+                self.final_seconds = time.perf_counter() - started
+                self.final_tokens = estimate_tokens(prompt)
+            return response
+
+    tags = ["教育", "科学技術", "子育て", "医療", "デジタル", "経済", "エネルギー", "行政改革", "地方創生", "防災", "福祉", "外交"]
+    print("\n--- 階層的ツイート生成ベンチマーク結果 ---")
+    for count in (10, 100, 1000):
+        summaries = [
+            {"summary": f"政策{i}の変更点と、その変更がもたらす影響についての要約です。", "tags": [tags[i % len(tags)], tags[(i * 7) % len(tags)]]}
+            for i in range(count)
+        ]
+        # 入力トークン数に比例して遅くなる偽モデル（1万トークンあたり1秒）
+        model = TimedModel(responder=responder, latency=0.02, latency_per_token=0.0001)
+        started = time.perf_counter()
+        tweets = generate_tweets(summaries, model=model)
+        elapsed = time.perf_counter() - started
+        assert tweets
+        print(f"要約 {count:>4}件: 最終リクエスト {model.final_seconds:.2f}秒 / 入力 {model.final_tokens}トークン, "
+              f"全体 {elapsed:.2f}秒 / リクエスト {model.call_count}回")
+
 if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+
     print("--- ツイート生成エージェント テスト実行 ---")
 
     # サンプルデータ（2件の更新）
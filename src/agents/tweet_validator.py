@@ -0,0 +1,109 @@
+import re
+import unicodedata
+from typing import List
+
+# --- 定数 ---
+MAX_TWEET_LENGTH = 280
+DEEP_DIVE_PREFIX = "【注目】"
+
+# ツイート生成プロンプトで禁止している表現（!、ハッシュタグ、絵文字などのアイコン）
+EXCLAMATION_PATTERN = re.compile(r"[!！]")
+# 「PR #6505」「#1」のような番号の参照はハッシュタグではないため、数字が続く「#」と語の途中の「#」は除く
+HASHTAG_PATTERN = re.compile(r"(?<!\w)[#＃](?![\d\s#＃]|$)")
+EMOJI_PATTERN = re.compile(
+    "[\U0001F000-\U0001FAFF"  # 絵文字・記号・ピクトグラフ
+    "☀-➿"           # その他の記号・装飾記号
+    "⬀-⯿"           # 矢印・星などの記号
+    "️‍]"           # 異体字セレクタ・ゼロ幅接合子
+)
+
+
+def _check_tweet(tweet: str) -> List[str]:
+    """1件のツイートについて、全てのツイートに共通するルールの違反理由を返す。"""
+    reasons = []
+    if len(tweet) > MAX_TWEET_LENGTH:
+        reasons.append(f"文字数が{MAX_TWEET_LENGTH}文字を超えています ({len(tweet)}文字)")
+    if EXCLAMATION_PATTERN.search(tweet):
+        reasons.append("「!」が含まれています")
+    if HASHTAG_PATTERN.search(tweet):
+        reasons.append("ハッシュタグが含まれています")
+    if EMOJI_PATTERN.search(tweet):
+        reasons.append("絵文字などのアイコンが含まれています")
+    return reasons
+
+
+def validate_tweets(tweets: List[str]) -> dict:
+    """
+    ツイート生成プロンプトの形式ルールを、LLMを使わずに検証する。
+    文字数、(1/2)・(2/2)の末尾、2ツイート目の【注目】、!・ハッシュタグ・絵文字の有無を確認する。
+
+    Args:
+        tweets (List[str]): 検証対象のツイート文字列のリスト。
+
+    Returns:
+        dict: evaluate_tweets と同じ "evaluation"・"reason"・"tweet_verdicts" に加え、ツイートごとの違反
+              ("violations": [{"index": 1始まりの番号, "reason": ...}]) を持つ辞書。
+    """
+    if not tweets:
+        return {"evaluation": "Needs Review", "reason": "ツイートがありません。", "tweet_verdicts": [], "violations": []}
+    if len(tweets) > 2:
+        # ツイート数の誤りは一部の書き直しでは直せないため、全てのツイートを差し戻す
+        reason = f"ツイート数が多すぎます ({len(tweets)}件)。"
+        return {
+            "evaluation": "Needs Review",
+            "reason": reason,
+            "tweet_verdicts": [
+                {"index": i, "evaluation": "Needs Review", "reason": reason} for i in range(1, len(tweets) + 1)
+            ],
+            "violations": [{"index": i, "reason": "想定外のツイートです"} for i in range(3, len(tweets) + 1)],
+        }
+
+    violations = []
+    for index, tweet in enumerate(tweets, 1):
+        reasons = _check_tweet(tweet)
+        # 全角の括弧や数字の揺れは許容する
+        normalized = unicodedata.normalize("NFKC", tweet).strip()
+        if len(tweets) == 2:
+            suffix = f"({index}/2)"
+            if not normalized.endswith(suffix):
+                reasons.append(f"末尾が「{suffix}」になっていません")
+            if index == 2 and not tweet.strip().startswith(DEEP_DIVE_PREFIX):
+                reasons.append(f"「{DEEP_DIVE_PREFIX}」から始まっていません")
+        for reason in reasons:
+            violations.append({"index": index, "reason": reason})
+
+    tweet_verdicts = []
+    for index in range(1, len(tweets) + 1):
+        reasons = [v["reason"] for v in violations if v["index"] == index]
+        if reasons:
+            tweet_verdicts.append({"index": index, "evaluation": "Needs Review", "reason": " / ".join(reasons)})
+        else:
+            tweet_verdicts.append({"index": index, "evaluation": "Approved", "reason": "形式ルールを満たしています。"})
+
+    if violations:
+        reason = " / ".join(f"ツイート{v['index']}: {v['reason']}" for v in violations)
+        return {"evaluation": "Needs Review", "reason": reason, "tweet_verdicts": tweet_verdicts, "violations": violations}
+    return {"evaluation": "Approved", "reason": "形式ルールを満たしています。", "tweet_verdicts": tweet_verdicts, "violations": []}
+
+
+if __name__ == '__main__':
+    print("--- ツイート形式チェック テスト実行 ---")
+
+    sample_tweets = [
+        "【本日の政策更新】\n・博士課程学生の経済支援を拡充\n・不登校の児童生徒への学習支援を明確化\n博士課程学生の支援について、次のツイートで詳しく解説します。(1/2)",
+        "【注目】博士課程の学生を「研究者」として位置づけ、生活費を賄える水準まで支援を引き上げます。(2/2)",
+    ]
+    print(validate_tweets(sample_tweets))
+
+    invalid_tweets = [
+        "本日の政策更新です! #チームみらい (1/2)",
+        "博士課程の学生支援を拡充します。",
+    ]
+    print(validate_tweets(invalid_tweets))
+
+    # PR番号などの「#」はハッシュタグとして扱わない
+    reference_tweets = [
+        "【本日の政策更新】\n・PR #6505 で博士課程学生の経済支援を拡充\n詳しくは次のツイートで解説します。(1/2)",
+        "【注目】#1 の論点は、生活費を賄える水準まで支援を引き上げることです。(2/2)",
+    ]
+    print(validate_tweets(reference_tweets))
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+# --- 定数 ---
+# 並行して処理する日数（ワーカースレッド数）
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "4"))
+
+
+def split_date_range(date_from: str, date_to: str) -> List[str]:
+    """
+    開始日から終了日まで（両端を含む）の日付を、1日ずつのジョブに分割する。
+
+    Returns:
+        List[str]: "YYYY-MM-DD" 形式の日付のリスト。
+    """
+    start = datetime.strptime(date_from, "%Y-%m-%d")
+    end = datetime.strptime(date_to, "%Y-%m-%d")
+    if end < start:
+        raise ValueError(f"終了日が開始日より前です: {date_from} - {date_to}")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+
+def _summarize_result(final_state: Dict) -> Dict:
+    """1日分の最終状態から、出力ファイルに書き出す項目だけを取り出す。"""
+    return {
+        "end_state": final_state.get("end_state"),
+        "pull_requests": [
+            {"number": pr["number"], "title": pr["title"], "url": pr["url"]}
+            for pr in final_state.get("pull_requests") or []
+        ],
+        "summaries": final_state.get("summaries") or [],
+        "tweets": final_state.get("generated_tweets") or [],
+        "evaluation": final_state.get("evaluation_result") or {},
+    }
+
+
+def run_backfill(
+    dates: List[str],
+    run_day: Callable[[str], Dict],
+    output_path: str,
+    max_workers: int = BACKFILL_WORKERS,
+) -> Dict:
+    """
+    日付ごとのジョブをスレッドプールで並行して実行し、終わった日から順に1行ずつJSONLファイルへ書き出す。
+    GitHubとGeminiのレートリミッターはプロセス内の全スレッドで共有される。
+    1日分の失敗は、その日の "error" として記録し、他の日の処理は続ける。
+
+    Args:
+        dates (List[str]): 処理する日付のリスト。
+        run_day (Callable[[str], Dict]): 日付を受け取り、その日のパイプラインの最終状態を返す関数。
+        output_path (str): 結果を書き出すJSONLファイルのパス。
+        max_workers (int): 並行して処理する日数。
+
+    Returns:
+        Dict: 成功・失敗した日数と所要時間、1分あたりの処理日数。
+    """
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    write_lock = threading.Lock()
+    started = time.perf_counter()
+    succeeded = 0
+    failed = 0
+
+    def run_job(date: str) -> Dict:
+        job_started = time.perf_counter()
+        try:
+            record = {"date": date, "status": "ok", **_summarize_result(run_day(date))}
+        except Exception as e:
+            record = {"date": date, "status": "error", "error": f"{type(e).__name__}: {e}",
+                      "traceback": traceback.format_exc()}
+        record["elapsed_seconds"] = round(time.perf_counter() - job_started, 3)
+        # 結果はメモリに溜めず、終わった日から順に書き出す。Futureには進捗の表示に使う項目だけを返す
+        with write_lock:
+            sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+            sink.flush()
+        return {key: record.get(key) for key in ("date", "status", "end_state", "error", "elapsed_seconds")}
+
+    print(f"--- バックフィル: {dates[0]} から {dates[-1]} までの{len(dates)}日分を最大{max_workers}並列で処理します ---")
+    with open(output_path, "a", encoding="utf-8") as sink:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(dates)))) as executor:
+            futures = [executor.submit(run_job, date) for date in dates]
+            for done_count, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                if record["status"] == "ok":
+                    succeeded += 1
+                else:
+                    failed += 1
+                elapsed = time.perf_counter() - started
+                remaining = elapsed / done_count * (len(dates) - done_count)
+                status = record.get("end_state") if record["status"] == "ok" else f"失敗 ({record['error']})"
+                print(f"[{done_count}/{len(dates)}] {record['date']}: {status} "
+                      f"({record['elapsed_seconds']:.1f}秒, 残り推定 {remaining:.0f}秒)")
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "days": len(dates),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed_seconds": elapsed,
+        "days_per_minute": len(dates) / elapsed * 60 if elapsed > 0 else 0.0,
+    }
+    print(f"--- バックフィル完了: 成功 {succeeded}日 / 失敗 {failed}日, {elapsed:.1f}秒 "
+          f"({stats['days_per_minute']:.1f}日/分), 出力: {output_path} ---")
+    return stats
+
+
+def _run_benchmark():
+    """
+    偽のGitHub取得と偽モデルで30日分のバックフィルを実行し、ワーカー数ごとの処理速度（日/分）を計測する。
+    GitHubとGeminiのレートリミッターは、実際の実行と同じく全ワーカーで共有する。
+    """
+    import random
+    import tempfile
+    import main
+    from utils.fake_llm import FakeGenerativeModel, ScriptedResponder, use_offline_settings
+    from utils.llm_gateway import set_default_model
+    from utils.rate_limiter import GITHUB_REQUESTS_PER_MINUTE, TokenBucket
+
+    # 偽モデルに対する呼び出しなので、Gemini APIのレートリミットによる待ちは計測から除外する
+    use_offline_settings()
+    github_limiter = None
+
+    def fake_fetch(date: str) -> List[Dict]:
+        # GitHub Search APIの1リクエスト分の遅延。10%の日は取得に失敗する
+        github_limiter.acquire()
+        time.sleep(0.05)
+        rng = random.Random(date)
+        if rng.random() < 0.1:
+            raise ConnectionError("偽GitHubの接続エラー")
+        return [
+            {"number": i, "title": f"{date} の政策提案 {i}", "body": f"### 政策概要\n* {date} の変更点 {i}",
+             "url": f"https://github.com/team-mirai/policy/pull/{i}"}
+            for i in range(rng.randint(0, 6))
+        ]
+
+    work_dir = tempfile.mkdtemp()
+    dates = split_date_range("2025-06-01", "2025-06-30")
+    results = []
+    for workers in (1, 2, 4, 8):
+        set_default_model(FakeGenerativeModel(responder=ScriptedResponder(), latency=0.05))
+        # GitHubのレートリミッターは、設定ごとに満杯の状態から全ワーカーで共有する
+        github_limiter = TokenBucket(GITHUB_REQUESTS_PER_MINUTE, GITHUB_REQUESTS_PER_MINUTE / 60.0)
+
+        def run_day(date):
+            state = main.make_initial_state(date, publish=False)
+            state["pull_requests"] = fake_fetch(date)
+            return main.run_pipeline(state, checkpoint_path=os.path.join(work_dir, f"checkpoints-{workers}.sqlite3"))
+
+        stats = run_backfill(dates, run_day, os.path.join(work_dir, f"backfill-{workers}.jsonl"), max_workers=workers)
+        results.append((workers, stats))
+
+    print("\n--- バックフィルベンチマーク結果 ---")
+    print(f"日数: {len(dates)}, GitHub取得の遅延: 0.05秒, LLM呼び出しの遅延: 0.05秒")
+    for workers, stats in results:
+        print(f"ワーカー数 {workers}: {stats['days_per_minute']:.0f}日/分 "
+              f"(成功 {stats['succeeded']}日 / 失敗 {stats['failed']}日, {stats['elapsed_seconds']:.1f}秒)")
+
+
+if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
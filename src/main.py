@@ -1,66 +1,306 @@
+import os
 import sys
+import time
+import argparse
+from datetime import datetime, timezone
 from typing import List, Dict, TypedDict, Union
-from langgraph.graph import StateGraph, END
 
 # エージェントの関数をインポート
-from agents.github_monitor import fetch_recent_merged_pull_requests
-from agents.summarizer import generate_summary_and_tags
-from agents.tweet_generator import generate_tweets
-from agents.evaluator import evaluate_tweets
-from agents.publisher import post_tweets
+# langgraph・PyGithub・google.generativeai・numpyは読み込みに時間がかかるため、
+# 実際に必要になる箇所（グラフの構築や各ノード）で初めてインポートする
+from agents.github_monitor import (
+    GITHUB_FETCH_BACKEND,
+    TARGET_REPO,
+    TARGET_REPOS,
+    advance_watermark,
+    fetch_merged_pull_requests_graphql,
+    fetch_new_merged_pull_requests,
+    fetch_recent_merged_pull_requests,
+    pull_request_key,
+)
+from agents.git_mirror import fetch_merged_pull_requests_from_mirror
+from agents.summarizer import SUMMARIZER_MODE, generate_summaries, generate_summaries_batched
+from agents.tweet_generator import generate_tweets, repair_tweet
+from agents.speculative import SPECULATIVE_CANDIDATES, generate_and_evaluate_speculatively
+from agents.tweet_validator import validate_tweets
+from agents.evaluator import evaluate_tweets, merge_tweet_verdicts
+from agents.outbox import STATUS_FAILED, STATUS_POSTED, drain_outbox, publish_thread
+from agents.db_saver import run_after_pending_writes, save_published_thread_async, save_run_async, wait_for_pending_writes
+from utils.cassette import active_cassette, remember, start_recording, start_replay, stop_cassette
+from utils.llm_cache import get_llm_cache, set_cache_enabled
+from utils.tags import canonicalize_tags
+from utils.spill_store import (
+    STREAM_CHUNK_SIZE, is_streaming, iter_chunks, load_spilled_fields, remove_spill_store, set_streaming,
+    spill_pull_requests,
+)
+from utils.metrics import instrument_node, set_node_profiler, write_report
+from utils.llm_gateway import default_gateway_stats, set_run_deadline
+
+# --- 定数 ---
+# 評価で差し戻された際に、ツイートを再生成する最大回数
+MAX_REGENERATIONS = int(os.environ.get("MAX_REGENERATIONS", "3"))
+# 実行開始からこの秒数を過ぎたら、再生成を打ち切る（GitHub Actionsの10分の制限に収めるため）
+RUN_DEADLINE_SECONDS = float(os.environ.get("RUN_DEADLINE_SECONDS", "480"))
+# グラフの各ノードの完了時点の状態（チェックポイント）の保存先
+CHECKPOINT_PATH = os.environ.get("GRAPH_CHECKPOINT_PATH", os.path.join(".cache", "checkpoints.sqlite3"))
+
+# 実行の終了状態
+END_STATE_PUBLISHED = "published"
+END_STATE_APPROVED = "approved"  # 承認されたが、投稿しない設定（バックフィルなど）のため投稿していない
+END_STATE_QUEUED = "queued"      # 承認されてアウトボックスに保存したが、まだ投稿していない（再試行待ちを含む）
+END_STATE_PUBLISH_FAILED = "publish_failed"
+END_STATE_NO_PULL_REQUESTS = "no_pull_requests"
+END_STATE_NO_TWEETS = "no_tweets"
+END_STATE_EVALUATION_FAILED = "evaluation_failed"
+END_STATE_REGENERATION_BUDGET_EXHAUSTED = "regeneration_budget_exhausted"
+END_STATE_DEADLINE_EXCEEDED = "deadline_exceeded"
 
 # --- 1. 状態 (State) の定義 ---
 # エージェント間で共有される情報
 class AppState(TypedDict):
-    pull_requests: List[Dict]  # GitHub監視エージェントからのPR情報
-    summaries: List[Dict]     # 要約・タグ付けエージェントからの要約とタグ
+    pull_requests: List[Dict]  # GitHub監視エージェントからのPR情報（"repo" に取得元のリポジトリ名を持つ）。ストリーミングモードでは本文と差分の代わりに "body_ref" を持つ
+    deduplicated_pull_requests: List[Dict] # ほぼ同一のPRをまとめた代表PR（"duplicates"に同一とみなしたPRを持つ）
+    dedupe_stats: Dict        # 重複集約の統計情報（削減できたLLM呼び出し数など）
+    summaries: List[Dict]     # 要約・タグ付けエージェントからの要約とタグ（"repo" と "pr_repos" に取得元のリポジトリ名を持つ）
     generated_tweets: List[str] # ツイート生成エージェントからのツイート文案
     evaluation_result: Dict   # 評価エージェントからの評価結果
     target_date: str          # 取得対象の日付 (YYYY-MM-DD)
-    # フェーズ2で追加される項目:
-    # db_save_result:
-    # trend_comment: str
+    regeneration_count: int   # 評価で差し戻されてツイートを再生成（または一部を書き直し）した回数
+    repaired_indices: List[int] # 直前に書き直したツイートの番号（1始まり）。次の評価ではこれだけを再評価する
+    max_regenerations: int    # 再生成の上限回数
+    deadline: float           # 再生成を打ち切る時刻 (UNIX時間)
+    end_state: str            # 実行の終了状態 (END_STATE_*)
+    speculative_candidates: int # 並行して生成・評価する候補の数。1以下の場合は逐次に生成する
+    speculative_metrics: Dict # 直前の投機的生成のレイテンシとLLM呼び出し数
+    publish: bool             # 承認されたツイートを投稿するかどうか。バックフィルではFalse
+    dispatch_outbox: bool     # 承認されたスレッドをすぐに投稿するかどうか。Falseの場合はアウトボックスに保存するだけ
+    db_save_result: Dict      # DB保存の依頼状況。書き込み自体はバックグラウンドで行う
+    trend_stats: Dict         # タグごとの短期・長期の件数と伸び率
+    trend_comment: str        # トレンド分析のコメント（3ツイート目の素材）
 
 # --- 2. エージェント (Node) のラッパー関数定義 ---
 # 各エージェントの関数をLangGraphのノードとして機能させるためのラッパー
 
 def github_monitor_node(state: AppState) -> AppState:
     print("\n--- Node: GitHub監視エージェント ---")
-    pull_requests = fetch_recent_merged_pull_requests(target_date_str=state.get("target_date"))
+    # カセットの再生中は、記録した実行と同じ取得方法・リポジトリで取得する（環境変数の設定が異なってもよい）
+    backend = remember("github_fetch_backend", lambda: GITHUB_FETCH_BACKEND)
+    repo_names = remember("github_target_repos", lambda: TARGET_REPOS)
+    if backend == "graphql":
+        pull_requests = fetch_merged_pull_requests_graphql(repo_names, target_date_str=state.get("target_date"))
+    elif backend == "git":
+        # ミラーはリポジトリごとに持つため、リポジトリごとに取得する
+        pull_requests = [
+            pr for repo_name in repo_names
+            for pr in fetch_merged_pull_requests_from_mirror(repo_name, target_date_str=state.get("target_date"))
+        ]
+    elif state.get("target_date"):
+        pull_requests = fetch_recent_merged_pull_requests(repo_names, target_date_str=state.get("target_date"))
+    else:
+        # 日付指定がない場合は、前回処理したPRより新しいものだけを取得する
+        pull_requests = fetch_new_merged_pull_requests(repo_names)
+    if is_streaming():
+        # 本文と差分はディスクに書き出し、グラフの状態（とチェックポイント）には参照だけを持つ
+        pull_requests = spill_pull_requests(pull_requests, state.get("target_date") or "latest")
     return {"pull_requests": pull_requests}
 
+def deduplicator_node(state: AppState) -> AppState:
+    print("\n--- Node: 重複PR集約 ---")
+    from agents.deduplicator import collapse_near_duplicates
+    representatives, stats = collapse_near_duplicates(state["pull_requests"])
+    print(f"  - {stats['input_count']}件のPRを{stats['cluster_count']}件に集約しました "
+          f"(削減できたLLM呼び出し: {stats['llm_calls_saved']}回)")
+    return {"deduplicated_pull_requests": representatives, "dedupe_stats": stats}
+
 def summarizer_node(state: AppState) -> AppState:
     print("\n--- Node: 要約・タグ付けエージェント ---")
+    # 重複集約済みの代表PRだけを要約する
+    pull_requests = state.get("deduplicated_pull_requests", state["pull_requests"])
+    # ストリーミングモードでは、本文をディスクから STREAM_CHUNK_SIZE 件ずつ読み込んで要約する
+    chunk_size = STREAM_CHUNK_SIZE if is_streaming() else max(1, len(pull_requests))
     all_summaries = []
-    for pr in state["pull_requests"]:
+    for chunk in iter_chunks(pull_requests, chunk_size):
+        all_summaries.extend(_summarize_chunk(chunk))
+    return {"summaries": all_summaries}
+
+def _summarize_chunk(pull_requests: List[Dict]) -> List[Dict]:
+    texts_to_summarize = []
+    for pr in pull_requests:
+        fields = load_spilled_fields(pr)
         # PRのbodyが空の場合があるため、titleとbodyを結合して渡す
-        text_to_summarize = f"タイトル: {pr['title']}\n\n{pr['body']}"
-        summary_data = generate_summary_and_tags(text_to_summarize)
+        text = f"タイトル: {pr['title']}\n\n{fields.get('body') or ''}"
+        # ローカルミラーから取得した場合は、PR本文の代わりに差分も要約の材料にする
+        texts_to_summarize.append(f"{text}\n\n差分:\n{fields['diff']}" if fields.get("diff") else text)
+    # 並列に要約し、PRの順序を保ったまま失敗分（空の辞書）だけを除外する
+    if SUMMARIZER_MODE == "batch":
+        # PR番号はリポジトリをまたぐと重複するため、バッチ内の識別には連番を使う
+        results = generate_summaries_batched(list(enumerate(texts_to_summarize, 1)))
+    else:
+        results = generate_summaries(texts_to_summarize)
+    all_summaries = []
+    for pr, summary_data in zip(pull_requests, results):
         if summary_data:
-            all_summaries.append(summary_data)
-    return {"summaries": all_summaries}
+            # 代表PRと、同一とみなしたPRの番号・URL・リポジトリを要約に付与する
+            members = [{"number": pr["number"], "url": pr["url"], "repo": pr.get("repo")}] + pr.get("duplicates", [])
+            # タグは表記の揺れをそろえ、グループ化やトレンド分析で同じタグとして扱えるようにする
+            all_summaries.append(dict(
+                summary_data,
+                tags=canonicalize_tags(summary_data.get("tags") or []),
+                pr_numbers=[m["number"] for m in members],
+                pr_urls=[m["url"] for m in members],
+                pr_repos=[m.get("repo") or TARGET_REPO for m in members],
+                repo=pr.get("repo") or TARGET_REPO,
+            ))
+    return all_summaries
+
+def db_saver_node(state: AppState) -> AppState:
+    print("\n--- Node: DB保存エージェント ---")
+    # 書き込みはバックグラウンドで行い、ツイート生成・評価・投稿を待たせない
+    queued = save_run_async(state["pull_requests"], state.get("summaries", []))
+    if queued:
+        print(f"  - {len(state['pull_requests'])}件のPRと{len(state.get('summaries', []))}件の要約の保存を開始しました")
+    return {"db_save_result": {"status": "queued" if queued else "skipped"}}
+
+def trend_analyzer_node(state: AppState) -> AppState:
+    print("\n--- Node: トレンド分析エージェント ---")
+    # numpyの読み込みに時間がかかるため、ここで初めてインポートする
+    from agents.trend_analyzer import analyze_trends, target_day_of
+
+    target_day = target_day_of(state.get("target_date"), state["pull_requests"])
+    # 過去の集計はDBから読むため、カセットには分析結果を記録し、再生中はDBの代わりにそれを使う
+    result = remember(f"trends:{state.get('target_date') or 'latest'}",
+                      lambda: analyze_trends(target_day, state["pull_requests"], state.get("summaries", [])))
+    if result.get("trend_comment"):
+        print(f"  - {result['trend_comment']}")
+    return {"trend_stats": result.get("trends", {}), "trend_comment": result.get("trend_comment", "")}
 
 def tweet_generator_node(state: AppState) -> AppState:
     print("\n--- Node: ツイート生成エージェント ---")
-    # フェーズ1ではトレンド分析コメントは空文字列として渡す
-    generated_tweets = generate_tweets(state["summaries"])
-    return {"generated_tweets": generated_tweets}
+    # フェーズ1の2連投では、トレンド分析コメント (trend_comment) はまだツイートの素材にしない
+    # 評価で差し戻された後の再生成では、キャッシュ済みの同じツイートを返さないようにする
+    is_regeneration = bool(state.get("evaluation_result"))
+    generated_tweets = generate_tweets(state["summaries"], use_cache=not is_regeneration)
+    regeneration_count = state.get("regeneration_count", 0) + (1 if is_regeneration else 0)
+    return {"generated_tweets": generated_tweets, "regeneration_count": regeneration_count, "repaired_indices": []}
+
+def speculative_generator_node(state: AppState) -> AppState:
+    print("\n--- Node: ツイート生成エージェント（投機的生成） ---")
+    # 複数の候補を並行して生成・評価し、最初に承認された候補を採用する
+    is_regeneration = bool(state.get("evaluation_result"))
+    result = generate_and_evaluate_speculatively(state["summaries"], candidates=state["speculative_candidates"])
+    metrics = result["metrics"]
+    print(f"  - 候補数: {metrics['candidates']}, LLM呼び出し: {metrics['llm_calls']}回, "
+          f"打ち切った候補: {metrics['cancelled_candidates']}件, 所要時間: {metrics['total_seconds']:.1f}秒")
+    update = {
+        "generated_tweets": result["tweets"],
+        "regeneration_count": state.get("regeneration_count", 0) + (1 if is_regeneration else 0),
+        "repaired_indices": [],
+        "speculative_metrics": metrics,
+    }
+    if not result["tweets"]:
+        print("情報: 評価対象のツイートがありません。")
+        update.update({"evaluation_result": {}, "end_state": END_STATE_NO_TWEETS})
+        return update
+    update.update(_check_budget(dict(state, **update), result["evaluation_result"]))
+    return update
+
+def tweet_repairer_node(state: AppState) -> AppState:
+    print("\n--- Node: ツイート修正 ---")
+    # 差し戻されたツイートだけを、承認済みのツイートを固定の文脈として書き直す
+    tweets = list(state["generated_tweets"])
+    rejected = [v for v in state["evaluation_result"]["tweet_verdicts"] if v["evaluation"] != "Approved"]
+    repaired_indices = []
+    for verdict in rejected:
+        repaired = repair_tweet(state["summaries"], tweets, verdict["index"], verdict["reason"])
+        if repaired:
+            tweets[verdict["index"] - 1] = repaired
+            repaired_indices.append(verdict["index"])
+    if not repaired_indices:
+        # 1件も書き直せなかった場合は、スレッド全体を再生成する（再生成の回数はそちらで数える）
+        print("  - 書き直せたツイートがないため、スレッド全体を再生成します。")
+        return {"repaired_indices": []}
+    return {
+        "generated_tweets": tweets,
+        "regeneration_count": state.get("regeneration_count", 0) + 1,
+        "repaired_indices": repaired_indices,
+    }
+
+def _is_llm_evaluation(evaluation_result: Dict) -> bool:
+    """評価結果がLLMによるものかどうか。形式チェックの結果には "violations" が含まれる。"""
+    return bool(evaluation_result and evaluation_result.get("tweet_verdicts")) and "violations" not in evaluation_result
 
 def evaluator_node(state: AppState) -> AppState:
     print("\n--- Node: 評価エージェント ---")
-    evaluation_result = evaluate_tweets(state["generated_tweets"])
-    return {"evaluation_result": evaluation_result}
+    tweets = state["generated_tweets"]
+    if not tweets:
+        print("情報: 評価対象のツイートがありません。")
+        return {"evaluation_result": {}, "end_state": END_STATE_NO_TWEETS}
+
+    # 形式ルールの違反は、LLMを呼び出さずにその場で差し戻す
+    validation_result = validate_tweets(tweets)
+    repaired_indices = state.get("repaired_indices") or []
+    if validation_result["evaluation"] != "Approved":
+        print(f"  - 形式チェックで不合格のため、LLMによる評価を省略します: {validation_result['reason']}")
+        evaluation_result = validation_result
+    elif repaired_indices and _is_llm_evaluation(state.get("evaluation_result")):
+        # 書き直したツイートだけを再評価し、LLMが承認済みのツイートの評価はそのまま引き継ぐ
+        partial_result = evaluate_tweets(tweets, target_indices=repaired_indices)
+        if partial_result:
+            evaluation_result = merge_tweet_verdicts(
+                state["evaluation_result"]["tweet_verdicts"], partial_result["tweet_verdicts"]
+            )
+        else:
+            evaluation_result = {}
+    else:
+        evaluation_result = evaluate_tweets(tweets)
+
+    return _check_budget(state, evaluation_result)
+
+def _check_budget(state: AppState, evaluation_result: Dict) -> Dict:
+    """評価結果を状態に反映し、差し戻された場合は再生成の回数と実行時間の上限を確認する。"""
+    update = {"evaluation_result": evaluation_result}
+    if not evaluation_result:
+        update["end_state"] = END_STATE_EVALUATION_FAILED
+    elif evaluation_result.get("evaluation") != "Approved":
+        max_regenerations = state.get("max_regenerations", MAX_REGENERATIONS)
+        if state.get("regeneration_count", 0) >= max_regenerations:
+            update["end_state"] = END_STATE_REGENERATION_BUDGET_EXHAUSTED
+        elif state.get("deadline") and time.time() >= state["deadline"]:
+            update["end_state"] = END_STATE_DEADLINE_EXCEEDED
+    return update
 
 def publisher_node(state: AppState) -> AppState:
     print("\n--- Node: 投稿エージェント ---")
-    success = post_tweets(state["generated_tweets"])
-    # 投稿結果を状態に含めることも可能だが、今回は最終ノードなので不要
-    return {}
+    if state.get("publish") is False:
+        # 過去の日付をまとめて処理する場合は、投稿もハイウォーターマークの更新も行わない
+        print("投稿しない設定のため、承認されたツイートの投稿を省略します。")
+        return {"end_state": END_STATE_APPROVED}
+    pr_keys = [
+        pull_request_key({"repo": repo, "number": number})
+        for summary in state.get("summaries", [])
+        for repo, number in zip(summary.get("pr_repos") or [], summary.get("pr_numbers", []))
+    ]
+    # アウトボックスに保存してから投稿する。再開や再実行で同じスレッドが承認されても、二重には投稿しない
+    status = publish_thread(state.get("target_date"), state["generated_tweets"], metadata={"pr_keys": pr_keys},
+                            dispatch=state.get("dispatch_outbox", True), on_posted=_record_published_thread)
+    if status == STATUS_FAILED:
+        return {"end_state": END_STATE_PUBLISH_FAILED}
+    # アウトボックスに保存したスレッドは後で必ず投稿されるため、投稿待ちのPRも処理済みとして、ハイウォーターマークを進める
+    if not state.get("target_date"):
+        advance_watermark(state["pull_requests"])
+    return {"end_state": END_STATE_PUBLISHED if status == STATUS_POSTED else END_STATE_QUEUED}
+
+def _record_published_thread(thread: Dict) -> None:
+    """アウトボックスから投稿したスレッドを、紹介したPRのキーとともにDBに保存する。"""
+    save_published_thread_async(thread["target_date"], thread["tweets"], thread["metadata"].get("pr_keys", []))
 
 # --- 3. 条件分岐のロジック ---
 # 評価結果に基づいて次のノードを決定する
 def route_evaluation(state: AppState) -> str:
     print("\n--- Routing: 評価結果のルーティング ---")
+    if state.get("end_state") == END_STATE_NO_TWEETS:
+        print("投稿するツイートがありません。処理を終了します。")
+        return "end"
     if not state.get("evaluation_result"):
         print("評価結果が取得できませんでした。処理を終了します。")
         return "end"
@@ -71,62 +311,519 @@ def route_evaluation(state: AppState) -> str:
     if evaluation == "Approved":
         print(f"評価結果: Approved. 理由: {reason} -> 投稿エージェントへ")
         return "publisher"
+    elif state.get("end_state") == END_STATE_REGENERATION_BUDGET_EXHAUSTED:
+        print(f"評価結果: Needs Review. 理由: {reason} -> 再生成の上限回数に達したため、処理を中断します。")
+        return "end"
+    elif state.get("end_state") == END_STATE_DEADLINE_EXCEEDED:
+        print(f"評価結果: Needs Review. 理由: {reason} -> 実行時間の上限に達したため、処理を中断します。")
+        return "end"
+    verdicts = state["evaluation_result"].get("tweet_verdicts") or []
+    rejected = [v for v in verdicts if v["evaluation"] != "Approved"]
+    # 書き直すのは、差し戻されたツイートと承認されたツイートが混在する場合だけ。
+    # 全体の評価とツイートごとの評価が食い違う（全ツイートが承認されている）場合は、書き直す対象がないため再生成する
+    if rejected and len(rejected) < len(verdicts):
+        print(f"評価結果: Needs Review. 理由: {reason} -> 差し戻されたツイートだけを書き直します。")
+        return "tweet_repairer"
     else:
         print(f"評価結果: Needs Review. 理由: {reason} -> 再度ツイートを生成します。")
         # ここで人間への通知などの処理を追加することも可能
         return "tweet_generator"
 
+def _is_speculative(state: AppState) -> bool:
+    return state.get("speculative_candidates", SPECULATIVE_CANDIDATES) > 1
+
+def route_generation(state: AppState) -> str:
+    # 候補数が2以上の場合は、投機的生成のノードでツイートを生成する
+    return "speculative_generator" if _is_speculative(state) else "tweet_generator"
+
+def route_repair(state: AppState) -> str:
+    # 書き直したツイートがあれば再評価し、なければスレッド全体を再生成する
+    if state.get("repaired_indices"):
+        return "evaluator"
+    return route_generation(state)
+
+def route_regeneration(state: AppState) -> str:
+    # 再生成も、最初の生成と同じ方法で行う
+    next_node = route_evaluation(state)
+    if next_node == "tweet_generator":
+        return route_generation(state)
+    return next_node
+
 # --- 4. LangGraphの構築 ---
 
-def build_graph():
+def build_graph(entry_point: str = "github_monitor", checkpointer=None):
+    """
+    LangGraphのワークフローを構築する。
+
+    Args:
+        entry_point (str): 開始ノード。PRを取得済みの場合は "deduplicator" を指定する。
+        checkpointer (optional): 各ノードの完了時点の状態を保存するチェックポインター。
+    """
+    from langgraph.graph import StateGraph, END
+
     workflow = StateGraph(AppState)
 
-    # ノードの追加
-    workflow.add_node("github_monitor", github_monitor_node)
-    workflow.add_node("summarizer", summarizer_node)
-    workflow.add_node("tweet_generator", tweet_generator_node)
-    workflow.add_node("evaluator", evaluator_node)
-    workflow.add_node("publisher", publisher_node)
+    # ノードの追加（各ノードは実行時間を計測するラッパーで包む）
+    workflow.add_node("github_monitor", instrument_node("github_monitor", github_monitor_node))
+    workflow.add_node("deduplicator", instrument_node("deduplicator", deduplicator_node))
+    workflow.add_node("summarizer", instrument_node("summarizer", summarizer_node))
+    workflow.add_node("db_saver", instrument_node("db_saver", db_saver_node))
+    workflow.add_node("trend_analyzer", instrument_node("trend_analyzer", trend_analyzer_node))
+    workflow.add_node("tweet_generator", instrument_node("tweet_generator", tweet_generator_node))
+    workflow.add_node("speculative_generator", instrument_node("speculative_generator", speculative_generator_node))
+    workflow.add_node("tweet_repairer", instrument_node("tweet_repairer", tweet_repairer_node))
+    workflow.add_node("evaluator", instrument_node("evaluator", evaluator_node))
+    workflow.add_node("publisher", instrument_node("publisher", publisher_node))
 
     # エッジ（処理の流れ）の定義
-    workflow.set_entry_point("github_monitor")
-    workflow.add_edge("github_monitor", "summarizer")
-    workflow.add_edge("summarizer", "tweet_generator")
+    workflow.set_entry_point(entry_point)
+    workflow.add_edge("github_monitor", "deduplicator")
+    workflow.add_edge("deduplicator", "summarizer")
+    workflow.add_edge("summarizer", "db_saver")
+    workflow.add_edge("db_saver", "trend_analyzer")
+    workflow.add_conditional_edges(
+        "trend_analyzer",
+        route_generation,
+        {"tweet_generator": "tweet_generator", "speculative_generator": "speculative_generator"},
+    )
     workflow.add_edge("tweet_generator", "evaluator")
-
-    # 条件付きエッジの追加
     workflow.add_conditional_edges(
-        "evaluator",
-        route_evaluation,
-        {
-            "publisher": "publisher",
-            "tweet_generator": "tweet_generator", # 評価がNGなら再生成
-            "end": END,
-        },
+        "tweet_repairer",
+        route_repair,
+        {"evaluator": "evaluator", "tweet_generator": "tweet_generator", "speculative_generator": "speculative_generator"},
     )
 
+    # 条件付きエッジの追加
+    evaluation_routes = {
+        "publisher": "publisher",
+        "tweet_generator": "tweet_generator", # 評価がNGなら再生成
+        "speculative_generator": "speculative_generator", # 投機的生成の場合は、候補を並行して再生成
+        "tweet_repairer": "tweet_repairer", # 一部のツイートだけがNGなら、そのツイートだけを書き直す
+        "end": END,
+    }
+    workflow.add_conditional_edges("evaluator", route_regeneration, evaluation_routes)
+    # 投機的生成のノードは評価まで済ませているため、直接ルーティングする
+    workflow.add_conditional_edges("speculative_generator", route_regeneration, evaluation_routes)
+
     # 最終ノードからのエッジ
     workflow.add_edge("publisher", END)
 
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
+
+# --- 5. チェックポイントからの再開 ---
+
+def make_initial_state(
+    target_date: str = None,
+    publish: bool = True,
+    max_regenerations: int = MAX_REGENERATIONS,
+    deadline_seconds: float = RUN_DEADLINE_SECONDS,
+    candidates: int = SPECULATIVE_CANDIDATES,
+    dispatch_outbox: bool = True,
+) -> Dict:
+    """1回の実行（1日分）の初期状態を作成する。再生成の期限は、この関数を呼び出した時刻から数える。"""
+    initial_state = {"target_date": target_date} if target_date else {}
+    initial_state.update({
+        "regeneration_count": 0,
+        "repaired_indices": [],
+        "max_regenerations": max_regenerations,
+        "deadline": time.time() + deadline_seconds,
+        "end_state": "",
+        "speculative_candidates": candidates,
+        "publish": publish,
+        "dispatch_outbox": dispatch_outbox,
+    })
+    return initial_state
+
+def _thread_config(target_date: str, thread_id: str = None) -> Dict:
+    """チェックポイントは取得対象の日付ごとに保存する。日付を指定しない実行は "latest" として扱う。"""
+    return {"configurable": {"thread_id": thread_id or f"target_date:{target_date or 'latest'}"}}
+
+def _open_checkpointer(path: str):
+    """SQLiteに保存するチェックポインターを作成する。"""
+    import sqlite3
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+def _is_resumable(state: Dict) -> bool:
+    """--resume で評価からやり直せる終了状態かどうかを返す。"""
+    return state.get("end_state") == END_STATE_EVALUATION_FAILED and bool(state.get("generated_tweets"))
+
+def _remove_spill_stores(state: Dict) -> None:
+    """
+    終了した実行のスピルストアを削除する。--resume で再開できる実行は、再開後に本文を読むため残す。
+    DB保存エージェントの書き込みはバックグラウンドで本文を読むため、削除はその書き込みが終わってから行う。
+    """
+    if _is_resumable(state):
+        return
+    names = {pr["body_ref"].rsplit(":", 1)[0] for pr in state.get("pull_requests") or [] if pr.get("body_ref")}
+    for name in names:
+        run_after_pending_writes(remove_spill_store, name)
+
+def _prepare_resume(app, config: Dict, deadline: float) -> bool:
+    """
+    保存済みのチェックポイントから再開できるよう準備する。
+    途中で異常終了した実行は、最後に完了したノードの次から再開する。評価に失敗して終了した実行は、評価からやり直す。
+
+    Returns:
+        bool: 再開できる場合はTrue。
+    """
+    snapshot = app.get_state(config)
+    if not snapshot.values:
+        print("再開できるチェックポイントがないため、最初から実行します。")
+        return False
+    if snapshot.next:
+        # 再開後の再生成が前回の期限で打ち切られないよう、期限だけを更新する
+        app.update_state(config, {"deadline": deadline})
+    elif _is_resumable(snapshot.values):
+        app.update_state(config, {"end_state": "", "deadline": deadline}, as_node="tweet_generator")
+    else:
+        print(f"前回の実行は完了しているため、最初から実行します (終了状態: {snapshot.values.get('end_state')})")
+        return False
+    print(f"チェックポイントから再開します: {', '.join(app.get_state(config).next)}")
+    return True
+
+def run_pipeline(
+    initial_state: Dict,
+    resume: bool = False,
+    checkpoint_path: str = CHECKPOINT_PATH,
+    entry_point: str = "deduplicator",
+    thread_id: str = None,
+) -> Dict:
+    """
+    パイプライン全体を実行し、最終的な状態を返す。
+    各ノードの完了時点の状態を取得対象の日付ごとに保存し、resume=Trueの場合は前回の続きから実行する。
+    ストリーミングモードのスピルストアは、再開できない状態で終了した場合に削除する（異常終了した場合は残す）。
+
+    Args:
+        initial_state (Dict): 初期状態。"pull_requests" を含む場合は、GitHubからの取得を省略する。
+        resume (bool): 保存済みのチェックポイントから再開するかどうか。
+        checkpoint_path (str): チェックポイントの保存先。
+        entry_point (str): 開始ノード。要約済みのPRから始める場合は "db_saver" を指定する。
+        thread_id (str, optional): チェックポイントの保存単位。省略時は取得対象の日付ごと。
+    """
+    config = _thread_config(initial_state.get("target_date"), thread_id)
+    checkpointer = None
+    try:
+        if resume:
+            checkpointer = _open_checkpointer(checkpoint_path)
+            app = build_graph(entry_point="deduplicator", checkpointer=checkpointer)
+            if _prepare_resume(app, config, initial_state["deadline"]):
+                final_state = app.invoke(None, config)
+                _remove_spill_stores(final_state)
+                return final_state
+
+        # PRの取得だけを先に行い、新しいPRがない日はグラフの構築とLLMの準備を省略する
+        if "pull_requests" not in initial_state:
+            initial_state = dict(initial_state, **instrument_node("github_monitor", github_monitor_node)(initial_state))
+        if not initial_state["pull_requests"]:
+            print("新しいマージ済みPull Requestがないため、処理を終了します。")
+            return dict(initial_state, end_state=END_STATE_NO_PULL_REQUESTS)
+
+        if checkpointer is None:
+            checkpointer = _open_checkpointer(checkpoint_path)
+        # 同じ日付の古いチェックポイントは破棄してから実行する
+        checkpointer.delete_thread(config["configurable"]["thread_id"])
+        app = build_graph(entry_point=entry_point, checkpointer=checkpointer)
+        final_state = app.invoke(initial_state, config)
+        _remove_spill_stores(final_state)
+        return final_state
+    finally:
+        if checkpointer is not None:
+            checkpointer.conn.close()
+
+def summarize_pull_request(pull_request: Dict) -> List[Dict]:
+    """Webhookで届いたPR 1件を、日次の実行と同じ要約エージェントで要約する。"""
+    return summarizer_node({"pull_requests": [pull_request]})["summaries"]
+
+def run_webhook_batch(
+    pull_requests: List[Dict],
+    summaries: List[Dict],
+    batch_id: str,
+    publish: bool = True,
+    checkpoint_path: str = CHECKPOINT_PATH,
+) -> Dict:
+    """
+    要約済みのPRをまとめて、DB保存からツイート生成・評価・投稿までを実行する。
+    重複の除去と要約は受信時に済んでいるため、グラフは db_saver から始める。
+    チェックポイントはバッチごとの使い捨てのスレッドに保存するため、再開できない状態で終了した場合は削除する。
+    """
+    state = make_initial_state(publish=publish)
+    state.update({"pull_requests": pull_requests, "deduplicated_pull_requests": pull_requests,
+                  "summaries": summaries})
+    final_state = run_pipeline(state, checkpoint_path=checkpoint_path, entry_point="db_saver", thread_id=batch_id)
+    if not _is_resumable(final_state):
+        # 常駐中にバッチの数だけチェックポイントが増え続けないようにする
+        checkpointer = _open_checkpointer(checkpoint_path)
+        try:
+            checkpointer.delete_thread(batch_id)
+        finally:
+            checkpointer.conn.close()
+    return final_state
+
+def _run_resume_self_check():
+    """
+    偽モデルを使い、評価エージェントの途中で異常終了した実行を --resume で再開した場合に、
+    要約とツイート生成のLLM呼び出しが1回も発生しないことを確認する。
+    """
+    import tempfile
+    from utils.fake_llm import FakeGenerativeModel, ScriptedResponder, use_offline_settings
+
+    class SimulatedCrash(BaseException):
+        """プロセスの異常終了の代わり。各エージェントの except Exception では捕捉されない。"""
+
+    crash = {"evaluator": True}
+
+    def on_call(kind: str, prompt: str) -> None:
+        if kind == "evaluator" and crash["evaluator"]:
+            raise SimulatedCrash()
+
+    responder = ScriptedResponder(summary="博士課程の学生への支援を拡充します。", tags=["科学技術"], on_call=on_call)
+    calls = responder.calls
+    use_offline_settings(FakeGenerativeModel(responder=responder))
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), "checkpoints.sqlite3")
+    initial_state = make_initial_state("2025-07-16", deadline_seconds=60, candidates=1)
+    initial_state["pull_requests"] = [{"number": 6505, "title": "博士課程の学生に対する政策を大幅に拡充",
+                                       "body": "### 政策概要", "url": "https://github.com/team-mirai/policy/pull/6505"}]
+    try:
+        run_pipeline(initial_state, checkpoint_path=checkpoint_path)
+        raise AssertionError("評価エージェントで異常終了しませんでした")
+    except SimulatedCrash:
+        pass
+    assert calls == {"summarizer": 1, "tweet_generator": 1, "tweet_repairer": 0, "evaluator": 1}, calls
+
+    crash["evaluator"] = False
+    final_state = run_pipeline({"target_date": "2025-07-16", "deadline": time.time() + 60},
+                               resume=True, checkpoint_path=checkpoint_path)
+    assert final_state["end_state"] == END_STATE_PUBLISHED, final_state.get("end_state")
+    assert calls == {"summarizer": 1, "tweet_generator": 1, "tweet_repairer": 0, "evaluator": 2}, calls
+    print("\n--- セルフチェック成功: 再開後の要約・ツイート生成のLLM呼び出しは0回でした ---")
+
+def _date_argument(value: str) -> str:
+    """コマンドライン引数の日付 (YYYY-MM-DD) を検証する。"""
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"無効な日付形式です。YYYY-MM-DD形式で指定してください: {value}")
+    return value
+
+def _strip_option(argv: List[str], option: str) -> List[str]:
+    """コマンドライン引数から、値を1つ取るオプション（"--record PATH" や "--record=PATH"）を取り除く。"""
+    stripped = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True
+        elif not arg.startswith(f"{option}="):
+            stripped.append(arg)
+    return stripped
+
+def _prepare_replay(path: str, realtime: bool) -> tuple:
+    """
+    カセットの再生を始め、記録した実行のコマンドライン引数と、この実行だけで使う一時ディレクトリを返す。
+    再生は記録した実行の再現なので、LLMのキャッシュ・DB・アウトボックスは使わず、
+    チェックポイントやスピルストアなど手元に状態を残すものは一時ディレクトリに置く。
+    """
+    import tempfile
+    from utils import spill_store
+    from utils.fake_llm import use_offline_settings
+
+    cassette = start_replay(path, realtime=realtime)
+    print(f"カセットを再生します: {path} (記録日時: {cassette.header.get('recorded_at')}, "
+          f"引数: {' '.join(cassette.header.get('argv', [])) or 'なし'})")
+    # Gemini APIにはリクエストを送らないため、レートリミットで待たない
+    use_offline_settings()
+    work_dir = tempfile.mkdtemp(prefix="replay-")
+    spill_store.SPILL_DIR = os.path.join(work_dir, "spill")
+    return cassette.header.get("argv", []), work_dir
+
+def _finish_cassette() -> bool:
+    """
+    カセットの記録・再生を終えて、結果を表示する。記録中の場合はカセットを書き出す。
+
+    Returns:
+        bool: 再生中にカセットに記録されていないリクエストがあった場合はFalse。
+    """
+    cassette = active_cassette()
+    if cassette is None:
+        return True
+    stats = stop_cassette()
+    if not cassette.replaying:
+        print(f"カセット: {stats['recorded']}件のやり取りを記録しました: {cassette.path}")
+        return True
+    print(f"カセット: {stats['replayed']}件のやり取りを再生しました (同じエンドポイントの記録で代用 {stats['fallbacks']}件, "
+          f"記録にないリクエスト {stats['misses']}件)")
+    return stats["misses"] == 0
+
+def _print_metrics_report(report: Dict) -> None:
+    """計測結果のうち、時間のかかったノードとトークン数を表示する。"""
+    if not report:
+        return
+    summary = report["summary"]
+    slowest = list(summary["nodes"].items())[:3]
+    print("所要時間の長いノード: " + ", ".join(f"{node} {stats['seconds']:.1f}秒" for node, stats in slowest))
+    print(f"LLMトークン: 入力 {summary['llm']['input_tokens']:.0f} / 出力 {summary['llm']['output_tokens']:.0f}, "
+          f"レートリミットの待ち: {summary['rate_limit_wait_seconds']:.1f}秒")
+    print(f"計測結果: {report['json']} / {report['prometheus']}")
 
 # --- メイン処理 ---
 if __name__ == "__main__":
     print("--- LangGraphベースのツイート生成システムを開始します ---")
     
-    # コマンドライン引数から日付を取得
-    target_date = None
-    if len(sys.argv) > 1:
-        target_date = sys.argv[1]
-        print(f"指定された日付: {target_date}")
+    # コマンドライン引数から日付とオプションを取得
+    parser = argparse.ArgumentParser(description="チームみらい政策リポジトリ更新通知Bot")
+    parser.add_argument("target_date", nargs="?", type=_date_argument, help="取得対象の日付 (YYYY-MM-DD)。省略時は過去24時間。")
+    parser.add_argument("--no-cache", action="store_true", help="LLMレスポンスのキャッシュを使用しない")
+    parser.add_argument("--max-regenerations", type=int, default=MAX_REGENERATIONS, help="ツイートを再生成する最大回数")
+    parser.add_argument("--candidates", type=int, default=SPECULATIVE_CANDIDATES,
+                        help="並行して生成・評価するツイート候補の数。2以上で最初に承認された候補を採用する")
+    parser.add_argument("--deadline-seconds", type=float, default=RUN_DEADLINE_SECONDS, help="再生成を打ち切るまでの実行時間（秒）")
+    parser.add_argument("--resume", action="store_true", help="同じ日付の前回の実行を、最後に完了したノードの次から再開する")
+    parser.add_argument("--from", dest="date_from", type=_date_argument,
+                        help="バックフィルの開始日 (YYYY-MM-DD)。--to と合わせて、期間内の各日を並行して処理する")
+    parser.add_argument("--to", dest="date_to", type=_date_argument, help="バックフィルの終了日 (YYYY-MM-DD、この日を含む)")
+    parser.add_argument("--workers", type=int, default=None, help="バックフィルで並行して処理する日数")
+    parser.add_argument("--publish", action="store_true",
+                        help="バックフィルで承認されたスレッドをアウトボックスに保存し、全ての日の処理の後に投稿する")
+    parser.add_argument("--drain-outbox", action="store_true",
+                        help="アウトボックスの投稿待ちのスレッドを、再試行待ちの期限も待ちながら全て投稿する")
+    parser.add_argument("--output", help="バックフィルの結果を書き出すJSONLファイル。省略時は backfill-<開始日>-<終了日>.jsonl")
+    parser.add_argument("--profile-nodes", choices=["cprofile", "pyinstrument"],
+                        help="各ノードの実行をプロファイルし、METRICS_REPORT_DIR/profiles に保存する")
+    parser.add_argument("--streaming", action="store_true",
+                        help="PRの本文と差分をディスクに書き出し、グラフの状態には参照だけを持つ（大量のPRを処理する場合に使う）")
+    parser.add_argument("--serve", action="store_true",
+                        help="GitHubのWebhookを待ち受け、マージされたPRを届いた順に要約して、まとめて投稿する")
+    parser.add_argument("--record", metavar="PATH",
+                        help="GitHubとGeminiとのやり取りをカセットに記録する（--replay で同じ実行を再現できる）")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="カセットに記録した実行を、GitHubとGeminiにリクエストを送らずに再現する")
+    parser.add_argument("--replay-realtime", action="store_true",
+                        help="--replay で、記録時のレイテンシだけ待ってからレスポンスを返す（プロファイル用）")
+    parser.add_argument("--self-check", action="store_true", help="偽モデルでチェックポイントからの再開を確認する")
+    args = parser.parse_args()
+
+    if args.self_check:
+        _run_resume_self_check()
+        sys.exit(0)
+
+    checkpoint_path = CHECKPOINT_PATH
+    if args.record and args.replay:
+        parser.error("--record と --replay は同時には使用できません")
+    if args.replay:
+        recorded_argv, replay_dir = _prepare_replay(args.replay, args.replay_realtime)
+        # 記録した実行と同じ引数で実行する
+        args = parser.parse_args(recorded_argv)
+        args.replay = True
+        checkpoint_path = os.path.join(replay_dir, "checkpoints.sqlite3")
+    if args.record or args.replay:
+        if args.resume or args.serve or args.drain_outbox:
+            parser.error("--record/--replay は、--resume・--serve・--drain-outbox と同時には使用できません")
+    if args.record:
+        start_recording(args.record, argv=_strip_option(sys.argv[1:], "--record"))
+        print(f"GitHubとGeminiとのやり取りをカセットに記録します: {args.record}")
+        # キャッシュから返したレスポンスはカセットに残らないため、全てのリクエストをGeminiに送る
+        args.no_cache = True
+        if GITHUB_FETCH_BACKEND == "git":
+            print("警告: ミラーからの取得 (GITHUB_FETCH_BACKEND=git) はGitHub APIを使わないため、カセットには記録されません。")
 
-    app = build_graph()
+    if args.streaming:
+        set_streaming(True)
+    if args.no_cache:
+        print("LLMレスポンスのキャッシュを無効化しました。")
+        set_cache_enabled(False)
+    if args.profile_nodes:
+        set_node_profiler(args.profile_nodes)
+    run_name = datetime.now(timezone.utc).strftime("run-%Y%m%dT%H%M%SZ")
+
+    if args.publish and not (args.date_from or args.date_to):
+        parser.error("--publish はバックフィル (--from/--to) でのみ使用できます")
+    if args.drain_outbox:
+        stats = drain_outbox(on_posted=_record_published_thread)
+        wait_for_pending_writes()
+        print(f"アウトボックス: 投稿 {stats.get(STATUS_POSTED, 0)}件, 失敗 {stats.get(STATUS_FAILED, 0)}件")
+        sys.exit(1 if stats.get(STATUS_FAILED) else 0)
+
+    if args.serve:
+        if args.target_date or args.resume or args.date_from or args.date_to:
+            parser.error("--serve は、日付の指定や --resume、--from/--to と同時には使用できません")
+        from webhook_server import run_daemon
+        # 常駐するため、LLMへのリクエストには実行全体の期限を設けない（再生成の期限はバッチごと）
+        set_run_deadline(None)
+        run_daemon(summarize_pull_request, run_webhook_batch)
+        wait_for_pending_writes()
+        _print_metrics_report(write_report(f"serve-{run_name[len('run-'):]}"))
+        sys.exit(0)
+
+    if args.date_from or args.date_to:
+        if not (args.date_from and args.date_to):
+            parser.error("--from と --to は両方指定してください")
+        if args.target_date or args.resume:
+            parser.error("--from/--to は、日付の指定や --resume と同時には使用できません")
+        from backfill import BACKFILL_WORKERS, run_backfill, split_date_range
+        try:
+            dates = split_date_range(args.date_from, args.date_to)
+        except ValueError as e:
+            parser.error(str(e))
+
+        def run_day(date: str) -> Dict:
+            # 期限は日ごとに初期状態に持たせる。--publish の場合も、日ごとにはアウトボックスに保存するだけにする
+            state = make_initial_state(date, publish=args.publish, max_regenerations=args.max_regenerations,
+                                       deadline_seconds=args.deadline_seconds, candidates=args.candidates,
+                                       dispatch_outbox=False)
+            return run_pipeline(state, checkpoint_path=checkpoint_path)
+
+        # 複数の日を並行して処理するため、LLMへのリクエストには実行全体の期限を設けない
+        set_run_deadline(None)
+        output_path = args.output or f"backfill-{args.date_from}-{args.date_to}.jsonl"
+        if args.replay:
+            output_path = os.path.join(replay_dir, os.path.basename(output_path))
+        stats = run_backfill(dates, run_day, output_path, max_workers=args.workers or BACKFILL_WORKERS)
+        if args.publish:
+            # 投稿数の上限を守りながら、保存したスレッドを古い日付から順に投稿する
+            outbox_stats = drain_outbox(on_posted=_record_published_thread)
+            print(f"アウトボックス: 投稿 {outbox_stats.get(STATUS_POSTED, 0)}件, 失敗 {outbox_stats.get(STATUS_FAILED, 0)}件")
+        wait_for_pending_writes()
+        cassette_ok = _finish_cassette()
+        _print_metrics_report(write_report(f"backfill-{args.date_from}-{args.date_to}"))
+        sys.exit(1 if stats["failed"] or not cassette_ok else 0)
+
+    target_date = args.target_date
+    if target_date:
+        print(f"指定された日付: {target_date}")
 
     # グラフを実行
     # 環境変数にAPIキーが設定されていないとエラーになるため注意
-    initial_state = {"target_date": target_date} if target_date else {}
-    final_state = app.invoke(initial_state)
+    initial_state = make_initial_state(target_date, max_regenerations=args.max_regenerations,
+                                       deadline_seconds=args.deadline_seconds, candidates=args.candidates)
+    # LLMへの各リクエストのタイムアウトも、実行全体の期限までの残り時間に収める
+    set_run_deadline(initial_state["deadline"])
+
+    final_state = run_pipeline(initial_state, resume=args.resume, checkpoint_path=checkpoint_path)
 
     print("\n--- システム処理完了 ---")
+    print(f"終了状態: {final_state.get('end_state') or END_STATE_EVALUATION_FAILED}")
+    # PRがなかった日はLLMのキャッシュも開かない
+    cache = get_llm_cache() if final_state.get("end_state") != END_STATE_NO_PULL_REQUESTS else None
+    if cache is not None:
+        stats = cache.stats()
+        print(f"LLMキャッシュ: ヒット {stats['hits']}件 / ミス {stats['misses']}件 (保存件数: {stats['entries']})")
+    # バックグラウンドのDB書き込みの完了を待つ
+    db_results = wait_for_pending_writes()
+    saved = [r for r in db_results if "pull_requests" in r]
+    if saved:
+        print(f"DB保存: PR {sum(r['pull_requests'] for r in saved)}件, 要約 {sum(r['summaries'] for r in saved)}件, "
+              f"タグ {sum(r['tags'] for r in saved)}件")
+    gateway_stats = default_gateway_stats()
+    if gateway_stats is not None:
+        print(f"LLMリクエスト: {gateway_stats['requests']}件 (再試行 {gateway_stats['retries']}回, "
+              f"ヘッジ {gateway_stats['hedges']}回, 失敗 {gateway_stats['failures']}件)")
+    cassette_ok = _finish_cassette()
+    _print_metrics_report(write_report(run_name))
     # 最終的な状態を表示（デバッグ用）
-    # print(final_state)
\ No newline at end of file
+    # print(final_state)
+    if not cassette_ok:
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,395 @@
+import os
+import copy
+import gzip
+import json
+import time
+import atexit
+import hashlib
+import threading
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# --- 定数 ---
+CASSETTE_VERSION = 1
+# 記録しないレスポンスヘッダー（実行の再現に不要で、実行ごとに変わるもの）
+_IGNORED_HEADERS = {"date", "set-cookie", "x-github-request-id", "x-served-by", "server-timing", "age", "via"}
+
+
+class CassetteMissError(LookupError):
+    """再生中に、カセットに記録されていないリクエストを受け取った。"""
+
+
+class ReplayedAPIError(Exception):
+    """記録時にAPIが返したエラー。記録時の例外と同じく、HTTPステータスを "code" に持つ。"""
+
+    def __init__(self, code: Optional[int], message: str = ""):
+        super().__init__(message or f"{code} 記録されたAPIのエラー")
+        self.code = code
+
+
+class ReplayedUsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class ReplayedResponse:
+    """generate_content のレスポンスのうち、LLMゲートウェイが使う本文とトークン数だけを持つ。"""
+
+    def __init__(self, text: str, usage: Optional[Dict]):
+        self.text = text
+        self.usage_metadata = ReplayedUsageMetadata(**usage) if usage else None
+
+
+def _request_key(*parts: Any) -> str:
+    content = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    1回の実行でのGitHubへのHTTPリクエストと、Geminiの generate_content の呼び出しを記録・再生する。
+    記録したカセットは、1行目にヘッダー（実行時の引数など）、2行目以降にやり取り1件ずつを持つgzip圧縮のJSONLファイル。
+    認証情報はリクエストの識別に使わず、ファイルにも書き出さない。
+
+    再生では、リクエストの内容のハッシュが一致するやり取りを記録した順に返す。同じリクエストを記録より多く受け取った場合は、
+    最後のレスポンスを返す（ヘッジや再試行の回数が記録時と異なっても再生できるようにするため）。
+    GitHubへのリクエストは、現在時刻を含む検索クエリのように記録時と完全には一致しない場合に、
+    同じエンドポイント（クエリ文字列を除くURL）への未使用のやり取りを記録順に返す。
+
+    Args:
+        path (str): カセットのファイル。
+        mode (str): "record" または "replay"。
+        realtime (bool): 再生時に、記録時のレイテンシだけ待ってからレスポンスを返すかどうか。
+    """
+
+    def __init__(self, path: str, mode: str, realtime: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"不明なカセットのモードです: {mode}")
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self.header: Dict = {}
+        self._lock = threading.Lock()
+        self._interactions: List[Dict] = []
+        self._by_key: Dict[str, deque] = defaultdict(deque)
+        self._last_by_key: Dict[str, Dict] = {}
+        self._by_endpoint: Dict[Tuple[str, str], deque] = defaultdict(deque)
+        self.stats = {"recorded": 0, "replayed": 0, "fallbacks": 0, "misses": 0}
+        if mode == "replay":
+            self._load()
+        else:
+            self.header = {"version": CASSETTE_VERSION, "recorded_at": datetime.now(timezone.utc).isoformat(),
+                           "state": {}}
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            self.header = json.loads(f.readline())
+            if self.header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"対応していないカセットの形式です: {self.header.get('version')}")
+            for line in f:
+                interaction = json.loads(line)
+                interaction["used"] = False
+                self._interactions.append(interaction)
+                self._by_key[interaction["key"]].append(interaction)
+                self._by_endpoint[(interaction["kind"], interaction["endpoint"])].append(interaction)
+
+    def save(self) -> None:
+        """記録したやり取りを書き出す。一時ファイルに書いてから置き換えるため、途中で失敗しても前のカセットは壊れない。"""
+        if self.replaying:
+            return
+        with self._lock:
+            interactions = list(self._interactions)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with gzip.open(temporary_path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(self.header, ensure_ascii=False) + "\n")
+            for interaction in interactions:
+                f.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+        os.replace(temporary_path, self.path)
+
+    def _record(self, kind: str, key: str, endpoint: str, response: Dict, latency: float) -> None:
+        with self._lock:
+            self._interactions.append({"kind": kind, "key": key, "endpoint": endpoint,
+                                       "latency": round(latency, 4), "response": response})
+            self.stats["recorded"] += 1
+
+    def _replay(self, kind: str, key: str, endpoint: str) -> Dict:
+        with self._lock:
+            queue = self._by_key.get(key)
+            interaction = None
+            while queue:
+                candidate = queue.popleft()
+                if not candidate["used"]:
+                    interaction = candidate
+                    break
+            if interaction is None and kind == "http":
+                interaction = next((i for i in self._by_endpoint.get((kind, endpoint), ()) if not i["used"]), None)
+                if interaction is not None:
+                    self.stats["fallbacks"] += 1
+            if interaction is None:
+                interaction = self._last_by_key.get(key)
+            if interaction is None:
+                self.stats["misses"] += 1
+                raise CassetteMissError(f"カセットに記録されていないリクエストです: {kind} {endpoint}")
+            interaction["used"] = True
+            self._last_by_key[key] = interaction
+            self.stats["replayed"] += 1
+        if self.realtime:
+            time.sleep(interaction["latency"])
+        return interaction["response"]
+
+    def remember(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        実行の再現に必要な、ファイルなどのローカルの状態を記録・再生する（ハイウォーターマークなど）。
+        記録時は最初に呼び出された時点の値を保存し、再生時はその値の複製を返す。
+        """
+        if self.replaying:
+            with self._lock:
+                if name not in self.header.get("state", {}):
+                    raise CassetteMissError(f"カセットに記録されていない状態です: {name}")
+                return copy.deepcopy(self.header["state"][name])
+        value = factory()
+        with self._lock:
+            self.header["state"].setdefault(name, copy.deepcopy(value))
+        return value
+
+    def http(self, method: str, url: str, data: Optional[bytes],
+             perform: Callable[[], Tuple[int, Dict, bytes]]) -> Tuple[int, Dict, bytes]:
+        """
+        HTTPリクエスト1件を記録・再生する。perform は実際にリクエストを送り、(ステータス, ヘッダー, ボディ) を返す関数。
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        key = _request_key("http", method, url, hashlib.sha256(data or b"").hexdigest())
+        endpoint = f"{method} {url.split('?', 1)[0]}"
+        if self.replaying:
+            response = self._replay("http", key, endpoint)
+            return response["status"], dict(response["headers"]), response["body"].encode("utf-8")
+        started = time.perf_counter()
+        status, headers, body = perform()
+        self._record("http", key, endpoint, {
+            "status": status,
+            "headers": {name: value for name, value in headers.items() if name.lower() not in _IGNORED_HEADERS},
+            "body": body.decode("utf-8", errors="replace") if isinstance(body, bytes) else (body or ""),
+        }, time.perf_counter() - started)
+        return status, headers, body
+
+    def wrap_model(self, model) -> "CassetteModel":
+        """generate_content を記録・再生するモデルを返す。再生時は model を使わない（None でよい）。"""
+        return CassetteModel(self, model)
+
+
+class CassetteModel:
+    """
+    generate_content の呼び出しを記録・再生するモデル。LLMゲートウェイからは、元のモデルと同じように使える。
+    リクエストは、モデル名・プロンプト・生成設定で識別する（タイムアウトなどのリクエストオプションは含めない）。
+    """
+
+    def __init__(self, cassette: Cassette, model=None):
+        self.cassette = cassette
+        self.model = model
+        if model is not None:
+            self.model_name = getattr(model, "model_name", None) or type(model).__name__
+            cassette.header.setdefault("model_name", self.model_name)
+        else:
+            self.model_name = cassette.header.get("model_name", "replay")
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict] = None, **kwargs):
+        config = dict(generation_config) if generation_config else None
+        key = _request_key("generate_content", self.model_name, prompt, config)
+        if self.cassette.replaying:
+            response = self.cassette._replay("generate_content", key, self.model_name)
+            if "error" in response:
+                raise ReplayedAPIError(response["error"]["code"], response["error"]["message"])
+            return ReplayedResponse(response["text"], response.get("usage"))
+
+        started = time.perf_counter()
+        if generation_config is not None:
+            kwargs["generation_config"] = generation_config
+        try:
+            response = self.model.generate_content(prompt, **kwargs)
+            text = response.text
+        except Exception as e:
+            code = getattr(e, "code", None)
+            self.cassette._record("generate_content", key, self.model_name, {
+                "error": {"code": code if isinstance(code, int) else None, "message": str(e)},
+            }, time.perf_counter() - started)
+            raise
+        usage = getattr(response, "usage_metadata", None)
+        self.cassette._record("generate_content", key, self.model_name, {
+            "text": text,
+            "usage": {
+                "prompt_token_count": getattr(usage, "prompt_token_count", 0) or 0,
+                "candidates_token_count": getattr(usage, "candidates_token_count", 0) or 0,
+            } if usage is not None else None,
+        }, time.perf_counter() - started)
+        return response
+
+
+_active: Optional[Cassette] = None
+
+
+def active_cassette() -> Optional[Cassette]:
+    """記録中・再生中のカセットを返す。どちらでもない場合はNone。"""
+    return _active
+
+
+def remember(name: str, factory: Callable[[], Any]) -> Any:
+    """
+    カセットの記録中・再生中は Cassette.remember と同じく、ローカルの状態を記録・再生する。
+    それ以外の場合は factory() の値をそのまま返す。
+    """
+    cassette = _active
+    if cassette is None:
+        return factory()
+    return cassette.remember(name, factory)
+
+
+def start_recording(path: str, argv: Optional[List[str]] = None) -> Cassette:
+    """
+    カセットへの記録を始める。argv には、再生時に同じ実行を再現するためのコマンドライン引数を渡す。
+    プロセスの終了時に自動で書き出す。
+    """
+    global _active
+    _active = Cassette(path, "record")
+    _active.header["argv"] = list(argv or [])
+    atexit.register(stop_cassette)
+    return _active
+
+
+def start_replay(path: str, realtime: bool = False) -> Cassette:
+    """カセットの再生を始める。"""
+    global _active
+    _active = Cassette(path, "replay", realtime=realtime)
+    return _active
+
+
+def stop_cassette() -> Optional[Dict]:
+    """記録中のカセットを書き出して、記録・再生を終える。記録・再生したやり取りの件数を返す。"""
+    global _active
+    cassette, _active = _active, None
+    if cassette is None:
+        return None
+    cassette.save()
+    return dict(cassette.stats)
+
+
+def _run_self_check():
+    """
+    ローカルの偽GitHubサーバーと、レイテンシのある偽モデルを使って、GitHubからの取得からツイートの評価・投稿までを
+    カセットに記録する。偽GitHubサーバーを止めてから再生し、同じ要約・ツイート・終了状態になることと、
+    記録時より短い時間で終わること（--replay-realtime 相当では記録時と同程度かかること）を確認する。
+    """
+    import sys
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    # python -m で実行した場合、このモジュールは __main__ になるため、各エージェントが使う utils.cassette を操作する
+    from utils import cassette as cassette_module
+    import main
+    from agents.github_monitor import fetch_new_merged_pull_requests
+    from utils.fake_llm import FakeGenerativeModel, ScriptedResponder, use_offline_settings
+    from utils.llm_gateway import set_default_model
+
+    search_items = [
+        {"number": n, "title": f"政策提案 {n}", "body": f"### 政策概要\n* 教育の支援を拡充します。{n}",
+         "html_url": f"https://github.com/team-mirai/policy/pull/{n}",
+         "pull_request": {"merged_at": f"2025-07-19T0{n}:00:00Z"}, "user": {"login": f"user{n}"}}
+        for n in (1, 2, 3)
+    ]
+    github_calls = {"count": 0}
+
+    class FakeGitHubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            github_calls["count"] += 1
+            time.sleep(0.05)
+            body = json.dumps({"total_count": len(search_items), "items": search_items}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("ETag", f'"{github_calls["count"]}"')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    # レスポンスがプロンプトごとに異なるよう、プロンプトの長さを含める
+    responder = ScriptedResponder(
+        summary=lambda prompt: f"教育の支援を拡充します。({len(prompt)})",
+        tweets=lambda prompt: [f"教育の支援を拡充する政策提案がマージされました。({len(prompt)})"],
+    )
+
+    work_dir = tempfile.mkdtemp()
+    path = os.path.join(work_dir, "run.cassette")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def run(label: str) -> Dict:
+        # 各エージェントの出力は計測の邪魔になるため捨てる
+        original_stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        started = time.perf_counter()
+        try:
+            state = main.make_initial_state(deadline_seconds=60, candidates=1)
+            state["pull_requests"] = fetch_new_merged_pull_requests(
+                ["team-mirai/policy"], os.path.join(work_dir, "watermark.json"), api_url, token="dummy")
+            final_state = main.run_pipeline(state, checkpoint_path=os.path.join(work_dir, f"{label}.sqlite3"))
+        finally:
+            sys.stdout.close()
+            sys.stdout = original_stdout
+        final_state["elapsed"] = time.perf_counter() - started
+        return final_state
+
+    # LangGraphなどのモジュールの読み込みを記録時の所要時間に含めないよう、カセットを使わずに一度実行しておく
+    use_offline_settings(FakeGenerativeModel(responder=responder))
+    run("warm_up")
+    github_calls["count"] = 0
+    try:
+        cassette_module.start_recording(path, argv=[])
+        set_default_model(FakeGenerativeModel(responder=responder, latency=0.2))
+        recorded = run("record")
+        recorded_stats = cassette_module.stop_cassette()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert recorded["end_state"] == main.END_STATE_PUBLISHED, recorded.get("end_state")
+
+    results = {}
+    for label, realtime in (("replay", False), ("replay_realtime", True)):
+        cassette_module.start_replay(path, realtime=realtime)
+        # 再生中は、共有のモデルとしてカセットのレスポンスを返すモデルを使う
+        set_default_model(None)
+        results[label] = run(label)
+        replay_stats = cassette_module.stop_cassette()
+        assert replay_stats["misses"] == 0, replay_stats
+        for key in ("pull_requests", "summaries", "generated_tweets", "evaluation_result", "end_state"):
+            assert results[label].get(key) == recorded.get(key), (label, key)
+    assert results["replay"]["elapsed"] < recorded["elapsed"] / 2, (results["replay"]["elapsed"], recorded["elapsed"])
+    assert results["replay_realtime"]["elapsed"] > recorded["elapsed"] / 2, (results["replay_realtime"]["elapsed"], recorded["elapsed"])
+
+    # 記録にないプロンプトは、Geminiに送らずに CassetteMissError にする
+    replay = Cassette(path, "replay")
+    try:
+        replay.wrap_model(None).generate_content("記録していないプロンプト")
+        raise AssertionError("記録にないリクエストが再生されました")
+    except CassetteMissError:
+        pass
+
+    print("\n--- セルフチェック成功: 再生した実行の要約・ツイート・評価・終了状態は記録時と一致しました ---")
+    print(f"記録: {recorded_stats['recorded']}件のやり取り, {os.path.getsize(path)}バイト, {recorded['elapsed']:.2f}秒 "
+          f"(GitHubへのリクエスト {github_calls['count']}回)")
+    print(f"再生: {results['replay']['elapsed']:.2f}秒, 記録時のレイテンシを再現した再生: {results['replay_realtime']['elapsed']:.2f}秒")
+
+
+if __name__ == '__main__':
+    import sys
+    if "--self-check" in sys.argv:
+        _run_self_check()
+        sys.exit(0)
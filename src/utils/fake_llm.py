@@ -0,0 +1,200 @@
+import json
+import random
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Union
+
+from utils.rate_limiter import estimate_tokens
+
+
+def default_responder(prompt: str) -> str:
+    """要約・タグ付けエージェントが期待する形式の固定レスポンスを返す。"""
+    return json.dumps({"summary": "テスト用の要約です。", "tags": ["テスト"]}, ensure_ascii=False)
+
+
+# 評価エージェントのプロンプトだけに含まれる文言（agents/evaluator.py の PROMPT_TEMPLATE の冒頭）
+EVALUATOR_PROMPT_MARKER = "経験豊富なコンテンツレビュアー"
+
+# ツイート生成プロンプトの形式ルールを満たす、偽モデル用の連投ツイート
+SCRIPTED_TWEETS = [
+    "【本日の政策更新】\n・政策の変更点\n次のツイートで詳しく解説します。(1/2)",
+    "【注目】政策の背景と意義を解説します。(2/2)",
+]
+
+
+def prompt_kind(prompt: str) -> str:
+    """プロンプトを送ったエージェント（"evaluator"・"tweet_generator"・"tweet_repairer"・"summarizer"）を返す。"""
+    if EVALUATOR_PROMPT_MARKER in prompt:
+        return "evaluator"
+    if '"tweets"' in prompt:
+        return "tweet_generator"
+    if '"tweet"' in prompt:
+        return "tweet_repairer"
+    return "summarizer"
+
+
+class ScriptedResponder:
+    """
+    プロンプトを送ったエージェントごとに、そのエージェントが期待する形式の固定レスポンスを返す responder。
+    セルフチェックやベンチマークで、パイプライン全体を偽モデルで動かすために使う。
+    各レスポンスの値の代わりに、プロンプトを受け取って値を返す関数も渡せる。
+
+    Args:
+        summary: 要約・タグ付けエージェントへの要約。
+        tags: 要約・タグ付けエージェントへのタグ。
+        tweets: ツイート生成エージェントへのツイート。
+        repaired_tweet: ツイートの書き直しへのツイート。
+        evaluation: 評価エージェントへの評価結果 ("Approved" / "Needs Review")。ツイートごとの評価も同じにする。
+        on_call (Callable[[str, str], None], optional): レスポンスを返す前に、エージェントの種類とプロンプトを受け取る関数。
+                                                         遅延や異常終了の再現に使う。
+
+    Attributes:
+        calls (Dict[str, int]): エージェントの種類ごとの呼び出し回数。
+    """
+
+    def __init__(
+        self,
+        summary: Union[str, Callable[[str], str]] = "政策の変更点の要約です。",
+        tags: Union[List[str], Callable[[str], List[str]]] = ("教育",),
+        tweets: Union[List[str], Callable[[str], List[str]]] = tuple(SCRIPTED_TWEETS),
+        repaired_tweet: Union[str, Callable[[str], str]] = SCRIPTED_TWEETS[1],
+        evaluation: Union[str, Callable[[str], str]] = "Approved",
+        on_call: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.summary = summary
+        self.tags = tags
+        self.tweets = tweets
+        self.repaired_tweet = repaired_tweet
+        self.evaluation = evaluation
+        self.on_call = on_call
+        self.calls = {"summarizer": 0, "tweet_generator": 0, "tweet_repairer": 0, "evaluator": 0}
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str) -> str:
+        kind = prompt_kind(prompt)
+        with self._lock:
+            self.calls[kind] += 1
+        if self.on_call:
+            self.on_call(kind, prompt)
+        value = lambda v: v(prompt) if callable(v) else v
+        if kind == "evaluator":
+            evaluation = value(self.evaluation)
+            reason = "問題ありません。" if evaluation == "Approved" else "表現を見直してください。"
+            # 評価対象でないツイートの評価は、評価エージェント側で捨てられる
+            verdicts = [{"index": i, "evaluation": evaluation, "reason": reason} for i in range(1, len(SCRIPTED_TWEETS) + 1)]
+            return json.dumps({"evaluation": evaluation, "reason": reason, "tweets": verdicts}, ensure_ascii=False)
+        if kind == "tweet_generator":
+            return json.dumps({"tweets": list(value(self.tweets))}, ensure_ascii=False)
+        if kind == "tweet_repairer":
+            return json.dumps({"tweet": value(self.repaired_tweet)}, ensure_ascii=False)
+        return json.dumps({"summary": value(self.summary), "tags": list(value(self.tags))}, ensure_ascii=False)
+
+
+def use_offline_settings(model=None) -> None:
+    """
+    ネットワークを使わない実行（偽モデルでのセルフチェック・ベンチマーク、カセットの再生）のために、
+    LLMのキャッシュ・DB・アウトボックスを無効にし、Gemini APIのレートリミットによる待ちをなくす。
+
+    Args:
+        model (optional): 指定した場合、各エージェントが使う既定のモデルにする。
+    """
+    from agents.db_saver import set_db_enabled
+    from agents.outbox import set_outbox_enabled
+    from utils.llm_cache import set_cache_enabled
+    from utils.rate_limiter import GEMINI_RATE_LIMITER, TokenBucket
+
+    set_cache_enabled(False)
+    set_db_enabled(False)
+    set_outbox_enabled(False)
+    GEMINI_RATE_LIMITER.requests = TokenBucket(1e9, 1e9)
+    GEMINI_RATE_LIMITER.tokens = TokenBucket(1e12, 1e12)
+    if model is not None:
+        from utils.llm_gateway import set_default_model
+        set_default_model(model)
+
+
+class FakeAPIError(Exception):
+    """Gemini APIのエラー (google.api_core.exceptions) と同じく、HTTPステータスを "code" に持つ例外。"""
+
+    def __init__(self, code: int, message: str = ""):
+        super().__init__(f"{code} {message or '偽モデルのエラー'}")
+        self.code = code
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt: str):
+        self.text = text
+        self.usage_metadata = FakeUsageMetadata(estimate_tokens(prompt), estimate_tokens(text))
+
+
+class FakeGenerativeModel:
+    """
+    google.generativeai.GenerativeModel の代わりに使う、ネットワークを使わないモデル。
+    ベンチマークやオフラインでの動作確認に使用する。
+
+    Args:
+        responder (Callable[[str], str], optional): プロンプトを受け取りレスポンス本文を返す関数。
+        latency (float): 1回の呼び出しにかかる秒数。
+        latency_per_token (float): 入力1トークンあたりに追加でかかる秒数。
+        latency_per_output_token (float): 出力1トークンあたりに追加でかかる秒数。
+        latency_sampler (Callable[[random.Random], float], optional): 呼び出しごとに追加の遅延（秒）を返す関数。
+                                                                      裾の重いレイテンシ分布の再現に使う。
+        error_rate (float): 呼び出しがFakeAPIErrorで失敗する確率。
+        error_codes (Sequence[int]): 失敗時に使うHTTPステータスの候補。
+        seed (int): 遅延とエラーの乱数のシード。
+    """
+
+    def __init__(
+        self,
+        responder: Optional[Callable[[str], str]] = None,
+        latency: float = 0.0,
+        latency_per_token: float = 0.0,
+        latency_per_output_token: float = 0.0,
+        latency_sampler: Optional[Callable[[random.Random], float]] = None,
+        error_rate: float = 0.0,
+        error_codes: Sequence[int] = (429, 503),
+        seed: int = 0,
+    ):
+        self.responder = responder or default_responder
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.latency_per_output_token = latency_per_output_token
+        self.latency_sampler = latency_sampler
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self._rng = random.Random(seed)
+        self.error_count = 0
+        self.call_count = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs) -> FakeResponse:
+        with self._lock:
+            extra_delay = self.latency_sampler(self._rng) if self.latency_sampler else 0.0
+            error_code = self._rng.choice(self.error_codes) if self._rng.random() < self.error_rate else None
+        if error_code is not None:
+            with self._lock:
+                self.call_count += 1
+                self.error_count += 1
+            time.sleep(self.latency + extra_delay)
+            raise FakeAPIError(error_code)
+
+        prompt_tokens = estimate_tokens(prompt)
+        text = self.responder(prompt)
+        completion_tokens = estimate_tokens(text)
+        with self._lock:
+            self.call_count += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        delay = self.latency + extra_delay + self.latency_per_token * prompt_tokens + self.latency_per_output_token * completion_tokens
+        if delay:
+            time.sleep(delay)
+        return FakeResponse(text, prompt)
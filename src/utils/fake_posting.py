@@ -0,0 +1,89 @@
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+
+class FakePostingError(Exception):
+    """Twitter (X) APIのエラーと同じく、HTTPステータスを "code" に、待つべき秒数を "retry_after" に持つ例外。"""
+
+    def __init__(self, code: int, message: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"{code} {message or '偽の投稿APIのエラー'}")
+        self.code = code
+        self.retry_after = retry_after
+
+
+class FakePostingAPI:
+    """
+    Twitter (X) の投稿APIの代わりに使う、ネットワークを使わないクライアント。
+    アカウントごとの投稿数の上限（一定時間の窓あたりの件数）を超えると429を返し、
+    投稿した全てのツイートと返信先を記録する。アウトボックスのベンチマークやオフラインでの動作確認に使用する。
+
+    Args:
+        limit (int): 窓あたりの投稿数の上限。
+        window_seconds (float): 上限を数える窓の長さ（秒）。
+        latency (float): 1回の投稿にかかる秒数。
+        error_rate (float): 投稿がFakePostingErrorで失敗する確率。
+        error_codes (Sequence[int]): 失敗時に使うHTTPステータスの候補。
+        seed (int): 遅延とエラーの乱数のシード。
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        window_seconds: float = 900.0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_codes: Sequence[int] = (500, 503),
+        seed: int = 0,
+    ):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent: deque = deque()
+        self._next_id = 0
+        self.posts: Dict[str, Dict] = {}
+        self.rate_limited_count = 0
+        self.error_count = 0
+
+    def post(self, text: str, reply_to_id: Optional[str] = None) -> str:
+        """ツイートを1件投稿し、投稿IDを返す。reply_to_id を指定した場合は、そのツイートへの返信にする。"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - self.window_seconds:
+                self._recent.popleft()
+            if len(self._recent) >= self.limit:
+                self.rate_limited_count += 1
+                raise FakePostingError(429, "Too Many Requests",
+                                       retry_after=self._recent[0] + self.window_seconds - now)
+            if self._rng.random() < self.error_rate:
+                self.error_count += 1
+                raise FakePostingError(self._rng.choice(self.error_codes))
+            if reply_to_id is not None and reply_to_id not in self.posts:
+                raise FakePostingError(400, f"返信先のツイートが存在しません: {reply_to_id}")
+            self._recent.append(now)
+            self._next_id += 1
+            post_id = str(self._next_id)
+            self.posts[post_id] = {"text": text, "reply_to_id": reply_to_id}
+            return post_id
+
+    def threads(self) -> List[List[str]]:
+        """投稿されたツイートを、返信のつながりごとのスレッド（本文のリスト）にまとめて返す。"""
+        with self._lock:
+            children = {post["reply_to_id"]: post_id for post_id, post in self.posts.items() if post["reply_to_id"]}
+            roots = [post_id for post_id, post in self.posts.items() if post["reply_to_id"] is None]
+            threads = []
+            for post_id in roots:
+                thread = []
+                while post_id is not None:
+                    thread.append(self.posts[post_id]["text"])
+                    post_id = children.get(post_id)
+                threads.append(thread)
+            return threads
@@ -0,0 +1,58 @@
+import os
+import re
+import sys
+import subprocess
+
+# --- 定数 ---
+# main.py のインポートにかけてよい時間（ミリ秒、python -X importtime の累積値）
+IMPORT_TIME_BUDGET_MS = float(os.environ.get("IMPORT_TIME_BUDGET_MS", "200"))
+# 起動時に読み込んではいけない重いパッケージ。各ノードで初めて必要になった時点で読み込む
+LAZY_MODULES = ("langgraph", "github", "google.generativeai", "numpy")
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def measure_import_time(module: str = "main", cwd: str = None) -> dict:
+    """
+    新しいプロセスで `python -X importtime` を実行し、モジュールのインポートにかかった時間と読み込まれたモジュールを返す。
+
+    Returns:
+        dict: "cumulative_ms"（指定モジュールの累積時間）と "modules"（読み込まれたモジュール名 -> 累積時間(ms)）。
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2)) / 1000
+    return {"cumulative_ms": modules.get(module, 0.0), "modules": modules}
+
+
+def _run_self_check():
+    """main.py のコールドスタートが予算内に収まり、重いパッケージを読み込んでいないことを確認する。"""
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # 初回はバイトコードの生成を含むため、2回目以降の最小値で判定する
+    measure_import_time("main", cwd=src_dir)
+    measurements = [measure_import_time("main", cwd=src_dir) for _ in range(3)]
+    best = min(measurements, key=lambda m: m["cumulative_ms"])
+
+    loaded = [name for name in best["modules"] if any(name == m or name.startswith(m + ".") for m in LAZY_MODULES)]
+    slowest = sorted(best["modules"].items(), key=lambda item: item[1], reverse=True)[:5]
+    print("\n--- 起動時間チェック ---")
+    print(f"main のインポート: {best['cumulative_ms']:.0f}ms (予算: {IMPORT_TIME_BUDGET_MS:.0f}ms)")
+    print("累積時間の大きいモジュール: " + ", ".join(f"{name} {ms:.0f}ms" for name, ms in slowest))
+    assert not loaded, f"起動時に重いパッケージが読み込まれています: {loaded}"
+    assert best["cumulative_ms"] <= IMPORT_TIME_BUDGET_MS, (
+        f"main のインポートが予算を超えました: {best['cumulative_ms']:.0f}ms > {IMPORT_TIME_BUDGET_MS:.0f}ms"
+    )
+    print("--- セルフチェック成功: 起動時間は予算内です ---")
+
+
+if __name__ == '__main__':
+    _run_self_check()
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+from utils.metrics import increment
+
+# --- 定数 ---
+# キャッシュの保存先ディレクトリと上限（環境変数で上書き可能）
+CACHE_DIR = os.environ.get("LLM_CACHE_DIR", ".cache")
+CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_AGE_DAYS = float(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", "30"))
+
+
+def make_cache_key(*parts: str) -> str:
+    """
+    キャッシュキーを生成する。
+    プロンプトテンプレート、モデル名、入力テキストなどを連結したSHA-256ハッシュを返すため、
+    プロンプトを編集すると既存のエントリは自動的に参照されなくなる。
+    """
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\x1f")
+    return hasher.hexdigest()
+
+
+class LLMCache:
+    """
+    SQLiteを使った、LLMレスポンス（JSON）のコンテンツアドレス型キャッシュ。
+    初期化時に、期限切れと件数超過のエントリを削除する。
+    """
+
+    def __init__(self, path: str, max_entries: int = CACHE_MAX_ENTRIES, max_age_days: float = CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_accessed ON entries (last_accessed)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[dict]:
+        """キーに対応する値を返す。存在しない場合はNoneを返す。"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                increment("llm_cache_lookups_total", result="miss")
+                return None
+            self.hits += 1
+            increment("llm_cache_lookups_total", result="hit")
+            self._conn.execute("UPDATE entries SET last_accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict) -> None:
+        """値を保存する。同じキーが存在する場合は上書きする。"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created_at, last_accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """
+        max_age_daysより古いエントリを削除し、max_entriesを超えた分を最終参照の古い順に削除する。
+
+        Returns:
+            int: 削除したエントリ数。
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            )
+            removed = cursor.rowcount
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE key IN ("
+                " SELECT key FROM entries ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            removed += cursor.rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> dict:
+        """ヒット数・ミス数・保存件数を返す。"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
+
+
+_cache_enabled = True
+_default_cache: Optional[LLMCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def set_cache_enabled(enabled: bool) -> None:
+    """キャッシュの有効/無効を切り替える（--no-cache 用）。"""
+    global _cache_enabled
+    _cache_enabled = enabled
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    全エージェントで共有するキャッシュを返す。無効化されている場合はNoneを返す。
+    """
+    global _default_cache
+    if not _cache_enabled:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache(os.path.join(CACHE_DIR, "llm_cache.sqlite3"))
+    return _default_cache
@@ -0,0 +1,521 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+from utils.cassette import active_cassette
+from utils.metrics import increment
+from utils.rate_limiter import GEMINI_RATE_LIMITER, RateLimiter, estimate_tokens
+
+# --- 定数 ---
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+MODEL_NAME = 'gemini-1.5-flash-latest'
+# 429・5xxなどの一時的なエラーで再試行する最大回数
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "4"))
+# 再試行の待ち時間（指数バックオフ）の基準値と上限（秒）。実際の待ち時間は0〜この値の一様乱数（フルジッター）
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", "1.0"))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", "30.0"))
+# 1回のリクエストのタイムアウト（秒）。実行全体の期限が近い場合は、残り時間まで短くする
+LLM_CALL_TIMEOUT_SECONDS = float(os.environ.get("LLM_CALL_TIMEOUT_SECONDS", "60"))
+# レイテンシがこの分位点を超えたリクエストには、同じリクエストをもう1つ送り（ヘッジ）、先に返った方を使う
+LLM_HEDGE_QUANTILE = float(os.environ.get("LLM_HEDGE_QUANTILE", "0.95"))
+# ヘッジのしきい値を計算するのに必要な、成功したリクエストのレイテンシの件数
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGING_ENABLED = os.environ.get("LLM_HEDGING_ENABLED", "1") == "1"
+# リクエストを実行するスレッド数（ヘッジ分を含む）
+LLM_GATEWAY_MAX_WORKERS = int(os.environ.get("LLM_GATEWAY_MAX_WORKERS", "32"))
+
+# 再試行するHTTPステータス
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """LLMゲートウェイのエラーの基底クラス。"""
+
+
+class LLMTimeoutError(LLMError, TimeoutError):
+    """1回のリクエストがタイムアウトした。実行全体の期限内であれば再試行する。"""
+
+
+class LLMDeadlineExceeded(LLMError):
+    """実行全体の期限を過ぎたため、リクエストを送らなかった。"""
+
+
+class LLMResponseError(LLMError, ValueError):
+    """レスポンスがJSONとして解析できない、または必要なキーを持たない。"""
+
+
+# 実行全体の期限 (UNIX時間)。set_run_deadline で設定する
+_run_deadline = None
+# リクエストを実行する共有スレッドプール
+_executor = ThreadPoolExecutor(max_workers=LLM_GATEWAY_MAX_WORKERS, thread_name_prefix="llm-gateway")
+_lock = threading.Lock()
+_default_gateway = None
+_gateways = weakref.WeakKeyDictionary()
+
+
+def set_run_deadline(deadline: Optional[float]) -> None:
+    """実行全体の期限 (UNIX時間) を設定する。各リクエストのタイムアウトは、この期限までの残り時間に収める。"""
+    global _run_deadline
+    _run_deadline = deadline
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """google.api_core.exceptions などの例外から、HTTPステータスを取り出す。"""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    code = getattr(error, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def parse_json_response(text: str) -> Any:
+    """
+    LLMのレスポンスからJSONを取り出す。
+    "```json ... ```" のコードブロックや、前後の説明文が付いている場合も、最初のJSONの値を解析する。
+
+    Raises:
+        LLMResponseError: JSONが見つからない場合。
+    """
+    cleaned = text.strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", cleaned, re.DOTALL)
+    if fenced:
+        cleaned = fenced.group(1).strip()
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        pass
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"[\[{]", cleaned):
+        try:
+            value, _ = decoder.raw_decode(cleaned, match.start())
+            return value
+        except json.JSONDecodeError:
+            continue
+    raise LLMResponseError(f"レスポンスをJSONとして解析できませんでした: {text[:200]!r}")
+
+
+_JSON_TYPES = {
+    "object": dict, "array": list, "string": str, "integer": int, "number": (int, float), "boolean": bool,
+}
+
+
+def check_schema(value: Any, schema: Dict) -> None:
+    """
+    レスポンスがスキーマの最上位の型と必須キー（およびその型）を満たすかを確認する。
+    配列の要素など、より深い部分の検証は各エージェントで行う（一部の要素だけが不正な場合に、残りを活かすため）。
+
+    Raises:
+        LLMResponseError: スキーマを満たさない場合。
+    """
+    expected = _JSON_TYPES.get(schema.get("type"))
+    if expected and not isinstance(value, expected):
+        raise LLMResponseError(f"レスポンスの型が {schema['type']} ではありません: {str(value)[:200]!r}")
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                raise LLMResponseError(f"レスポンスに必要なキー「{key}」が含まれていません")
+            key_type = _JSON_TYPES.get(properties.get(key, {}).get("type"))
+            if key_type and not isinstance(value[key], key_type):
+                raise LLMResponseError(f"レスポンスの「{key}」の型が {properties[key]['type']} ではありません")
+
+
+class LLMGateway:
+    """
+    全エージェントで共有するLLMの呼び出し口。
+    レートリミット、429・5xxの再試行（指数バックオフ+ジッター）、実行全体の期限に基づくタイムアウト、
+    遅いリクエストのヘッジ、JSON出力の解析をまとめて扱う。複数スレッドから共有して使用する。
+
+    Args:
+        model: generate_content を持つモデル（google.generativeai.GenerativeModel や FakeGenerativeModel）。
+    """
+
+    def __init__(
+        self,
+        model,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE_SECONDS,
+        backoff_max: float = LLM_BACKOFF_MAX_SECONDS,
+        call_timeout: float = LLM_CALL_TIMEOUT_SECONDS,
+        hedging: bool = LLM_HEDGING_ENABLED,
+        hedge_quantile: float = LLM_HEDGE_QUANTILE,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+    ):
+        self.model = model
+        # 計測のラベルに使うモデル名
+        self.model_name = getattr(model, "model_name", None) or type(model).__name__
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.call_timeout = call_timeout
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self.counters = {"requests": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    def stats(self) -> Dict:
+        """呼び出し回数・再試行・ヘッジの件数と、現在のヘッジのしきい値を返す。"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats["hedge_threshold_seconds"] = self.hedge_threshold()
+        return stats
+
+    def hedge_threshold(self) -> Optional[float]:
+        """成功したリクエストのレイテンシの分位点。サンプルが足りない場合やヘッジが無効な場合はNone。"""
+        if not self.hedging:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_quantile))]
+
+    def _call_timeout(self) -> float:
+        timeout = self.call_timeout
+        if _run_deadline is not None:
+            remaining = _run_deadline - time.time()
+            if remaining <= 0:
+                raise LLMDeadlineExceeded("実行全体の期限を過ぎたため、LLMへのリクエストを中止しました")
+            timeout = min(timeout, remaining)
+        return timeout
+
+    def _invoke(self, prompt: str, generation_config: Optional[Dict], timeout: float, invoked: Optional[threading.Event] = None):
+        if invoked is not None:
+            invoked.set()
+        started = time.monotonic()
+        kwargs = {"request_options": {"timeout": timeout}}
+        if generation_config:
+            kwargs["generation_config"] = generation_config
+        increment("llm_attempts_total", model=self.model_name)
+        response = self.model.generate_content(prompt, **kwargs)
+        text = response.text
+        latency = time.monotonic() - started
+        # ヘッジや再試行で送った分も、課金されるトークンとして数える
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            increment("llm_input_tokens_total", getattr(usage, "prompt_token_count", 0) or 0, model=self.model_name)
+            increment("llm_output_tokens_total", getattr(usage, "candidates_token_count", 0) or 0, model=self.model_name)
+        with self._lock:
+            self._latencies.append(latency)
+        return text
+
+    def _attempt(self, prompt: str, generation_config: Optional[Dict], timeout: float, rate_limiter) -> str:
+        """
+        1回分のリクエストを送る。しきい値を過ぎても返らない場合は、同じリクエストをもう1つ送り、先に成功した方を返す。
+        タイムアウトは共有のスレッドプールのキューで待った時間を含めず、リクエストを送り始めてから数える。
+        戻る時点でまだ始まっていないリクエストは取り消し、呼び出し元が諦めた後にモデルを呼び出さない。
+        """
+        self._count("attempts")
+        invoked = threading.Event()
+        primary = _executor.submit(self._invoke, prompt, generation_config, timeout, invoked)
+        futures = [primary]
+        try:
+            queue_timeout = None if _run_deadline is None else max(0.0, _run_deadline - time.time())
+            if not invoked.wait(queue_timeout):
+                raise LLMDeadlineExceeded("実行全体の期限までにLLMへのリクエストを開始できませんでした")
+            started = time.monotonic()
+
+            threshold = self.hedge_threshold()
+            if threshold is not None and threshold < timeout:
+                done, _ = wait(futures, timeout=threshold)
+                if not done:
+                    if rate_limiter is not None:
+                        rate_limiter.acquire(estimate_tokens(prompt))
+                    self._count("hedges")
+                    futures.append(_executor.submit(self._invoke, prompt, generation_config, timeout))
+
+            pending = set(futures)
+            error = None
+            while pending:
+                remaining = timeout - (time.monotonic() - started)
+                done, pending = wait(pending, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise LLMTimeoutError(f"LLMへのリクエストが{timeout:.1f}秒以内に完了しませんでした")
+                for future in done:
+                    if future.exception() is None:
+                        if future is not primary:
+                            self._count("hedge_wins")
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def generate_text(
+        self,
+        prompt: str,
+        generation_config: Optional[Dict] = None,
+        rate_limiter: Optional[RateLimiter] = GEMINI_RATE_LIMITER,
+    ) -> str:
+        """
+        プロンプトを送り、レスポンスの本文を返す。429・5xx・タイムアウトは、実行全体の期限内で再試行する。
+
+        Raises:
+            LLMDeadlineExceeded: 実行全体の期限を過ぎた場合。
+            Exception: 再試行しても成功しなかった場合は、最後のエラーをそのまま送出する。
+        """
+        self._count("requests")
+        started = time.perf_counter()
+        status = "error"
+        try:
+            for attempt in range(self.max_retries + 1):
+                timeout = self._call_timeout()
+                if rate_limiter is not None:
+                    rate_limiter.acquire(estimate_tokens(prompt))
+                try:
+                    text = self._attempt(prompt, generation_config, timeout, rate_limiter)
+                    status = "ok"
+                    return text
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        self._count("failures")
+                        raise
+                    delay = self._rng.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                    if _run_deadline is not None and time.time() + delay >= _run_deadline:
+                        self._count("failures")
+                        raise
+                    print(f"  - LLMへのリクエストが失敗したため、{delay:.1f}秒後に再試行します "
+                          f"({attempt + 1}/{self.max_retries}): {e}")
+                    self._count("retries")
+                    increment("llm_retries_total", model=self.model_name)
+                    time.sleep(delay)
+        finally:
+            increment("llm_requests_total", model=self.model_name, status=status)
+            increment("llm_seconds_total", time.perf_counter() - started, model=self.model_name)
+
+    def generate_json(
+        self,
+        prompt: str,
+        schema: Optional[Dict] = None,
+        temperature: Optional[float] = None,
+        rate_limiter: Optional[RateLimiter] = GEMINI_RATE_LIMITER,
+    ) -> Any:
+        """
+        JSONモードでプロンプトを送り、解析済みの値を返す。
+        schemaを指定した場合は、モデルにスキーマどおりの出力を指示し、最上位の型と必須キーを確認する。
+
+        Args:
+            prompt (str): プロンプト。
+            schema (Dict, optional): レスポンスのスキーマ（OpenAPI形式のサブセット）。
+            temperature (float, optional): 生成時のtemperature。指定しない場合はモデルの既定値を使う。
+            rate_limiter (RateLimiter, optional): リクエスト前に枠を取得するレートリミッター。
+
+        Raises:
+            LLMResponseError: レスポンスがJSONとして解析できない、またはスキーマを満たさない場合。
+        """
+        generation_config = {"response_mime_type": "application/json"}
+        if schema is not None:
+            generation_config["response_schema"] = schema
+        if temperature is not None:
+            generation_config["temperature"] = temperature
+        value = parse_json_response(self.generate_text(prompt, generation_config, rate_limiter))
+        if schema is not None:
+            check_schema(value, schema)
+        return value
+
+
+def get_gateway(model=None) -> Optional[LLMGateway]:
+    """
+    モデルに対応するゲートウェイを返す。同じモデルには同じゲートウェイ（レイテンシの統計を含む）を使い回す。
+    modelを指定しない場合は、プロセス内で1つだけ作成するGeminiモデルを共有する。
+    APIキーが未設定の場合はNoneを返す。カセットの記録中はGeminiモデルへの呼び出しを記録し、
+    再生中はAPIキーがなくても、Geminiの代わりにカセットのレスポンスを返すモデルを使う。
+    """
+    global _default_gateway
+    with _lock:
+        if model is not None:
+            gateway = _gateways.get(model)
+            if gateway is None:
+                gateway = _gateways[model] = LLMGateway(model)
+            return gateway
+
+        if _default_gateway is None:
+            cassette = active_cassette()
+            if cassette is not None and cassette.replaying:
+                _default_gateway = LLMGateway(cassette.wrap_model(None))
+                return _default_gateway
+            if not GEMINI_API_KEY:
+                print("エラー: 環境変数 GEMINI_API_KEY が設定されていません。")
+                return None
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            _default_gateway = LLMGateway(_with_cassette(genai.GenerativeModel(MODEL_NAME)))
+        return _default_gateway
+
+
+def _with_cassette(model):
+    """カセットの記録中は、モデルへの呼び出しを記録するモデルで包む。"""
+    cassette = active_cassette()
+    if cassette is None or cassette.replaying:
+        return model
+    return cassette.wrap_model(model)
+
+
+def set_default_model(model) -> None:
+    """
+    modelを指定しない呼び出しで共有するモデルを差し替える。
+    偽モデルを使ったパイプライン全体の動作確認や、オフラインでの実行に使う。
+    Noneを指定した場合は、次の呼び出しで改めてGeminiモデル（カセットの再生中はカセット）を用意する。
+    """
+    global _default_gateway
+    with _lock:
+        _default_gateway = LLMGateway(_with_cassette(model)) if model is not None else None
+
+
+def default_gateway_stats() -> Optional[Dict]:
+    """共有のGeminiモデルのゲートウェイの統計を返す。まだ作成されていない場合はNone。"""
+    return _default_gateway.stats() if _default_gateway is not None else None
+
+
+def _run_self_check():
+    """偽モデルに遅延とエラーを注入し、再試行・期限・JSONの解析・ヘッジの動作を確認する。"""
+    from utils.fake_llm import FakeAPIError, FakeGenerativeModel
+
+    schema = {
+        "type": "object",
+        "properties": {"summary": {"type": "string"}, "tags": {"type": "array", "items": {"type": "string"}}},
+        "required": ["summary", "tags"],
+    }
+
+    # コードブロックや前置きの説明文が付いていても解析できる
+    assert parse_json_response('```json\n{"a": 1}\n```') == {"a": 1}
+    assert parse_json_response('以下が結果です。\n{"a": [1, 2]}\n以上です。') == {"a": [1, 2]}
+
+    # 429・503は再試行して成功する
+    model = FakeGenerativeModel(error_rate=0.5, seed=1)
+    gateway = LLMGateway(model, backoff_base=0.01, hedging=False)
+    for _ in range(20):
+        assert gateway.generate_json("要約してください", schema, rate_limiter=None)["tags"] == ["テスト"]
+    assert gateway.counters["retries"] == model.error_count > 0, (gateway.counters, model.error_count)
+
+    # 400などの再試行しないエラーは、そのまま送出する
+    gateway = LLMGateway(FakeGenerativeModel(error_rate=1.0, error_codes=(400,)), backoff_base=0.01, hedging=False)
+    try:
+        gateway.generate_text("x", rate_limiter=None)
+        raise AssertionError("400で例外が送出されませんでした")
+    except FakeAPIError as e:
+        assert e.code == 400 and gateway.counters["attempts"] == 1
+
+    # スキーマの必須キーが欠けている場合
+    gateway = LLMGateway(FakeGenerativeModel(responder=lambda p: '{"summary": "x"}'), hedging=False)
+    try:
+        gateway.generate_json("x", schema, rate_limiter=None)
+        raise AssertionError("必須キーの欠落が検出されませんでした")
+    except LLMResponseError:
+        pass
+
+    # 1回のタイムアウトは実行全体の期限までの残り時間に収まり、期限を過ぎるとリクエストを送らない
+    gateway = LLMGateway(FakeGenerativeModel(latency=0.5), max_retries=0, hedging=False)
+    set_run_deadline(time.time() + 0.1)
+    started = time.monotonic()
+    try:
+        gateway.generate_text("x", rate_limiter=None)
+        raise AssertionError("タイムアウトしませんでした")
+    except LLMTimeoutError:
+        assert time.monotonic() - started < 0.3
+    time.sleep(0.1)
+    try:
+        gateway.generate_text("x", rate_limiter=None)
+        raise AssertionError("期限切れが検出されませんでした")
+    except LLMDeadlineExceeded:
+        pass
+    set_run_deadline(None)
+
+    # スレッドプールのキューで待った時間はタイムアウトに数えず、期限までに始まらなかったリクエストは取り消す
+    global _executor
+    shared_executor = _executor
+    _executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        blocker = LLMGateway(FakeGenerativeModel(latency=0.5), max_retries=0, hedging=False)
+        blocked = [shared_executor.submit(blocker.generate_text, "x", rate_limiter=None) for _ in range(2)]
+        time.sleep(0.05)
+        model = FakeGenerativeModel(latency=0.1)
+        gateway = LLMGateway(model, max_retries=0, call_timeout=0.3, hedging=False)
+        assert gateway.generate_text("要約してください", rate_limiter=None)
+        for future in blocked:
+            future.result()
+        blocked = [shared_executor.submit(blocker.generate_text, "x", rate_limiter=None) for _ in range(2)]
+        time.sleep(0.05)
+        model = FakeGenerativeModel(latency=0.1)
+        gateway = LLMGateway(model, max_retries=0, hedging=False)
+        set_run_deadline(time.time() + 0.2)
+        try:
+            gateway.generate_text("x", rate_limiter=None)
+            raise AssertionError("期限切れが検出されませんでした")
+        except LLMDeadlineExceeded:
+            pass
+        set_run_deadline(None)
+        for future in blocked:
+            future.result()
+        time.sleep(0.2)
+        assert model.call_count == 0, model.call_count
+    finally:
+        _executor.shutdown()
+        _executor = shared_executor
+        set_run_deadline(None)
+
+    # 遅いリクエストはヘッジされ、先に返った方が使われる
+    model = FakeGenerativeModel(latency_sampler=lambda rng: 1.0 if rng.random() < 0.1 else 0.01, seed=3)
+    gateway = LLMGateway(model, hedge_min_samples=20)
+    for _ in range(100):
+        gateway.generate_text("x", rate_limiter=None)
+    assert gateway.counters["hedges"] > 0 and gateway.counters["hedge_wins"] > 0, gateway.counters
+    print("\n--- セルフチェック成功: 再試行・期限・JSONの解析・ヘッジを確認しました ---")
+
+
+def _run_benchmark():
+    """裾の重いレイテンシ分布と一時的なエラーを注入した偽モデルで、ヘッジの有無によるレイテンシの分布を比較する。"""
+    from utils.fake_llm import FakeGenerativeModel
+
+    def heavy_tail(rng: random.Random) -> float:
+        # 95%は20〜40ms、5%は0.5〜1.5秒かかる
+        return rng.uniform(0.5, 1.5) if rng.random() < 0.05 else rng.uniform(0.02, 0.04)
+
+    requests = 300
+    print("\n--- LLMゲートウェイ ベンチマーク結果 ---")
+    print(f"リクエスト数: {requests}, 5%のリクエストが0.5〜1.5秒, 2%が429/503で失敗")
+    for hedging in (False, True):
+        model = FakeGenerativeModel(latency_sampler=heavy_tail, error_rate=0.02, seed=7)
+        gateway = LLMGateway(model, hedging=hedging, backoff_base=0.05)
+        latencies = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            gateway.generate_text("x", rate_limiter=None)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        p50, p95, p99 = (latencies[int(len(latencies) * q)] for q in (0.5, 0.95, 0.99))
+        label = "ヘッジあり" if hedging else "ヘッジなし"
+        print(f"{label}: p50 {p50 * 1000:.0f}ms, p95 {p95 * 1000:.0f}ms, p99 {p99 * 1000:.0f}ms, "
+              f"平均 {sum(latencies) / len(latencies) * 1000:.0f}ms, モデル呼び出し {model.call_count}回 "
+              f"(再試行 {gateway.counters['retries']}回, ヘッジ {gateway.counters['hedges']}回)")
+
+
+if __name__ == '__main__':
+    if "--self-check" in sys.argv:
+        _run_self_check()
+        sys.exit(0)
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
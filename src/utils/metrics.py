@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+# --- 定数 ---
+# 計測の有効/無効。無効の場合、各フックは何もせずに戻り、ノードはラップせずにそのまま登録する
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# 実行の終わりに書き出すレポート（JSONとPrometheusのテキスト形式）とプロファイルの保存先
+METRICS_REPORT_DIR = os.environ.get("METRICS_REPORT_DIR", os.path.join(".cache", "metrics"))
+# ノードごとのプロファイラー。"cprofile" または "pyinstrument"（空文字列の場合はプロファイルしない）
+NODE_PROFILER = os.environ.get("NODE_PROFILER", "")
+
+METRIC_PREFIX = "policy_bot_"
+# Prometheusの # HELP に出力する説明
+METRIC_HELP = {
+    "node_calls_total": "グラフのノードの実行回数",
+    "node_errors_total": "例外で終了したノードの実行回数",
+    "node_seconds_total": "グラフのノードの実行時間の合計（秒）",
+    "node_seconds_max": "グラフのノードの1回の実行時間の最大値（秒）",
+    "llm_requests_total": "LLMへのリクエスト数（再試行はまとめて1件）",
+    "llm_attempts_total": "LLMへの実際の送信回数（再試行とヘッジを含む）",
+    "llm_retries_total": "LLMへのリクエストの再試行回数",
+    "llm_seconds_total": "LLMへのリクエストの所要時間の合計（秒、再試行の待ちを含む）",
+    "llm_input_tokens_total": "LLMの入力トークン数",
+    "llm_output_tokens_total": "LLMの出力トークン数",
+    "llm_cache_lookups_total": "LLMレスポンスのキャッシュの参照回数",
+    "github_requests_total": "GitHub APIへのリクエスト数",
+    "github_seconds_total": "GitHub APIへのリクエストの所要時間の合計（秒）",
+    "rate_limit_waits_total": "レートリミッターで待たされた回数",
+    "rate_limit_wait_seconds_total": "レートリミッターで待たされた時間の合計（秒）",
+    "webhook_deliveries_total": "Webhookの配信の受信数（受付・無視・重複・拒否・503で押し戻した件数）",
+    "outbox_threads_total": "アウトボックスのスレッドの投稿の試行結果（投稿・再試行・失敗・投稿済みのため省略）",
+    "outbox_posts_total": "アウトボックスから投稿したツイート数",
+}
+
+
+class MetricsRegistry:
+    """
+    ラベル付きのカウンター（合計値）と最大値を集計する、スレッドセーフなレジストリ。
+    キーは (メトリクス名, ラベルの組) で、値は実行の間ずっと積み上げる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, float] = {}
+        self._maxima: Dict[tuple, float] = {}
+        self.started_at = datetime.now(timezone.utc)
+
+    def increment(self, name: str, value: float = 1.0, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe_max(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if value > self._maxima.get(key, float("-inf")):
+                self._maxima[key] = value
+
+    def samples(self) -> list:
+        """全てのメトリクスを {"name", "type", "labels", "value"} のリストで返す。"""
+        with self._lock:
+            counters = dict(self._counters)
+            maxima = dict(self._maxima)
+        samples = [{"name": name, "type": "counter", "labels": dict(labels), "value": value}
+                   for (name, labels), value in counters.items()]
+        samples += [{"name": name, "type": "gauge", "labels": dict(labels), "value": value}
+                    for (name, labels), value in maxima.items()]
+        return sorted(samples, key=lambda s: (s["name"], sorted(s["labels"].items())))
+
+    def total(self, name: str, **labels) -> float:
+        """ラベルが一致するサンプルの合計値を返す（指定しなかったラベルはまとめて合計する）。"""
+        return sum(s["value"] for s in self.samples()
+                   if s["name"] == name and all(s["labels"].get(k) == v for k, v in labels.items()))
+
+    def summary(self) -> Dict:
+        """ノードごとの所要時間と、LLM・GitHub・キャッシュ・レートリミットの合計をまとめる。"""
+        samples = self.samples()
+        nodes: Dict[str, Dict] = {}
+        for s in samples:
+            if s["name"].startswith("node_"):
+                node = nodes.setdefault(s["labels"]["node"], {"calls": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0})
+                field = {"node_calls_total": "calls", "node_errors_total": "errors",
+                         "node_seconds_total": "seconds", "node_seconds_max": "max_seconds"}[s["name"]]
+                node[field] += s["value"]
+        return {
+            "elapsed_seconds": (datetime.now(timezone.utc) - self.started_at).total_seconds(),
+            "nodes": dict(sorted(nodes.items(), key=lambda item: -item[1]["seconds"])),
+            "llm": {
+                "requests": self.total("llm_requests_total"),
+                "failed_requests": self.total("llm_requests_total", status="error"),
+                "attempts": self.total("llm_attempts_total"),
+                "retries": self.total("llm_retries_total"),
+                "seconds": self.total("llm_seconds_total"),
+                "input_tokens": self.total("llm_input_tokens_total"),
+                "output_tokens": self.total("llm_output_tokens_total"),
+            },
+            "llm_cache": {"hits": self.total("llm_cache_lookups_total", result="hit"),
+                          "misses": self.total("llm_cache_lookups_total", result="miss")},
+            "github": {"requests": self.total("github_requests_total"), "seconds": self.total("github_seconds_total")},
+            "rate_limit_wait_seconds": self.total("rate_limit_wait_seconds_total"),
+        }
+
+    def to_json(self) -> Dict:
+        return {
+            "started_at": self.started_at.isoformat(),
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "summary": self.summary(),
+            "metrics": self.samples(),
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheusのテキスト形式（node_exporterのtextfileコレクターなどで読み込める形式）で返す。"""
+        lines = []
+        current = None
+        for s in self.samples():
+            name = METRIC_PREFIX + s["name"]
+            if name != current:
+                current = name
+                if s["name"] in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[s['name']]}")
+                lines.append(f"# TYPE {name} {s['type']}")
+            labels = ",".join(f'{k}="{_escape_label(str(v))}"' for k, v in sorted(s["labels"].items()))
+            lines.append(f"{name}{{{labels}}} {s['value']:.6g}" if labels else f"{name} {s['value']:.6g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_registry: Optional[MetricsRegistry] = MetricsRegistry() if METRICS_ENABLED else None
+_node_profiler = NODE_PROFILER
+_profile_counter = 0
+_profile_lock = threading.Lock()
+
+
+def set_metrics_enabled(enabled: bool) -> None:
+    """計測の有効/無効を切り替える。有効にした場合は、新しいレジストリで計測を始める。"""
+    global _registry
+    _registry = MetricsRegistry() if enabled else None
+
+
+def set_node_profiler(profiler: str) -> None:
+    """ノードごとのプロファイラーを設定する（--profile-nodes 用）。グラフを構築する前に呼び出す。"""
+    global _node_profiler
+    _node_profiler = profiler or ""
+
+
+def get_metrics() -> Optional[MetricsRegistry]:
+    """現在のレジストリを返す。計測が無効な場合はNoneを返す。"""
+    return _registry
+
+
+def increment(name: str, value: float = 1.0, **labels) -> None:
+    """カウンターを加算する。計測が無効な場合は何もしない。"""
+    if _registry is not None:
+        _registry.increment(name, value, **labels)
+
+
+@contextmanager
+def track_request(kind: str, **labels):
+    """
+    外部へのリクエスト1回分の件数（成功/失敗）と所要時間を記録する。
+    kindは "github" などで、"<kind>_requests_total" と "<kind>_seconds_total" に記録する。
+    """
+    if _registry is None:
+        yield
+        return
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _registry.increment(f"{kind}_requests_total", status=status, **labels)
+        _registry.increment(f"{kind}_seconds_total", time.perf_counter() - started, **labels)
+
+
+def _profile_path(node: str, extension: str) -> str:
+    global _profile_counter
+    with _profile_lock:
+        _profile_counter += 1
+        index = _profile_counter
+    directory = os.path.join(METRICS_REPORT_DIR, "profiles")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{os.getpid()}-{index:03d}-{node}.{extension}")
+
+
+def _run_profiled(node: str, function: Callable, state):
+    """プロファイラーを有効にしてノードを実行し、結果をファイルに保存する。"""
+    if _node_profiler == "pyinstrument":
+        # 任意の依存関係のため、使う場合だけインポートする
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return function(state)
+        finally:
+            profiler.stop()
+            path = _profile_path(node, "html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            print(f"  - プロファイルを保存しました: {path}")
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(state)
+    finally:
+        profiler.disable()
+        path = _profile_path(node, "prof")
+        profiler.dump_stats(path)
+        print(f"  - プロファイルを保存しました: {path} (python -m pstats で表示できます)")
+
+
+def instrument_node(node: str, function: Callable) -> Callable:
+    """
+    グラフのノード関数をラップし、実行時間と例外の有無を記録する（プロファイラーが設定されていればプロファイルも取る）。
+    計測もプロファイルも無効な場合は、ノード関数をそのまま返すため、オーバーヘッドはない。
+    """
+    if _registry is None and not _node_profiler:
+        return function
+
+    def wrapper(state):
+        registry = _registry
+        started = time.perf_counter()
+        try:
+            if _node_profiler:
+                return _run_profiled(node, function, state)
+            return function(state)
+        except BaseException:
+            if registry is not None:
+                registry.increment("node_errors_total", node=node)
+            raise
+        finally:
+            if registry is not None:
+                elapsed = time.perf_counter() - started
+                registry.increment("node_calls_total", node=node)
+                registry.increment("node_seconds_total", elapsed, node=node)
+                registry.observe_max("node_seconds_max", elapsed, node=node)
+
+    wrapper.__name__ = getattr(function, "__name__", node)
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+
+def write_report(run_name: str, directory: str = METRICS_REPORT_DIR) -> Optional[Dict]:
+    """
+    現在の計測結果を、JSONとPrometheusのテキスト形式でファイルに書き出す。
+
+    Returns:
+        Dict: 書き出したファイルのパス ("json", "prometheus") と集計 ("summary")。計測が無効な場合はNone。
+    """
+    if _registry is None:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, run_name)
+    report = _registry.to_json()
+    try:
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        with open(f"{base}.prom", "w", encoding="utf-8") as f:
+            f.write(_registry.to_prometheus())
+    except OSError as e:
+        print(f"エラー: 計測結果を書き出せませんでした: {e}")
+        return None
+    return {"json": f"{base}.json", "prometheus": f"{base}.prom", "summary": report["summary"]}
+
+
+def _run_benchmark():
+    """ノード1回あたりの計測のオーバーヘッドを、計測の有効・無効で比較する。"""
+    iterations = 200_000
+
+    def node(state):
+        return {"value": state["value"] + 1}
+
+    def measure(function) -> float:
+        state = {"value": 0}
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function(state)
+        return (time.perf_counter() - started) / iterations * 1e9
+
+    baseline = measure(node)
+    set_metrics_enabled(False)
+    disabled_node = instrument_node("benchmark", node)
+    disabled = measure(disabled_node)
+    disabled_hook = measure(lambda state: increment("llm_cache_lookups_total", result="hit"))
+    set_metrics_enabled(True)
+    enabled = measure(instrument_node("benchmark", node))
+    enabled_hook = measure(lambda state: increment("llm_cache_lookups_total", result="hit"))
+
+    print("\n--- 計測のオーバーヘッド ---")
+    print(f"ラップなしのノード: {baseline:.0f}ns/回")
+    print(f"計測無効: ノード {disabled:.0f}ns/回 (ラップなし: {disabled_node is node}), フック {disabled_hook:.0f}ns/回")
+    print(f"計測有効: ノード {enabled:.0f}ns/回 (+{enabled - baseline:.0f}ns), フック {enabled_hook:.0f}ns/回")
+    print("LLMやGitHubへのリクエスト（数百ms〜数秒）と比べて無視できる大きさです。")
+
+
+if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+from utils.metrics import increment
+
+# --- 定数 ---
+# Gemini APIの既定のレートリミット（環境変数で上書き可能）
+GEMINI_REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "60"))
+GEMINI_TOKENS_PER_MINUTE = float(os.environ.get("GEMINI_TOKENS_PER_MINUTE", "1000000"))
+# GitHub APIの既定のレートリミット（Search APIは認証済みで毎分30リクエスト）
+GITHUB_REQUESTS_PER_MINUTE = float(os.environ.get("GITHUB_REQUESTS_PER_MINUTE", "30"))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    テキストのおおよそのトークン数を見積もる。
+    ASCII文字は約4文字で1トークン、日本語などの非ASCII文字は1文字で約1トークンとして概算する。
+
+    Args:
+        text (str): 見積もり対象のテキスト。
+
+    Returns:
+        int: 推定トークン数（最低1）。
+    """
+    if not text:
+        return 1
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    other_chars = len(text) - ascii_chars
+    return max(1, ascii_chars // 4 + other_chars)
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット。
+    capacity分まで貯められ、毎秒refill_per_second分だけ補充される。
+    nameを指定した場合は、待たされた回数と時間を計測に記録する。
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float, name: str = ""):
+        self.name = name
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_per_second)
+        self._last_refill = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """
+        指定量のトークンを取得できるまで待機する。
+
+        Args:
+            amount (float): 消費するトークン量。capacityを超える場合はcapacityに丸める。
+
+        Returns:
+            float: 待機に要した秒数。
+        """
+        # capacityを超える要求は永遠に満たせないため、満杯のバケットを丸ごと消費させる
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    break
+                wait_seconds = (amount - self._tokens) / self.refill_per_second
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+        if waited > 0 and self.name:
+            increment("rate_limit_waits_total", limiter=self.name)
+            increment("rate_limit_wait_seconds_total", waited, limiter=self.name)
+        return waited
+
+
+
+class RateLimiter:
+    """
+    リクエスト数/分 と トークン数/分 の2つのトークンバケットを組み合わせたレートリミッター。
+    複数スレッドから共有して使用する。
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, name: str = ""):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0, name=f"{name}_requests" if name else "")
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0, name=f"{name}_tokens" if name else "")
+
+    def acquire(self, token_count: int = 1) -> float:
+        """
+        1リクエスト分の枠と、token_count分のトークン枠を取得するまで待機する。
+
+        Args:
+            token_count (int): このリクエストで消費する見込みのトークン数。
+
+        Returns:
+            float: 待機に要した秒数の合計。
+        """
+        waited = self.requests.acquire(1)
+        waited += self.tokens.acquire(token_count)
+        return waited
+
+
+# 全エージェントで共有するGemini API用のレートリミッター
+GEMINI_RATE_LIMITER = RateLimiter(GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE, name="gemini")
+# 全エージェントで共有するGitHub API用のレートリミッター（1リクエストにつき1つ取得する）
+GITHUB_RATE_LIMITER = TokenBucket(GITHUB_REQUESTS_PER_MINUTE, GITHUB_REQUESTS_PER_MINUTE / 60.0, name="github")
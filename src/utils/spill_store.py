@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+# --- 定数 ---
+# "1" を指定すると、PRの本文と差分をディスクに書き出し、グラフの状態には参照だけを持つ（ストリーミングモード）
+PIPELINE_STREAMING = os.environ.get("PIPELINE_STREAMING", "0") == "1"
+# 本文と差分を書き出すJSONLファイルの置き場所。実行（対象日）ごとに1ファイル
+SPILL_DIR = os.environ.get("PIPELINE_SPILL_DIR", os.path.join(".cache", "spill"))
+# ストリーミングモードで、要約などのために一度に本文を読み込むPRの数
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", "200"))
+# 同時に開いておくスピルストアのファイル数。バックフィルで日数が多くてもファイル記述子を使い果たさないようにする
+SPILL_MAX_OPEN_FILES = int(os.environ.get("SPILL_MAX_OPEN_FILES", "32"))
+
+# ディスクに書き出すPRのフィールド。それ以外（番号・タイトル・URLなど）はグラフの状態に残す
+SPILLED_FIELDS = ("body", "diff")
+
+_streaming = PIPELINE_STREAMING
+
+
+def set_streaming(enabled: bool) -> None:
+    """ストリーミングモードの有効/無効を切り替える（--streaming 用）。"""
+    global _streaming
+    _streaming = enabled
+
+
+def is_streaming() -> bool:
+    return _streaming
+
+
+class SpillStore:
+    """
+    PRの本文と差分を1件1行で追記するJSONLファイル。
+    書き込んだ行の先頭のバイト位置を参照として返し、読み込みはその位置から1行だけを読む。
+    ファイルは追記するだけなので、参照は同じファイルを使い続ける限り（--resume を含む）有効。
+    """
+
+    def __init__(self, path: str, fresh: bool = False):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._open("w+b" if fresh else "a+b")
+
+    def _open(self, mode: str = "a+b") -> None:
+        self._file = open(self.path, mode)
+        self._file.seek(0, os.SEEK_END)
+        self._end = self._file.tell()
+        self._dirty = False
+
+    def put(self, fields: Dict) -> int:
+        """フィールドを1行として追記し、その行の先頭のバイト位置を返す。"""
+        line = json.dumps(fields, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._file is None:
+                self._open()
+            offset = self._end
+            self._file.seek(offset)
+            self._file.write(line)
+            self._end += len(line)
+            self._dirty = True
+        return offset
+
+    def get(self, offset: int) -> Dict:
+        """put が返した位置の行を読み込む。"""
+        with self._lock:
+            if self._file is None:
+                self._open()
+            if self._dirty:
+                self._file.flush()
+                self._dirty = False
+            self._file.seek(offset)
+            line = self._file.readline()
+        return json.loads(line)
+
+    def close(self) -> None:
+        """ファイルを閉じる。閉じた後に put や get を呼び出した場合は、開き直して続きから使う。"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# 最近使った順に並べ、SPILL_MAX_OPEN_FILES を超えたら最も古いストアのファイルを閉じる
+_stores: "OrderedDict[str, SpillStore]" = OrderedDict()
+_stores_lock = threading.Lock()
+
+
+def _store_path(name: str) -> str:
+    # 日付や "latest" 以外の名前（Webhookのバッチなど）もファイル名に使えるようにする
+    return os.path.join(SPILL_DIR, "".join(c if c.isalnum() or c in "-_" else "_" for c in name) + ".jsonl")
+
+
+def open_spill_store(name: str, fresh: bool = False) -> SpillStore:
+    """
+    名前ごとに1つのスピルストアを開く。同じプロセスの中では同じ名前に同じインスタンスを返す。
+    fresh=True の場合は、前回の実行の内容を破棄して空のファイルから始める（--resume しない新しい実行用）。
+    """
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is not None and not fresh:
+            _stores.move_to_end(name)
+            return store
+        if store is not None:
+            store.close()
+        store = _stores[name] = SpillStore(_store_path(name), fresh=fresh)
+        _stores.move_to_end(name)
+        for _, evicted in list(_stores.items())[:-SPILL_MAX_OPEN_FILES]:
+            evicted.close()
+        return store
+
+
+def remove_spill_store(name: str) -> None:
+    """スピルストアを閉じてファイルを削除する。再開できない（終了した）実行の後片付けに使う。"""
+    with _stores_lock:
+        store = _stores.pop(name, None)
+        if store is not None:
+            store.close()
+    path = _store_path(name)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"警告: スピルストアを削除できませんでした: {path}: {e}")
+
+
+def spill_pull_request(pr: Dict, store_name: str) -> Dict:
+    """
+    PRの本文と差分をスピルストアに書き出し、それらの代わりに "body_ref"（"<ストア名>:<位置>"）を持つPRを返す。
+    """
+    store = open_spill_store(store_name)
+    offset = store.put({field: pr[field] for field in SPILLED_FIELDS if field in pr})
+    compact = {key: value for key, value in pr.items() if key not in SPILLED_FIELDS}
+    compact["body_ref"] = f"{store_name}:{offset}"
+    return compact
+
+
+def _drain(items: List) -> Iterator:
+    """リストの要素を先頭から順に取り出し、取り出した要素はリストから取り除く。"""
+    items.reverse()
+    while items:
+        yield items.pop()
+
+
+def spill_pull_requests(pull_requests: Iterable[Dict], store_name: str) -> List[Dict]:
+    """
+    取得したPRを新しいスピルストアに書き出し、参照だけを持つPRのリストを返す。
+    リストを渡した場合は、書き出したPRから順に元のリストから取り除くため、全PRの本文を二重にメモリに持たない。
+    ジェネレーターを渡した場合は、本文を1件分しかメモリに持たない。
+    """
+    open_spill_store(store_name, fresh=True)
+    if isinstance(pull_requests, list):
+        pull_requests = _drain(pull_requests)
+    spilled = [spill_pull_request(pr, store_name) for pr in pull_requests]
+    if not spilled:
+        # 新しいPRがない実行はここで終わるため、空のファイルを残さない
+        remove_spill_store(store_name)
+    return spilled
+
+
+def load_spilled_fields(pr: Dict) -> Dict:
+    """PRの本文と差分を返す。スピルストアに書き出したPRは、その1行だけをディスクから読み込む。"""
+    ref = pr.get("body_ref")
+    if not ref:
+        return {field: pr[field] for field in SPILLED_FIELDS if field in pr}
+    store_name, offset = ref.rsplit(":", 1)
+    return open_spill_store(store_name).get(int(offset))
+
+
+def pull_request_body(pr: Dict) -> str:
+    """PRの本文を返す。スピルストアに書き出したPRも、書き出していないPRも同じように扱える。"""
+    return load_spilled_fields(pr).get("body") or ""
+
+
+def iter_chunks(items: Iterable, size: int) -> Iterator[List]:
+    """items を size 件ずつのリストに区切って順に返す。"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_benchmark():
+    """
+    合成PR（本文約4KB）100〜50000件で、取得直後から重複集約・要約・DB保存までのノードと、チェックポイントへの
+    状態のシリアライズを実行し、tracemalloc で計測したピークメモリを通常モードとストリーミングモードで比較する。
+    PRはGitHubのページングと同じく1件ずつ届くものとし、通常モードではリストに、ストリーミングモードではスピルストアに溜める。
+    """
+    import gc
+    import random
+    import tempfile
+    import time
+    import tracemalloc
+    import main
+    from agents.db_saver import UpdateStore
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    from utils.fake_llm import FakeGenerativeModel, use_offline_settings
+    # python -m で実行した場合、このモジュールは __main__ になるため、各ノードが使う utils.spill_store を操作する
+    from utils import spill_store
+
+    work_dir = tempfile.mkdtemp()
+    spill_store.SPILL_DIR = os.path.join(work_dir, "spill")
+    # 偽モデルに対する呼び出しなので、Gemini APIのレートリミットによる待ちは計測から除外する
+    use_offline_settings(FakeGenerativeModel())
+    serializer = JsonPlusSerializer()
+    words = ["教育", "科学技術", "子育て", "医療", "エネルギー", "行政", "デジタル", "経済", "支援", "制度", "予算", "地域"]
+
+    def fetched(count: int) -> Iterator[Dict]:
+        rng = random.Random(count)
+        for n in range(1, count + 1):
+            body = "### 政策概要\n" + "".join(f"* {rng.choice(words)}の{rng.choice(words)}を見直します。{i}\n" for i in range(60))
+            yield {"number": n, "title": f"政策提案 {n}", "url": f"https://github.com/team-mirai/policy/pull/{n}",
+                   "author": f"user{n % 500}", "body": body, "merged_at": "2025-07-16T09:00:00+00:00",
+                   "repo": "team-mirai/policy"}
+
+    results = []
+    original_stdout = sys.stdout
+    # 各エージェントのモジュールの読み込みを計測に含めないよう、少数のPRで一度実行しておく
+    sys.stdout = open(os.devnull, "w")
+    try:
+        warm_up = {"pull_requests": list(fetched(10))}
+        warm_up.update(main.deduplicator_node(warm_up))
+        main.summarizer_node(warm_up)
+    finally:
+        sys.stdout.close()
+        sys.stdout = original_stdout
+    for count in (100, 1_000, 10_000, 50_000):
+        row = {"count": count}
+        for streaming in (False, True):
+            spill_store.set_streaming(streaming)
+            store = UpdateStore(backend="sqlite", path=os.path.join(work_dir, f"updates-{count}-{streaming}.sqlite3"))
+            gc.collect()
+            tracemalloc.start()
+            started = time.perf_counter()
+            sys.stdout = open(os.devnull, "w")
+            try:
+                if streaming:
+                    pull_requests = spill_store.spill_pull_requests(fetched(count), f"benchmark-{count}")
+                else:
+                    pull_requests = list(fetched(count))
+                state = {"pull_requests": pull_requests}
+                state.update(main.deduplicator_node(state))
+                state.update(main.summarizer_node(state))
+                store.save_run(state["pull_requests"], state["summaries"])
+                checkpoint_bytes = len(serializer.dumps_typed(state)[1])
+            finally:
+                sys.stdout.close()
+                sys.stdout = original_stdout
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert len(state["summaries"]) == state["dedupe_stats"]["cluster_count"] and store.count("pull_requests") == count
+            row["streaming" if streaming else "in_memory"] = (peak, checkpoint_bytes, time.perf_counter() - started)
+            store.close()
+            del state, pull_requests
+        results.append(row)
+    spill_store.set_streaming(PIPELINE_STREAMING)
+
+    print("\n--- ストリーミングモード メモリベンチマーク結果 ---")
+    print("対象: 取得したPRの保持・重複集約・要約（偽モデル）・DB保存・チェックポイントへのシリアライズ, PR本文: 約4KB")
+    for row in results:
+        for label, key in (("通常", "in_memory"), ("ストリーミング", "streaming")):
+            peak, checkpoint_bytes, elapsed = row[key]
+            print(f"PR {row['count']:>6}件 {label:<7}: ピーク {peak / 2**20:7.1f}MB "
+                  f"(PR 1件あたり {peak / row['count'] / 1024:5.2f}KB), チェックポイント {checkpoint_bytes / 2**20:6.1f}MB, "
+                  f"{elapsed:.1f}秒")
+
+
+if __name__ == '__main__':
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
@@ -0,0 +1,109 @@
+import os
+import re
+import json
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+# --- 定数 ---
+# 同義語表の追加分（JSONファイル、{"別名": "正規のタグ"}）。組み込みの表を上書きする
+TAG_SYNONYMS_PATH = os.environ.get("TAG_SYNONYMS_PATH")
+
+# 組み込みの同義語表。キーと値はどちらも正規化（normalize_tag）済みの形で書く
+DEFAULT_TAG_SYNONYMS = {
+    "不登校支援": "不登校",
+    "不登校対策": "不登校",
+    "教育政策": "教育",
+    "教育改革": "教育",
+    "学校教育": "教育",
+    "科学技術政策": "科学技術",
+    "科学": "科学技術",
+    "研究開発": "科学技術",
+    "子育て支援": "子育て",
+    "子ども・子育て": "子育て",
+    "少子化対策": "子育て",
+    "医療政策": "医療",
+    "医療・介護": "医療",
+    "経済政策": "経済",
+    "経済成長": "経済",
+    "エネルギー政策": "エネルギー",
+    "デジタル化": "デジタル",
+    "dx": "デジタル",
+    "デジタル政策": "デジタル",
+    "行政": "行政改革",
+    "行政dx": "行政改革",
+}
+
+# 区切りとして扱う記号の揺れ（全角・半角の中黒やスラッシュ）
+_SEPARATOR_PATTERN = re.compile(r"[・･/／]+")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_tag(tag: str) -> str:
+    """
+    タグをUnicode正規化（NFKC）し、表記の揺れを吸収した形にする。
+    全角英数字は半角に、英字は小文字にそろえ、先頭の "#" と空白を取り除き、中黒・スラッシュは "・" にそろえる。
+    """
+    normalized = unicodedata.normalize("NFKC", tag).strip().lstrip("#").lower()
+    normalized = _WHITESPACE_PATTERN.sub("", normalized)
+    return _SEPARATOR_PATTERN.sub("・", normalized).strip("・")
+
+
+class TagCanonicalizer:
+    """
+    同義語表とUnicode正規化で、LLMが返す自由形式のタグを正規のタグにそろえる。
+    同義語表のキーも正規化してから引くため、全角・半角や大文字・小文字の違いは表に書かなくてよい。
+    """
+
+    def __init__(self, synonyms: Optional[Dict[str, str]] = None):
+        self._synonyms: Dict[str, str] = {}
+        self.add_synonyms(DEFAULT_TAG_SYNONYMS if synonyms is None else synonyms)
+
+    def add_synonyms(self, synonyms: Dict[str, str]) -> None:
+        """同義語を追加する。既存の同義語は上書きする。"""
+        for alias, canonical in synonyms.items():
+            self._synonyms[normalize_tag(alias)] = normalize_tag(canonical)
+
+    def canonicalize(self, tag: str) -> str:
+        """タグを正規のタグに変換する。空のタグは空文字列を返す。"""
+        normalized = normalize_tag(tag)
+        # 同義語をたどる（"a" -> "b" -> "c" のような連鎖も最後までたどる）
+        seen = set()
+        while normalized in self._synonyms and normalized not in seen:
+            seen.add(normalized)
+            normalized = self._synonyms[normalized]
+        return normalized
+
+    def canonicalize_all(self, tags: Iterable[str]) -> List[str]:
+        """タグのリストを正規化し、順序を保ったまま重複と空のタグを除く。"""
+        return [tag for tag in dict.fromkeys(self.canonicalize(t) for t in tags if isinstance(t, str)) if tag]
+
+
+_default_canonicalizer: Optional[TagCanonicalizer] = None
+_default_canonicalizer_lock = threading.Lock()
+
+
+def get_tag_canonicalizer() -> TagCanonicalizer:
+    """全エージェントで共有する変換器を返す。TAG_SYNONYMS_PATH が設定されている場合は、その同義語も読み込む。"""
+    global _default_canonicalizer
+    with _default_canonicalizer_lock:
+        if _default_canonicalizer is None:
+            canonicalizer = TagCanonicalizer()
+            if TAG_SYNONYMS_PATH:
+                try:
+                    with open(TAG_SYNONYMS_PATH, encoding="utf-8") as f:
+                        canonicalizer.add_synonyms(json.load(f))
+                except (OSError, ValueError) as e:
+                    print(f"エラー: タグの同義語表を読み込めませんでした: {e}")
+            _default_canonicalizer = canonicalizer
+    return _default_canonicalizer
+
+
+def canonicalize_tags(tags: Iterable[str]) -> List[str]:
+    """共有の変換器で、タグのリストを正規のタグにそろえる。"""
+    return get_tag_canonicalizer().canonicalize_all(tags)
+
+
+if __name__ == '__main__':
+    for sample in (["不登校支援", "不登校"], ["ＤＸ", "#デジタル化", "行政 DX"], ["子ども／子育て", "少子化対策"]):
+        print(f"{sample} -> {canonicalize_tags(sample)}")
@@ -0,0 +1,379 @@
+import os
+import sys
+import hmac
+import json
+import time
+import queue
+import signal
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from agents.github_monitor import pull_request_from_webhook_payload, pull_request_key
+from utils.metrics import increment
+
+# --- 定数 ---
+# GitHubのWebhookに設定したシークレット。未設定の場合はサーバーを起動しない
+WEBHOOK_SECRET = os.environ.get("GITHUB_WEBHOOK_SECRET")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+# 要約待ちのPRを溜めておける件数。超えた分は 503 を返し、GitHub側での再送を促す
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "100"))
+# 届いたPRを並行して要約するスレッド数
+WEBHOOK_SUMMARIZER_WORKERS = int(os.environ.get("WEBHOOK_SUMMARIZER_WORKERS", "2"))
+# 要約済みのPRがこの件数に達するか、最初のPRからこの秒数が過ぎたら、まとめて1つのスレッドとして投稿する
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", "10"))
+WEBHOOK_BATCH_WINDOW_SECONDS = float(os.environ.get("WEBHOOK_BATCH_WINDOW_SECONDS", "300"))
+# 受け付けるペイロードの上限（GitHubのWebhookのペイロードは最大25MB）
+WEBHOOK_MAX_BODY_BYTES = 25 * 1024 * 1024
+# 再送された同じPRを無視するために覚えておくPRの数
+SEEN_PULL_REQUESTS_LIMIT = 10000
+
+
+def verify_signature(secret: bytes, body: bytes, signature_header: Optional[str]) -> bool:
+    """X-Hub-Signature-256 ヘッダー（"sha256=" + HMAC-SHA256の16進表記）を、定数時間で比較して検証する。"""
+    if not signature_header or not signature_header.startswith("sha256="):
+        return False
+    expected = "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header)
+
+
+class WebhookDaemon:
+    """
+    GitHubの pull_request Webhookを受け付け、マージされたPRを届いた順に要約し、
+    一定の件数または時間ごとにまとめてツイート生成・評価・投稿に流す常駐プロセス。
+
+    受信 → 要約 → まとめての投稿 の各段の間は、上限付きのキューでつなぐ。投稿や要約が詰まると、
+    要約待ちのキューがあふれた時点で受信側が 503 を返すため、メモリを使い果たさずにバーストを受け流せる。
+
+    Args:
+        summarize (Callable[[Dict], List[Dict]]): PR 1件を受け取り、要約のリストを返す関数。
+        flush (Callable[[List[Dict], List[Dict], str], Dict]): PRと要約のリスト、バッチIDを受け取り、
+            ツイート生成から投稿までを実行して最終状態を返す関数。
+        secret (bytes): Webhookのシークレット。
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[Dict], List[Dict]],
+        flush: Callable[[List[Dict], List[Dict], str], Dict],
+        secret: bytes,
+        batch_size: int = WEBHOOK_BATCH_SIZE,
+        batch_window: float = WEBHOOK_BATCH_WINDOW_SECONDS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        workers: int = WEBHOOK_SUMMARIZER_WORKERS,
+    ):
+        self.summarize = summarize
+        self.flush = flush
+        self.secret = secret
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self.workers = max(1, workers)
+        self.incoming: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.ready: queue.Queue = queue.Queue(maxsize=max(queue_size, self.batch_size))
+        self._seen: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._batch_count = 0
+        self.stats = {"accepted": 0, "ignored": 0, "duplicates": 0, "rejected": 0, "throttled": 0,
+                      "summarized": 0, "batches": 0, "flushed_pull_requests": 0, "flush_errors": 0}
+        self.end_states: List[str] = []
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += amount
+
+    def snapshot(self) -> Dict:
+        """受信・要約・投稿の件数と、各キューに溜まっている件数を返す。"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["incoming_queue"] = self.incoming.qsize()
+        stats["ready_queue"] = self.ready.qsize()
+        return stats
+
+    # --- 受信 ---
+
+    def handle_delivery(self, headers: Mapping[str, str], body: bytes) -> Tuple[int, str]:
+        """
+        Webhookの配信1件を処理し、(HTTPステータス, メッセージ) を返す。
+        headers はヘッダー名の大文字・小文字を区別せずに引けるもの（http.server のヘッダー）を渡す。
+
+        - 署名が正しくない場合は 401。
+        - マージされたPR以外のイベントは 202 で受け取って無視する。
+        - 要約待ちのキューがいっぱいの場合は 503（GitHubから再送してもらう）。
+        """
+        if not verify_signature(self.secret, body, headers.get("X-Hub-Signature-256")):
+            self._count("rejected")
+            increment("webhook_deliveries_total", result="rejected")
+            return 401, "署名が正しくありません"
+        event = headers.get("X-GitHub-Event")
+        if event == "ping":
+            return 200, "pong"
+        try:
+            payload = json.loads(body.decode("utf-8"))
+        except ValueError:
+            self._count("rejected")
+            increment("webhook_deliveries_total", result="rejected")
+            return 400, "JSONとして解析できません"
+        pull_request = pull_request_from_webhook_payload(payload) if event == "pull_request" else None
+        if pull_request is None:
+            self._count("ignored")
+            increment("webhook_deliveries_total", result="ignored")
+            return 202, "対象外のイベントです"
+
+        with self._lock:
+            if pull_request_key(pull_request) in self._seen:
+                self.stats["duplicates"] += 1
+                increment("webhook_deliveries_total", result="duplicate")
+                return 202, "受付済みのPRです"
+            try:
+                self.incoming.put_nowait(pull_request)
+            except queue.Full:
+                self.stats["throttled"] += 1
+                increment("webhook_deliveries_total", result="throttled")
+                return 503, "処理待ちのPRが多いため、後で再送してください"
+            self._seen[pull_request_key(pull_request)] = True
+            if len(self._seen) > SEEN_PULL_REQUESTS_LIMIT:
+                self._seen.popitem(last=False)
+            self.stats["accepted"] += 1
+        increment("webhook_deliveries_total", result="accepted")
+        print(f"  - Webhook: PR #{pull_request['number']} {pull_request['title']} を受け付けました")
+        return 202, "受け付けました"
+
+    # --- 要約 ---
+
+    def _summarize_loop(self) -> None:
+        while True:
+            pull_request = self.incoming.get()
+            if pull_request is None:
+                return
+            try:
+                summaries = self.summarize(pull_request)
+            except Exception as e:
+                print(f"エラー: PR #{pull_request['number']} の要約中にエラーが発生しました: {e}")
+                summaries = []
+            self._count("summarized")
+            # 投稿側が詰まっている場合はここで待ち、要約待ちのキューを通じて受信側に背圧をかける
+            self.ready.put((pull_request, summaries))
+
+    # --- まとめての投稿 ---
+
+    def _flush_batch(self, batch: List[Tuple[Dict, List[Dict]]]) -> None:
+        self._batch_count += 1
+        batch_id = f"webhook:{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{self._batch_count}"
+        pull_requests = [pr for pr, _ in batch]
+        summaries = [summary for _, pr_summaries in batch for summary in pr_summaries]
+        print(f"\n--- Webhook: {len(pull_requests)}件のPRをまとめて投稿に流します ({batch_id}) ---")
+        try:
+            final_state = self.flush(pull_requests, summaries, batch_id)
+            with self._lock:
+                self.end_states.append(final_state.get("end_state") or "")
+        except Exception as e:
+            print(f"エラー: バッチ {batch_id} の処理中にエラーが発生しました: {e}")
+            self._count("flush_errors")
+        self._count("batches")
+        self._count("flushed_pull_requests", len(pull_requests))
+
+    def _flush_loop(self) -> None:
+        batch: List[Tuple[Dict, List[Dict]]] = []
+        first_at = 0.0
+        stopping = False
+        while not stopping:
+            timeout = None if not batch else max(0.0, first_at + self.batch_window - time.monotonic())
+            try:
+                item = self.ready.get(timeout=timeout)
+                if item is None:
+                    stopping = True
+                else:
+                    if not batch:
+                        first_at = time.monotonic()
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            # 件数に達したか、最初のPRから一定時間が過ぎたか、停止する場合に投稿する
+            if batch and (stopping or len(batch) >= self.batch_size
+                          or time.monotonic() >= first_at + self.batch_window):
+                self._flush_batch(batch)
+                batch = []
+
+    # --- 起動と停止 ---
+
+    def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> int:
+        """HTTPサーバーと要約・投稿のスレッドを起動し、待ち受けているポート番号を返す。"""
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > WEBHOOK_MAX_BODY_BYTES:
+                    self._respond(413, "ペイロードが大きすぎます")
+                    return
+                status, message = daemon.handle_delivery(self.headers, self.rfile.read(length))
+                self._respond(status, message)
+
+            def do_GET(self):
+                if self.path == "/healthz":
+                    self._respond(200, daemon.snapshot())
+                else:
+                    self._respond(404, "見つかりません")
+
+            def _respond(self, status: int, message):
+                body = json.dumps({"status": status, "message": message}, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 503:
+                    self.send_header("Retry-After", "30")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # アクセスログは出力しない（受け付けたPRは handle_delivery で表示する）
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._threads = [threading.Thread(target=self._summarize_loop, name=f"webhook-summarizer-{i}")
+                         for i in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._flush_loop, name="webhook-flusher"))
+        self._threads.append(threading.Thread(target=self._server.serve_forever, name="webhook-http", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self._server.server_address[1]
+
+    def stop(self) -> None:
+        """受信を止め、受付済みのPRを全て要約・投稿してから終了する。"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for _ in range(self.workers):
+            self.incoming.put(None)
+        for thread in self._threads[:self.workers]:
+            thread.join()
+        self.ready.put(None)
+        self._threads[self.workers].join()
+
+
+def run_daemon(
+    summarize: Callable[[Dict], List[Dict]],
+    flush: Callable[[List[Dict], List[Dict], str], Dict],
+    host: str = WEBHOOK_HOST,
+    port: int = WEBHOOK_PORT,
+) -> None:
+    """Webhookの常駐プロセスを起動し、SIGINT/SIGTERMを受け取るまで待ち受ける。"""
+    if not WEBHOOK_SECRET:
+        print("エラー: 環境変数 GITHUB_WEBHOOK_SECRET が設定されていません。")
+        sys.exit(1)
+    daemon = WebhookDaemon(summarize, flush, WEBHOOK_SECRET.encode("utf-8"))
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    bound_port = daemon.start(host, port)
+    print(f"--- Webhookの待ち受けを開始しました: http://{host}:{bound_port}/ "
+          f"({daemon.batch_size}件または{daemon.batch_window:.0f}秒ごとに投稿) ---")
+    stop_event.wait()
+    print("--- 停止します。受付済みのPRを処理しています... ---")
+    daemon.stop()
+    print(f"--- Webhookの待ち受けを終了しました: {daemon.snapshot()} ---")
+
+
+def _deliver(port: int, secret: bytes, event: str, payload: Dict) -> int:
+    """GitHubと同じヘッダーと署名を付けてペイロードを送り、HTTPステータスを返す。"""
+    import urllib.error
+    import urllib.request
+
+    body = json.dumps(payload).encode("utf-8")
+    signature = "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/webhook", data=body, method="POST", headers={
+        "Content-Type": "application/json", "X-GitHub-Event": event, "X-Hub-Signature-256": signature,
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def _sample_payload(number: int, merged: bool = True) -> Dict:
+    """pull_request イベント（closed）のペイロードの見本。"""
+    return {"action": "closed", "repository": {"full_name": "team-mirai/policy"}, "pull_request": {
+        "number": number, "title": f"政策提案 {number}", "body": f"### 政策概要\n* 変更点 {number}",
+        "html_url": f"https://github.com/team-mirai/policy/pull/{number}", "merged": merged,
+        "merged_at": "2025-07-19T10:00:00Z" if merged else None, "user": {"login": "alice"}}}
+
+
+def _replay_deliveries(daemon: WebhookDaemon, port: int, secret: bytes, burst: int) -> int:
+    """
+    署名の誤り・対象外のイベント・バースト・再送を順に送り、全てのPRが投稿に流れるまで待つ。
+    バーストのうち 503 で押し戻された件数を返す。
+    """
+    assert _deliver(port, secret, "ping", {"zen": "test"}) == 200
+    assert _deliver(port, b"wrong-secret", "pull_request", _sample_payload(1)) == 401
+    assert _deliver(port, secret, "pull_request", _sample_payload(2, merged=False)) == 202
+
+    # あふれた分は 503 になるため、GitHubの再送の代わりに間を置いて送り直す
+    numbers = list(range(100, 100 + burst))
+    statuses = [_deliver(port, secret, "pull_request", _sample_payload(n)) for n in numbers]
+    throttled = statuses.count(503)
+    pending = [n for n, status in zip(numbers, statuses) if status == 503]
+    while pending:
+        time.sleep(0.1)
+        pending = [n for n in pending if _deliver(port, secret, "pull_request", _sample_payload(n)) == 503]
+    # 受付済みのPRの再送は無視する
+    assert _deliver(port, secret, "pull_request", _sample_payload(100)) == 202
+
+    deadline = time.time() + 30
+    while daemon.snapshot()["flushed_pull_requests"] < burst and time.time() < deadline:
+        time.sleep(0.1)
+    return throttled
+
+
+def _run_self_check():
+    """
+    偽モデルとローカルのHTTPクライアントで、署名の検証、対象外イベントの無視、バースト時の 503 と再送、
+    件数・時間によるまとめての投稿を、サーバーの外側から確認する。
+    """
+    import sqlite3
+    import tempfile
+    import main
+    from utils.fake_llm import FakeGenerativeModel, ScriptedResponder, use_offline_settings
+
+    # 要約に時間がかかる状況を再現し、バーストで要約待ちのキューをあふれさせる
+    use_offline_settings(FakeGenerativeModel(responder=ScriptedResponder(), latency=0.05))
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), "checkpoints.sqlite3")
+    secret = b"self-check-secret"
+    burst = 30
+    daemon = WebhookDaemon(
+        summarize=main.summarize_pull_request,
+        flush=lambda prs, summaries, batch_id: main.run_webhook_batch(
+            prs, summaries, batch_id, publish=False, checkpoint_path=checkpoint_path),
+        secret=secret, batch_size=5, batch_window=0.5, queue_size=4, workers=2,
+    )
+    port = daemon.start("127.0.0.1", 0)
+    try:
+        throttled = _replay_deliveries(daemon, port, secret, burst)
+    finally:
+        daemon.stop()
+
+    stats = daemon.snapshot()
+    print(f"\n統計: {stats}")
+    print(f"バースト{burst}件のうち 503 で押し戻した件数: {throttled}")
+    assert throttled > 0, "要約待ちのキューの上限が効いていません"
+    assert stats["accepted"] == burst and stats["flushed_pull_requests"] == burst, stats
+    assert stats["rejected"] == 1 and stats["ignored"] == 1 and stats["duplicates"] == 1, stats
+    assert stats["batches"] >= burst // daemon.batch_size and stats["flush_errors"] == 0, stats
+    assert all(state == main.END_STATE_APPROVED for state in daemon.end_states), daemon.end_states
+    # 終了したバッチのチェックポイントは残らない
+    with sqlite3.connect(checkpoint_path) as conn:
+        remaining = conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+    assert remaining == 0, remaining
+    print("--- セルフチェック成功: 署名検証・背圧・まとめての投稿を確認しました ---")
+
+
+if __name__ == '__main__':
+    if "--self-check" in sys.argv:
+        _run_self_check()
+        sys.exit(0)